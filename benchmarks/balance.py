@@ -0,0 +1,60 @@
+"""
+Benchmark of Balance.get_balances
+
+Measures the average cost of processing a transaction for portfolios with
+an increasing number of holdings. Since balances share all untouched
+holdings (copy-on-write) the per-transaction cost should stay flat.
+
+Usage: python -m benchmarks.balance
+"""
+
+import time
+from datetime import datetime, timedelta
+from inverno.balance import Balance
+from inverno.price import Currency, Price
+from inverno.transaction import Transaction, TransactionAction
+
+
+def _make_transactions(nb_holdings: int, nb_transactions: int):
+    start = datetime(2006, 1, 1)
+    transactions = [
+        Transaction(
+            action=TransactionAction.BUY,
+            date=start,
+            ticker=f"H{i}",
+            quantity=1.0,
+            price=Price(currency=Currency.USD, amount=10.0),
+        )
+        for i in range(nb_holdings)
+    ]
+    for i in range(nb_transactions):
+        transactions.append(
+            Transaction(
+                action=TransactionAction.BUY,
+                date=start + timedelta(days=1 + i),
+                ticker=f"H{i % nb_holdings}",
+                quantity=1.0,
+                price=Price(currency=Currency.USD, amount=10.0),
+            )
+        )
+    return transactions
+
+
+def main():
+    nb_transactions = 5000
+    print(f"{'holdings':>10} {'us/transaction':>16}")
+    for nb_holdings in [10, 100, 1000, 10000]:
+        transactions = _make_transactions(nb_holdings, nb_transactions)
+        initial = Balance.get_balances(transactions[:nb_holdings])
+        last = list(initial.values())[-1]
+
+        begin = time.perf_counter()
+        for trs in transactions[nb_holdings:]:
+            last = last.process_transaction(trs)
+        elapsed = time.perf_counter() - begin
+
+        print(f"{nb_holdings:>10} {elapsed / nb_transactions * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
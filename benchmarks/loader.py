@@ -0,0 +1,53 @@
+"""
+Benchmark of the standard transactions loader
+
+Parses a synthetic standard-format transactions file in bulk into columns,
+then builds the Transaction objects from the columns.
+
+Usage: python -m benchmarks.loader [NB_ROWS]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from inverno.columnar import TransactionColumns
+
+
+def _make_csv(nb_rows: int) -> str:
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2006-01-01", periods=nb_rows, freq="min")
+    tickers = np.array([f"H{i}" for i in range(2000)])
+    df = pd.DataFrame(
+        {
+            "date": dates.strftime("%d/%m/%y"),
+            "action": "buy",
+            "name": "",
+            "ticker": tickers[rng.integers(0, len(tickers), nb_rows)],
+            "isin": "",
+            "quantity": rng.integers(1, 100, nb_rows),
+            "price": [f"${p:,.2f}" for p in rng.uniform(1, 2000, nb_rows)],
+            "fees": "",
+            "amount": "",
+        }
+    )
+    return df.to_csv(index=False)
+
+
+def main():
+    nb_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    content = _make_csv(nb_rows)
+
+    begin = time.perf_counter()
+    columns = TransactionColumns.from_standard_csv(content)
+    elapsed = time.perf_counter() - begin
+    print(f"columns:      {nb_rows} rows in {elapsed:.2f}s")
+
+    begin = time.perf_counter()
+    columns.to_transactions()
+    elapsed = time.perf_counter() - begin
+    print(f"transactions: {nb_rows} rows in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Memory benchmark of transactions
+
+Measures the memory used per transaction by the Transaction objects built
+from a synthetic history (see benchmarks.loader), and the time taken to
+compute the ending balance from them.
+
+Usage: python -m benchmarks.memory [NB_ROWS]
+"""
+
+import sys
+import gc
+import time
+import tracemalloc
+from inverno.balance import Balance
+from inverno.columnar import TransactionColumns
+from .loader import _make_csv
+
+
+def main():
+    nb_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    columns = TransactionColumns.from_standard_csv(_make_csv(nb_rows))
+
+    gc.collect()
+    tracemalloc.start()
+    transactions = columns.to_transactions()
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"transactions: {used / nb_rows:.0f} bytes/transaction")
+
+    begin = time.perf_counter()
+    Balance(date=transactions[0].date).process_transactions(transactions)
+    elapsed = time.perf_counter() - begin
+    print(f"balance:      {nb_rows} transactions in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,208 @@
-from typing import Dict, List, Iterable, Optional
-from collections import defaultdict
+from typing import Dict, List, Iterable, Optional, Union
 import pandas as pd
 import numpy as np
 from .transaction import TransactionAction, Transaction
+from .positions import Positions
 from .balance import Balance
 from .price import Price, Currency
+from .registry import HoldingRegistry
+
+# Maximum number of intermediate products computed at once by AttrsWeights
+DOT_BLOCK_SIZE = 1 << 20
+
+
+class AttrsWeights:
+    """
+    Sparse (holdings x values) matrix containing the weights of several
+    attributes stacked side by side. Each attribute has a column for each of
+    its values, followed by an "unknown" column with the portion of each
+    holding that is not allocated to any value.
+    Weights are stored in coordinate format (row, column, weight).
+    """
+
+    def __init__(
+        self,
+        registry: HoldingRegistry,
+        attrs_weights: Dict[str, Dict[str, Dict[str, float]]],
+    ):
+        rows, cols, weights = [], [], []
+
+        # Columns labels and position of each attribute
+        self.columns: Dict[str, List[str]] = {}
+        self.slices: Dict[str, slice] = {}
+        self.ncols = 0
+
+        for attr, attr_weights in attrs_weights.items():
+            allocated = np.zeros(len(registry), dtype=np.float64)
+
+            for col, values in enumerate(attr_weights.values(), start=self.ncols):
+                for holding_key, portion in values.items():
+                    row = registry.get_id(holding_key)
+                    if row is None:
+                        continue
+                    rows.append(row)
+                    cols.append(col)
+                    weights.append(portion)
+                    allocated[row] += portion
+
+            # Floating point operations can lack of precision
+            # so we should be slightly tollerant
+            eps = 0.00001
+
+            exceeding = np.flatnonzero(allocated > 1 + eps)
+            if len(exceeding) > 0:
+                raise ValueError(
+                    f'Attribute "{attr}" has more than 100% '
+                    f"allocation for {registry.get_key(exceeding[0])}"
+                )
+
+            # Unknown portion
+            unknown_col = self.ncols + len(attr_weights)
+            for row in np.flatnonzero(allocated <= 1 - eps):
+                rows.append(row)
+                cols.append(unknown_col)
+                weights.append(1 - allocated[row])
+
+            self.columns[attr] = list(attr_weights) + ["unknown"]
+            self.slices[attr] = slice(self.ncols, unknown_col + 1)
+            self.ncols = unknown_col + 1
+
+        # Sort by column, so that each column's weights are contiguous
+        order = np.argsort(np.array(cols, dtype=np.int64), kind="stable")
+        self.rows = np.array(rows, dtype=np.int64)[order]
+        self.cols = np.array(cols, dtype=np.int64)[order]
+        self.weights = np.array(weights, dtype=np.float64)[order]
+
+    def dot(self, matrix: np.ndarray) -> np.ndarray:
+        """ Multiplies a (days x holdings) matrix by the weights """
+        res = np.zeros((matrix.shape[0], self.ncols), dtype=np.float64)
+        if self.cols.size == 0:
+            return res
+
+        # Weights are processed in chunks, so that the products of a chunk
+        # take at most DOT_BLOCK_SIZE values
+        chunk = max(DOT_BLOCK_SIZE // max(matrix.shape[0], 1), 1)
+        for begin in range(0, self.cols.size, chunk):
+            rows = self.rows[begin : begin + chunk]
+            cols = self.cols[begin : begin + chunk]
+            products = matrix[:, rows] * self.weights[begin : begin + chunk]
+            # A column split between two chunks is summed up in two steps
+            starts = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]])
+            res[:, cols[starts]] += np.add.reduceat(products, starts, axis=1)
+        return res
+
+    def split(
+        self, matrix: np.ndarray, index: pd.DatetimeIndex
+    ) -> Dict[str, pd.DataFrame]:
+        """ Splits a (days x values) matrix in one dataframe per attribute """
+        return {
+            attr: pd.DataFrame(
+                matrix[:, self.slices[attr]], index=index, columns=columns
+            )
+            for attr, columns in self.columns.items()
+        }
 
 
 class Analysis:
+    """
+    Analysis of a portfolio given holdings' daily prices.
+
+    Conversion rates (conv_rates) give, for each currency name, how much of
+    that currency one unit of the destination currency is worth. They can be
+    either fixed (a dict) or daily (a days x currencies dataframe, the rates
+    of the closest previous day are used for days which are not in it).
+
+    Holdings are identified internally by their ID in the registry, which
+    must follow the order of the prices columns (a registry of the prices
+    columns is used if none is given).
+    """
+
     def __init__(
         self,
         prices: pd.DataFrame,
-        conv_rates: Dict[str, float],
+        conv_rates: Union[Dict[str, float], pd.DataFrame],
         holdings_currencies: Dict[str, Currency],
+        registry: Optional[HoldingRegistry] = None,
     ):
+        if registry is None:
+            registry = HoldingRegistry(prices.columns)
+        elif registry.keys != list(prices.columns):
+            raise ValueError("Prices columns don't follow the holdings registry")
+
         self.prices = prices
         self.conv_rates = conv_rates
         self.holdings_currencies = holdings_currencies
-        self.holdings_keys = list(self.prices.columns)
+        self.registry = registry
+        self.holdings_keys = registry.keys
+
+        if isinstance(conv_rates, pd.DataFrame):
+            rates = conv_rates.sort_index()
+        else:
+            rates = pd.DataFrame(
+                [conv_rates], index=pd.DatetimeIndex([pd.Timestamp.min])
+            )
+        self._rates_index = pd.DatetimeIndex(rates.index)
+        self._rates_values = rates.values.astype(np.float64)
+        self._rates_cols = {name: col for col, name in enumerate(rates.columns)}
+
+    def _get_rates_cols(self, currencies: Iterable[Currency]) -> np.ndarray:
+        cols = []
+        for currency in currencies:
+            col = self._rates_cols.get(currency.name)
+            if col is None:
+                raise ValueError(f"Unsupported currency {currency.name}")
+            cols.append(col)
+        return np.array(cols, dtype=np.int64)
+
+    def _get_rates_rows(self, dates: Iterable) -> np.ndarray:
+        dates = pd.DatetimeIndex([pd.Timestamp(d) for d in dates])
+        rows = self._rates_index.searchsorted(dates, side="right") - 1
+        return np.maximum(rows, 0)
+
+    def _get_rates(self, dates: List, currencies: List[Currency]) -> np.ndarray:
+        """ Conversion rate of each currency at the corresponding date """
+        if not dates:
+            return np.zeros(0, dtype=np.float64)
+        rows = self._get_rates_rows(dates)
+        return self._rates_values[rows, self._get_rates_cols(currencies)]
+
+    def _get_rates_matrix(
+        self, index: pd.DatetimeIndex, currencies: List[Currency]
+    ) -> np.ndarray:
+        """ Conversion rates of the currencies (columns) for each day of index """
+        rows = self._get_rates_rows(index)
+        return self._rates_values[np.ix_(rows, self._get_rates_cols(currencies))]
+
+    def _get_holdings_currencies(self) -> List[Currency]:
+        currencies = []
+        for key in self.holdings_keys:
+            currency = self.holdings_currencies.get(key)
+            if currency is None:
+                raise ValueError(f"Couldn't determine currency for holding {key}")
+            currencies.append(currency)
+        return currencies
+
+    def get_positions(
+        self, transactions: List[Transaction], opening: Optional[Balance] = None
+    ) -> Positions:
+        """ Daily quantities and cash, aligned to prices """
+        return Positions.from_transactions(
+            transactions=transactions,
+            index=self.prices.index,
+            registry=self.registry,
+            opening=opening,
+        )
 
     def get_allocations(
-        self, balances: Iterable[Balance], ndays: Optional[int] = None
+        self,
+        transactions: List[Transaction],
+        ndays: Optional[int] = None,
+        opening: Optional[Balance] = None,
     ) -> pd.DataFrame:
         """
-        Given a list of known balances, creates a pandas dataframe of allocations
-        where each column represent an holding and each row represent holdings'
-        values (i.e.  as cash) for a day.
+        Given a sorted list of transactions, creates a pandas dataframe of
+        allocations where each column represent an holding and each row
+        represent holdings' values (i.e.  as cash) for a day.
         An extra cash column is added to represent the amount of cash held.
 
         For example, considering a single day X, two holdings which corresponding
@@ -43,53 +220,28 @@ class Analysis:
                 ----+-----------+-----------+--------
                 X   |   100     |   100     | 50
                 X+1 |   150     |   105     |  0
-        """
 
-        # New dataframe with the same layout of prices
-        allocations = pd.DataFrame().reindex_like(self.prices)
-        cash = pd.DataFrame(columns=["cash"], index=allocations.index, dtype=np.float64)
-
-        for balance in balances:
-            b_date = pd.Timestamp(balance.date)
-
-            # Skip balances out of bounds
-            if b_date > allocations.index.max() or b_date < allocations.index.min():
-                continue
-
-            # Populate holdings columns
-            for holding in balance.holdings.values():
-                allocations.loc[
-                    pd.Timestamp(balance.date), holding.get_key()
-                ] = holding.quantity
-
-            # Populate cash dataframe
-            total_cash = 0.0
-            for curr, amount in balance.cash.items():
-                cash_to_add = Price(
-                    currency=curr, amount=abs(amount)
-                ).normalize_currency(self.conv_rates)
-                # Prices are always positive, so must compensate for that
-                total_cash += cash_to_add if amount > 0 else -cash_to_add
-            cash.loc[pd.Timestamp(balance.date), "cash"] = total_cash
-
-        # Fill empty slot using previous known values
-        allocations = allocations.interpolate(method="pad", axis=0)
-        cash = cash.interpolate(method="pad", axis=0)
-
-        # Apply prices
-        allocations *= self.prices
-
-        # For each column, apply conversion rate
-        for key in self.prices.columns:
-            currency = self.holdings_currencies.get(key)
-            if currency is None:
-                raise ValueError(f"Couldn't determine currency for holding {key}")
-
-            rate = self.conv_rates.get(currency.name)
-            if rate is None:
-                raise ValueError(f"Unsupported currency {currency.name}")
-
-            allocations[key] /= rate
+        Transactions made before the first day of prices can be replaced by
+        the balance they lead to (opening), so that only the transactions
+        within the analysed days need to be given.
+        """
+        positions = self.get_positions(transactions=transactions, opening=opening)
+
+        # Apply prices and conversion rates to the daily quantities
+        index = self.prices.index
+        values = positions.quantities * self.prices.values
+        values /= self._get_rates_matrix(index, self._get_holdings_currencies())
+        allocations = pd.DataFrame(
+            values, index=self.prices.index, columns=self.prices.columns
+        )
+
+        # Sum up cash of all currencies
+        cash_rates = self._get_rates_matrix(index, positions.currencies)
+        cash = pd.DataFrame(
+            (positions.cash / cash_rates).sum(axis=1),
+            index=self.prices.index,
+            columns=["cash"],
+        )
 
         # Return holdings allocations including cash
         res = pd.concat([allocations, cash], axis=1).fillna(0)
@@ -101,6 +253,29 @@ class Analysis:
 
         return res
 
+    @staticmethod
+    def _accumulate_deltas(
+        index: pd.DatetimeIndex, dates: List, deltas: List[float]
+    ) -> np.ndarray:
+        """
+        Sum up dated deltas so that each delta applies from its date onward
+        (i.e. same as adding each delta to index[date:]).
+        """
+        totals = np.zeros(len(index) + 1, dtype=np.float64)
+        if dates:
+            rows = index.searchsorted(
+                pd.DatetimeIndex([pd.Timestamp(d) for d in dates]), side="left"
+            )
+            np.add.at(totals, rows, deltas)
+        return np.cumsum(totals)[:-1]
+
+    def _get_vest_value(self, trs: Transaction) -> Price:
+        """ Value of vested stock at the moment of vesting """
+        holding = trs.get_holding_key()
+        price = self.prices.loc[trs.date :][holding].iloc[0]
+        holding_cur = self.holdings_currencies[holding]
+        return Price(currency=holding_cur, amount=trs.quantity * price)
+
     def get_earnings(
         self,
         allocations: pd.DataFrame,
@@ -113,27 +288,30 @@ class Analysis:
         """
         earnings = allocations.sum(axis=1)
 
+        dates = []
+        currencies = []
+        amounts = []
         for trs in transactions:
             # Discount cash put into the account
-            if (
-                trs.action == TransactionAction.CASH_IN
-                or trs.action == TransactionAction.CASH_OUT
-            ):
-                rows = earnings.loc[trs.date :]
-                delta = trs.amount.normalize_currency(self.conv_rates)
-                earnings.loc[trs.date :] = rows.add(
-                    -delta if trs.action == TransactionAction.CASH_IN else delta
-                )
+            if trs.action == TransactionAction.CASH_IN:
+                price, sign = trs.amount, -1.0
+            elif trs.action == TransactionAction.CASH_OUT:
+                price, sign = trs.amount, 1.0
 
             # Discount vested stock (as it is not earning from investiment)
             elif trs.action == TransactionAction.VEST:
-                rows = earnings.loc[trs.date :]
-                price = self.prices.loc[trs.date :][trs.get_holding_key()].iloc[0]
-                holding_cur = self.holdings_currencies[trs.get_holding_key()]
-                delta = Price(
-                    currency=holding_cur, amount=trs.quantity * price
-                ).normalize_currency(self.conv_rates)
-                earnings.loc[trs.date :] = rows.add(-delta)
+                price, sign = self._get_vest_value(trs), -1.0
+            else:
+                continue
+
+            dates.append(trs.date)
+            currencies.append(price.currency)
+            amounts.append(sign * price.amount)
+
+        # Convert and apply all cash flows at once
+        deltas = np.array(amounts, dtype=np.float64)
+        deltas /= self._get_rates(dates, currencies)
+        earnings += self._accumulate_deltas(earnings.index, dates, deltas)
 
         # Take only the last n days
         if ndays is not None:
@@ -160,6 +338,21 @@ class Analysis:
         ret = balances.prod()
         return ret - 1
 
+    def get_attrs_allocations(
+        self,
+        allocations: pd.DataFrame,
+        attrs_weights: Dict[str, Dict[str, Dict[str, float]]],
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Same as get_attr_allocations, but computes the allocations of several
+        attributes at once (see get_attr_allocations). The weights of all
+        attributes are stacked in a single sparse matrix, which is multiplied
+        only once by the allocations.
+        """
+        weights = AttrsWeights(registry=self.registry, attrs_weights=attrs_weights)
+        values = allocations[self.holdings_keys].values
+        return weights.split(weights.dot(values), index=allocations.index)
+
     def get_attr_allocations(
         self, allocations: pd.DataFrame, attr: str, attr_weights: Dict[str, Dict[str, float]]
     ) -> pd.DataFrame:
@@ -185,38 +378,96 @@ class Analysis:
                 --+--------+---------+--------
                 X |  140   |   50    |   10
         """
+        return self.get_attrs_allocations(
+            allocations=allocations, attrs_weights={attr: attr_weights}
+        )[attr]
 
-        columns = list(attr_weights) + ["unknown"]
-        df = pd.DataFrame(0, columns=columns, index=allocations.index, dtype=np.float64)
+    def get_holdings_flows(
+        self, index: pd.DatetimeIndex, transactions: List[Transaction]
+    ) -> np.ndarray:
+        """
+        Creates a (days x holdings) matrix containing, for each holding, the
+        total cash flow due to buy, sell and vest transactions up to each day.
+        Flows are negative when the allocation of the holding is increased
+        (e.g. after a purchase) and positive otherwise.
+        """
+        dates = []
+        cols = []
+        currencies = []
+        amounts = []
+        for trs in transactions:
+            # Discount allocation increases after BUY
+            if trs.action == TransactionAction.BUY:
+                price, sign = trs.amount, -1.0
 
-        # Keep record of how much we allocate for each holding
-        tot_holdings = defaultdict(lambda: 0)
+            # Discount allocation decreases after SELL
+            elif trs.action == TransactionAction.SELL:
+                price, sign = trs.amount, 1.0
 
-        # Compute holdings allocations
-        for entry, values in attr_weights.items():
-            for holding_key, portion in values.items():
-                df[entry] += portion * allocations[holding_key]
-                tot_holdings[holding_key] += portion
+            # Discount vested stock (as it is not earning from investiment)
+            elif trs.action == TransactionAction.VEST:
+                price, sign = self._get_vest_value(trs), -1.0
 
-        # Cumpute unknown allocations
-        for holding_key in self.holdings_keys:
-            allocation = tot_holdings[holding_key]
+            else:
+                continue
 
-            # Floating point operations can lack of precision
-            # so we should be slightly tollerant
-            eps = 0.00001
+            col = self.registry.get_id(trs.get_holding_key())
+            if col is not None:
+                dates.append(trs.date)
+                cols.append(col)
+                currencies.append(price.currency)
+                amounts.append(sign * price.amount)
+
+        # Convert all cash flows at once
+        deltas = np.array(amounts, dtype=np.float64)
+        deltas /= self._get_rates(dates, currencies)
+
+        flows = np.zeros((len(index) + 1, len(self.registry)), dtype=np.float64)
+        if dates:
+            rows = index.searchsorted(
+                pd.DatetimeIndex([pd.Timestamp(d) for d in dates]), side="left"
+            )
+            np.add.at(flows, (rows, cols), deltas)
+        return np.cumsum(flows, axis=0)[:-1]
+
+    def get_attrs_earnings(
+        self,
+        attrs_allocations: Dict[str, pd.DataFrame],
+        transactions: List[Transaction],
+        attrs_weights: Dict[str, Dict[str, Dict[str, float]]],
+        ndays: Optional[int] = None,
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Same as get_attr_earnings, but computes the earnings of several attributes
+        at once (see get_attr_earnings). Holdings flows are computed only once
+        and distributed to the values of all attributes with a single matrix
+        multiplication.
+        """
+        if not attrs_allocations:
+            return {}
 
-            if allocation > 1 + eps:
-                raise ValueError(
-                    f"Attribute \"{attr}\" has more than 100% "
-                    f"allocation for {holding_key}"
-                )
+        index = next(iter(attrs_allocations.values())).index
+        flows = self.get_holdings_flows(index=index, transactions=transactions)
 
-            elif allocation > 1 - eps:
-                continue
+        weights = AttrsWeights(
+            registry=self.registry,
+            attrs_weights={attr: attrs_weights[attr] for attr in attrs_allocations},
+        )
+        attrs_flows = weights.dot(flows)
+
+        res = {}
+        for attr, attr_allocations in attrs_allocations.items():
+            earnings = attr_allocations + attrs_flows[:, weights.slices[attr]]
+
+            # Take only the last n days
+            if ndays is not None:
+                # pylint: disable=invalid-unary-operand-type
+                earnings = earnings.iloc[-ndays:]
 
-            df["unknown"] += allocations[holding_key] * (1 - allocation)
-        return df
+            # Subtract initial value so that we always start from zero
+            res[attr] = earnings.add(-earnings.iloc[0])
+
+        return res
 
     def get_attr_earnings(
         self,
@@ -233,51 +484,9 @@ class Analysis:
         have both produced $50 of earnings.
         Buy, sell and vest transaction are discounted from the earnings.
         """
-        # Map holdings to their weights with respect of attributes
-        holdings_alloc = defaultdict(lambda: {})
-
-        for entry, values in attr_weights.items():
-            for holding_key, portion in values.items():
-                holdings_alloc[holding_key][entry] = portion
-
-        # Earning for each attribute
-        earnings = attr_allocations.copy()
-
-        def _apply_deltas(date, delta, holding):
-            weights_sum = 0
-            for attr, weight in holdings_alloc[holding].items():
-                earnings.loc[date:, attr] += delta * weight
-                weights_sum += weight
-            earnings.loc[date:, "unknown"] += delta * (1 - weights_sum)
-            return earnings
-
-        for trs in transactions:
-            # Discount allocation increases after BUY
-            if trs.action == TransactionAction.BUY:
-                delta = -trs.amount.normalize_currency(self.conv_rates)
-                earnings = _apply_deltas(trs.date, delta, trs.get_holding_key())
-
-            # Discount allocation decreases after SELL
-            elif trs.action == TransactionAction.SELL:
-                delta = trs.amount.normalize_currency(self.conv_rates)
-                earnings = _apply_deltas(trs.date, delta, trs.get_holding_key())
-
-            # Discount vested stock (as it is not earning from investiment)
-            elif trs.action == TransactionAction.VEST:
-                holding = trs.get_holding_key()
-                price = self.prices.loc[trs.date :][holding].iloc[0]
-                holding_cur = self.holdings_currencies[holding]
-                delta = -Price(
-                    currency=holding_cur, amount=trs.quantity * price
-                ).normalize_currency(self.conv_rates)
-                earnings = _apply_deltas(trs.date, delta, holding)
-
-        # Take only the last n days
-        if ndays is not None:
-            # pylint: disable=invalid-unary-operand-type
-            earnings = earnings.iloc[-ndays:]
-
-        # Subtract initial value so that we always start from zero
-        earnings = earnings.add(-earnings.iloc[0])
-
-        return earnings
+        return self.get_attrs_earnings(
+            attrs_allocations={"": attr_allocations},
+            transactions=transactions,
+            attrs_weights={"": attr_weights},
+            ndays=ndays,
+        )[""]
@@ -1,26 +1,55 @@
-from typing import Optional, Dict, List
-import copy
+from typing import Optional, Mapping, Dict, List, Iterable, Union
 from datetime import datetime
 from .transaction import Transaction, TransactionAction
 from .price import Currency
 from .holding import Holding
+from .persistent import PersistentMap
+from .money import to_unit, from_units
 
 
 class Balance:
+    """
+    Holdings and cash at a given date.
+
+    Balances are never modified in place: processing a transaction returns
+    a new balance which shares all the untouched holdings and cash entries
+    with the previous one (copy-on-write), so that keeping a balance for
+    every transaction has a constant cost regardless of the number of holdings.
+
+    Cash is kept in fixed point (integer units, see money.py) so that it
+    stays exact however many transactions are processed, see
+    get_cash_balance for the amount of a currency.
+    """
+
     def __init__(
         self,
         date: datetime,
-        holdings: Optional[Dict[str, Holding]] = None,
-        cash: Optional[Dict[Currency, float]] = None,
+        holdings: Optional[Mapping[str, Holding]] = None,
+        cash: Optional[Mapping[Currency, int]] = None,
     ):
         self.date = date
-        self.holdings = holdings or {}
-        self.cash = cash or {}
+        self.holdings = self._to_pmap(holdings)
+        self.cash = self._to_pmap(cash)
+
+    @staticmethod
+    def _to_pmap(items: Optional[Mapping]) -> PersistentMap:
+        if isinstance(items, PersistentMap):
+            return items
+        return PersistentMap(items)
 
     def process_transaction(self, transaction: Transaction) -> "Balance":
-        new_balance = copy.deepcopy(self)
-        new_balance.date = max(transaction.date, new_balance.date)
+        # Holdings and cash are persistent maps, hence sharing them is safe
+        new_balance = Balance(
+            date=max(transaction.date, self.date),
+            holdings=self.holdings,
+            cash=self.cash,
+        )
+        self._apply_transaction(new_balance=new_balance, transaction=transaction)
+        return new_balance
 
+    def _apply_transaction(
+        self, new_balance: Union["Balance", "_BalanceBuilder"], transaction: Transaction
+    ):
         if transaction.action == TransactionAction.BUY:
             self._process_buy_transaction(
                 new_balance=new_balance, transaction=transaction
@@ -55,8 +84,6 @@ class Balance:
                 " this action is currently not fully supported"
             )
 
-        return new_balance
-
     def _make_holding(self, transaction: Transaction) -> Holding:
         return Holding(
             quantity=transaction.quantity,
@@ -66,59 +93,65 @@ class Balance:
         )
 
     def get_cash_balance(self, currency: Currency) -> float:
+        return from_units(self.get_cash_units(currency))
+
+    def get_cash_units(self, currency: Currency) -> int:
         cash = self.cash.get(currency)
         if cash is None:
-            cash = 0.0
+            cash = 0
         return cash
 
+    def _set_cash(self, currency: Currency, units: int):
+        self.cash = self.cash.set(currency, units)
+
+    def _add_holding(self, holding: Holding):
+        key = holding.get_key()
+        if key in self.holdings:
+            holding = self.holdings[key] + holding
+        self.holdings = self.holdings.set(key, holding)
+
     def _process_sell_transaction(
         self, new_balance: "Balance", transaction: Transaction
     ):
         # Reduce available holdings
         new_holding = self._make_holding(transaction=transaction)
-        if new_holding.get_key() in new_balance.holdings:
-            new_balance.holdings[new_holding.get_key()] -= new_holding
-        else:
-            new_balance.holdings[new_holding.get_key()] = -new_holding
+        new_balance._add_holding(-new_holding)
 
         # Update cash after transaction
-        cash = new_balance.get_cash_balance(transaction.price.currency)
-        new_cash = cash + (transaction.price * transaction.quantity).amount
+        cash = new_balance.get_cash_units(transaction.price.currency)
+        new_cash = cash + to_unit((transaction.price * transaction.quantity).amount)
         if transaction.fees:
-            new_cash -= transaction.fees.amount
-        new_balance.cash[transaction.price.currency] = new_cash
+            new_cash -= to_unit(transaction.fees.amount)
+        new_balance._set_cash(transaction.price.currency, new_cash)
 
     def _process_buy_transaction(
         self, new_balance: "Balance", transaction: Transaction
     ):
         # Reduce cash for the given currency
-        cash = new_balance.get_cash_balance(transaction.price.currency)
-        new_cash = cash - (transaction.price * transaction.quantity).amount
+        cash = new_balance.get_cash_units(transaction.price.currency)
+        new_cash = cash - to_unit((transaction.price * transaction.quantity).amount)
         if transaction.fees:
-            new_cash -= transaction.fees.amount
-        new_balance.cash[transaction.price.currency] = new_cash
+            new_cash -= to_unit(transaction.fees.amount)
+        new_balance._set_cash(transaction.price.currency, new_cash)
 
         # Add holdings
         new_holding = self._make_holding(transaction=transaction)
-        if new_holding.get_key() in new_balance.holdings:
-            new_balance.holdings[new_holding.get_key()] += new_holding
-        else:
-            new_balance.holdings[new_holding.get_key()] = new_holding
+        new_balance._add_holding(new_holding)
 
     def _process_cash_transaction(
         self, new_balance: "Balance", transaction: Transaction, out: bool,
     ):
         # Reduce cash for the given currency
-        cash = new_balance.get_cash_balance(transaction.amount.currency)
+        cash = new_balance.get_cash_units(transaction.amount.currency)
 
         if out:
-            new_cash = cash - transaction.amount.amount
+            new_cash = cash - to_unit(transaction.amount.amount)
         else:
-            new_cash = cash + transaction.amount.amount
+            new_cash = cash + to_unit(transaction.amount.amount)
 
         if transaction.fees:
-            new_cash -= transaction.fees.amount
-        new_balance.cash[transaction.amount.currency] = new_cash
+            new_cash -= to_unit(transaction.fees.amount)
+        new_balance._set_cash(transaction.amount.currency, new_cash)
 
     def _process_div_transaction(
         self, new_balance: "Balance", transaction: Transaction
@@ -135,16 +168,24 @@ class Balance:
     ):
         # Apply fees (if any) (??)
         if transaction.fees:
-            cash = new_balance.get_cash_balance(transaction.fees.currency)
-            new_cash = cash - transaction.fees.amount
-            new_balance.cash[transaction.fees.currency] = new_cash
+            cash = new_balance.get_cash_units(transaction.fees.currency)
+            new_cash = cash - to_unit(transaction.fees.amount)
+            new_balance._set_cash(transaction.fees.currency, new_cash)
 
         # Add holdings
         new_holding = self._make_holding(transaction=transaction)
-        if new_holding.get_key() in new_balance.holdings:
-            new_balance.holdings[new_holding.get_key()] += new_holding
-        else:
-            new_balance.holdings[new_holding.get_key()] = new_holding
+        new_balance._add_holding(new_holding)
+
+    def process_transactions(self, transactions: Iterable[Transaction]) -> "Balance":
+        """
+        Balance after processing all the given transactions. Intermediary
+        balances are not kept, holdings are then updated in place.
+        """
+        builder = _BalanceBuilder(self)
+        for trs in transactions:
+            builder.date = max(trs.date, builder.date)
+            self._apply_transaction(new_balance=builder, transaction=trs)
+        return builder.to_balance()
 
     @staticmethod
     def get_balances(transactions: List[Transaction]) -> Dict[datetime, "Balance"]:
@@ -167,9 +208,43 @@ class Balance:
 
     def __str__(self):
         return (
-            f"CASH: {list(self.cash.values())}, "
+            f"CASH: {[from_units(units) for units in self.cash.values()]}, "
             f"HOLDINGS: {list(self.holdings.values())}"
         )
 
     def __repr__(self):
         return self.__str__()
+
+
+class _BalanceBuilder:
+    """
+    Mutable balance, used when only the final balance is needed. Holdings
+    start shared with the initial balance, a holding is copied the first
+    time it's updated and then updated in place.
+    """
+
+    def __init__(self, balance: Balance):
+        self.date = balance.date
+        self.holdings: Dict[str, Holding] = dict(balance.holdings.items())
+        self.cash: Dict[Currency, int] = dict(balance.cash.items())
+        self._owned = set()
+
+    def get_cash_units(self, currency: Currency) -> int:
+        return self.cash.get(currency, 0)
+
+    def _set_cash(self, currency: Currency, units: int):
+        self.cash[currency] = units
+
+    def _add_holding(self, holding: Holding):
+        key = holding.get_key()
+        current = self.holdings.get(key)
+        if current is None:
+            self.holdings[key] = holding
+        elif key in self._owned:
+            current.quantity += holding.quantity
+        else:
+            self.holdings[key] = current + holding
+            self._owned.add(key)
+
+    def to_balance(self) -> Balance:
+        return Balance(date=self.date, holdings=self.holdings, cash=self.cash)
@@ -0,0 +1,102 @@
+"""
+Benchmark indices to compare earnings with
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import pandas as pd
+from .holding import Holding
+from .providers import PriceProvider
+from .columnar import read_prices_csv
+
+# Benchmarks already computed, by provider, benchmarks and range of days, so
+# that projects sharing the same benchmarks and providers compute them only
+# once. Only the most recently used entries are kept.
+MAX_COMPUTED = 16
+_computed: "OrderedDict[Tuple, Dict[str, pd.Series]]" = OrderedDict()
+_computing: Dict[Tuple, threading.Lock] = {}
+_computed_lock = threading.Lock()
+
+
+def _reindex(prices: pd.Series) -> pd.Series:
+    prices = prices.add(-prices.iloc[0])
+    return prices.reindex(
+        index=pd.date_range(prices.index.min(), prices.index.max()),
+        method="pad",
+    )
+
+
+def _compute_benchmarks(
+    benchmarks: List[Dict[str, str]],
+    provider: PriceProvider,
+    start: datetime,
+    end: datetime,
+) -> Dict[str, pd.Series]:
+    # Benchmarks with a ticker are fetched all together
+    holdings = [Holding(ticker=b["ticker"]) for b in benchmarks if "ticker" in b]
+    histories = provider.history(holdings, start=start, end=end) if holdings else {}
+
+    res = {}
+    for benchmark in benchmarks:
+        if "ticker" in benchmark:
+            prices = histories.get(benchmark["ticker"])
+        else:
+            with open(benchmark["file"]) as fd:
+                prices, _ = read_prices_csv(fd.read())
+            first = pd.Timestamp(start).normalize()
+            prices = prices[(prices.index >= first) & (prices.index < end)].dropna()
+
+        if prices is not None and prices.size > 0:
+            res[benchmark["name"]] = _reindex(prices)
+    return res
+
+
+def _get_computed(key: Tuple) -> Optional[Dict[str, pd.Series]]:
+    with _computed_lock:
+        if key not in _computed:
+            return None
+        _computed.move_to_end(key)
+        return dict(_computed[key])
+
+
+def get_benchmarks(
+    benchmarks: List[Dict[str, str]],
+    provider: PriceProvider,
+    start: datetime,
+    end: datetime,
+) -> Dict[str, pd.Series]:
+    """
+    Changes in value of each benchmark (by name) since start, benchmarks are
+    dicts containing a name and either a ticker (whose prices are requested
+    to provider) or a prices file.
+    """
+    key = (
+        provider.get_identity(),
+        tuple((b["name"], b.get("ticker"), b.get("file")) for b in benchmarks),
+        pd.Timestamp(start).normalize(),
+        pd.Timestamp(end).normalize(),
+    )
+    computed = _get_computed(key)
+    if computed is not None:
+        return computed
+
+    # Callers asking for the same benchmarks wait for the first one, while
+    # other benchmarks are computed concurrently
+    with _computed_lock:
+        lock = _computing.setdefault(key, threading.Lock())
+    with lock:
+        computed = _get_computed(key)
+        if computed is not None:
+            return computed
+
+        computed = _compute_benchmarks(
+            benchmarks, provider=provider, start=start, end=end
+        )
+        with _computed_lock:
+            _computed[key] = computed
+            while len(_computed) > MAX_COMPUTED:
+                _computed.popitem(last=False)
+            _computing.pop(key, None)
+        return dict(computed)
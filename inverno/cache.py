@@ -0,0 +1,199 @@
+"""
+On-disk cache of parsed transactions files
+"""
+
+from typing import Callable, Optional
+import os
+import json
+import hashlib
+import numpy as np
+from .columnar import TransactionColumns
+from .common import log_info
+
+# Bump whenever the layout of cached columns changes
+CACHE_VERSION = 3
+
+# Name of the cache directory, created next to the project config
+CACHE_DIR = ".inverno_cache"
+
+
+def _decode(content: bytes) -> str:
+    """ Decode file content as done when reading a file in text mode """
+    return content.decode().replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class TransactionsCache:
+    """
+    Cache of parsed transactions files stored in a directory.
+
+    Each transactions file has an entry made of a metadata file, recording
+    the file fingerprint (path, size, modification time and content hash),
+    and of a compressed npz file containing the parsed columns.
+    An entry is reused if size and modification time of the file didn't change
+    or, otherwise, if its content hash is still the same.
+
+    Transactions files are often append-only logs, hence entries also record
+    where the last complete line of the file ends (offset), how many rows
+    precede it and the hash of the content up to there. If a file grows and
+    its content up to the offset didn't change, only the new tail is parsed
+    (for formats supporting it) and appended to the cached rows.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.appends = 0
+        self.misses = 0
+
+    def _entry_path(self, path: str, fmt: str) -> str:
+        name = hashlib.sha1(f"{fmt}:{path}".encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self, entry: str) -> Optional[dict]:
+        try:
+            with open(entry + ".json") as fd:
+                meta = json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("version") != CACHE_VERSION:
+            return None
+        return meta
+
+    def _write(self, entry: str, meta: dict, columns: Optional[TransactionColumns]):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to temporary files first so that entries are never partial
+        if columns is not None:
+            with open(entry + ".npz.tmp", "wb") as fd:
+                np.savez_compressed(fd, **columns.to_arrays())
+            os.replace(entry + ".npz.tmp", entry + ".npz")
+
+        with open(entry + ".json.tmp", "w") as fd:
+            json.dump(meta, fd)
+        os.replace(entry + ".json.tmp", entry + ".json")
+
+    def _read_columns(self, entry: str) -> Optional[TransactionColumns]:
+        try:
+            with np.load(entry + ".npz") as arrays:
+                return TransactionColumns.from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _get_offset_meta(content: bytes, nb_rows: int) -> dict:
+        """
+        Offset (end of the last complete line) of content made of nb_rows
+        rows, along with the number of rows before the offset and the hashes
+        of the content and of the last line before the offset.
+        """
+        offset = content.rfind(b"\n") + 1
+        offset_rows = nb_rows - 1 if content[offset:].strip() else nb_rows
+        line_start = content.rfind(b"\n", 0, max(offset - 1, 0)) + 1
+        return {
+            "offset": offset,
+            "offset_rows": offset_rows if offset > 0 else 0,
+            "offset_sha256": _sha256(content[:offset]),
+            "last_line_sha256": _sha256(content[line_start:offset]),
+        }
+
+    @staticmethod
+    def _is_appended(meta: dict, content: bytes) -> bool:
+        """ Whether content extends the content recorded in meta """
+        offset = meta["offset"]
+        if offset == 0 or len(content) <= offset:
+            return False
+
+        # Cheap check of the last line first, then of the whole prefix
+        line_start = content.rfind(b"\n", 0, offset - 1) + 1
+        return (
+            _sha256(content[line_start:offset]) == meta["last_line_sha256"]
+            and _sha256(content[:offset]) == meta["offset_sha256"]
+        )
+
+    def load(
+        self,
+        path: str,
+        fmt: str,
+        parse: Callable[[str], TransactionColumns],
+        parse_tail: Optional[Callable[[str, str], TransactionColumns]] = None,
+    ) -> TransactionColumns:
+        """
+        Columns of the transactions file at path (in the given format), either
+        from the cache or by parsing the file content with parse. If provided,
+        parse_tail is used to parse only the lines appended to a file since it
+        was cached: it is given the first line of the file (e.g. a header) and
+        the new lines.
+        """
+        path = os.path.abspath(path)
+        entry = self._entry_path(path=path, fmt=fmt)
+        stat = os.stat(path)
+        meta = self._read_meta(entry)
+
+        if (
+            meta is not None
+            and meta["size"] == stat.st_size
+            and meta["mtime_ns"] == stat.st_mtime_ns
+        ):
+            columns = self._read_columns(entry)
+            if columns is not None:
+                self.hits += 1
+                return columns
+
+        with open(path, "rb") as fd:
+            content = fd.read()
+        digest = _sha256(content)
+
+        new_meta = {
+            "version": CACHE_VERSION,
+            "path": path,
+            "format": fmt,
+            "size": len(content),
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+        }
+
+        # File was touched but its content didn't change
+        if meta is not None and meta["sha256"] == digest:
+            columns = self._read_columns(entry)
+            if columns is not None:
+                self.hits += 1
+                meta.update(new_meta)
+                self._write(entry=entry, meta=meta, columns=None)
+                return columns
+
+        # New lines were appended to the file
+        columns = None
+        if (
+            parse_tail is not None
+            and meta is not None
+            and self._is_appended(meta=meta, content=content)
+        ):
+            cached = self._read_columns(entry)
+            if cached is not None:
+                offset_rows = meta["offset_rows"]
+                header = content[: content.index(b"\n") + 1]
+                tail = parse_tail(_decode(header), _decode(content[meta["offset"] :]))
+                columns = TransactionColumns.concat(
+                    [cached.take(slice(0, offset_rows)), tail]
+                )
+                self.appends += 1
+
+        if columns is None:
+            self.misses += 1
+            columns = parse(_decode(content))
+
+        new_meta.update(self._get_offset_meta(content=content, nb_rows=len(columns)))
+        self._write(entry=entry, meta=new_meta, columns=columns)
+        return columns
+
+    def log_stats(self):
+        """ Log cache hits and misses """
+        log_info(
+            f"Transactions cache: {self.hits} file(s) reused, "
+            f"{self.appends} file(s) extended, {self.misses} file(s) parsed"
+        )
@@ -10,11 +10,14 @@ def main():
 @main.command("gen-report")
 @click.argument("config")
 @click.argument("dest")
-def make_report(config: str, dest: str):
+@click.option(
+    "--no-cache", is_flag=True, help="Do not use or update the local cache"
+)
+def make_report(config: str, dest: str, no_cache: bool):
     """
     Generate an html report from a config
     """
-    proj = Project(config=config)
+    proj = Project(config=config, use_cache=not no_cache)
     proj.gen_report(dest)
 
 @main.command("new-project")
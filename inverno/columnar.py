@@ -0,0 +1,564 @@
+"""
+Column-wise storage and bulk parsing of transactions
+"""
+
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+from datetime import datetime
+import io
+import hashlib
+import sys
+import re
+import pandas as pd
+import numpy as np
+import dateutil.parser
+from .price import Price, Currency
+from .money import to_units, from_units
+from .transaction import Transaction, TransactionAction, HOLDING_ACTIONS
+from .holding import Holding
+
+# Date formats tried (in order) when sniffing the format of a dates column.
+# Day first formats come before month first ones, as for dateutil with dayfirst.
+DATE_FORMATS = [
+    "%d/%m/%y",
+    "%d/%m/%Y",
+    "%Y-%m-%d",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%d-%m-%Y",
+    "%d-%m-%y",
+    "%d.%m.%Y",
+    "%m/%d/%Y",
+    "%m/%d/%y",
+]
+
+
+def _sniff_date_format(sample: str) -> Optional[str]:
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(sample, fmt)
+        except ValueError:
+            continue
+        return fmt
+    return None
+
+
+def parse_dates(values: pd.Series) -> np.ndarray:
+    """
+    Parses a column of dates in bulk. The format is sniffed once from the first
+    value and used for the whole column, if the format can't be determined
+    (or doesn't fit all values) each distinct value is parsed with dateutil.
+    """
+    values = values.str.strip()
+    if values.empty:
+        return np.array([], dtype="datetime64[ns]")
+
+    fmt = _sniff_date_format(values.iloc[0])
+    if fmt is not None:
+        try:
+            return pd.to_datetime(values, format=fmt).values
+        except ValueError:
+            pass
+
+    uniques = pd.unique(values)
+    parsed = pd.to_datetime(
+        [dateutil.parser.parse(v, dayfirst=True) for v in uniques]
+    )
+    return parsed.values[pd.Index(uniques).get_indexer(values)]
+
+
+_NUMBER_CHARS = "0123456789.,"
+_DROP_NUMBERS = str.maketrans("", "", _NUMBER_CHARS)
+
+
+def _get_currency(price: str) -> Optional[Currency]:
+    for currency in Currency:
+        if currency.name in price or currency.value in price:
+            return currency
+    return None
+
+
+def _parse_number(price: str, text: str) -> float:
+    """
+    Number contained in price, text is the price without the number's chars.
+    If the number is surrounded by text (e.g. "$1,000.00") stripping the text
+    leaves only the number, otherwise fallback to searching the first number.
+    """
+    number = price.strip(text)
+    if number and len(number) + len(text) == len(price):
+        return float(number.replace(",", ""))
+
+    match = re.search(r"[\d\.,]+", price)
+    if match is None:
+        raise ValueError(f'Cannot find valid price in string "{price}"')
+    return float(match.group().replace(",", ""))
+
+
+def parse_prices(
+    values: pd.Series, expect_negative: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses a column of prices in bulk (see Price.from_str).
+    Returns the amounts (NaN for empty values) and the currencies (None for
+    empty values).
+    """
+    present = (values != "").values
+    amounts = np.full(len(values), np.nan, dtype=np.float64)
+    currencies = np.full(len(values), None, dtype=object)
+    if not present.any():
+        return amounts, currencies
+
+    # Sign and currency are determined by the text surrounding the number,
+    # which takes only a few distinct values (e.g. "$", "-£")
+    prices = values.values[present].tolist()
+    texts = [p.translate(_DROP_NUMBERS) for p in prices]
+    positions, uniques = pd.factorize(np.array(texts, dtype=object))
+
+    parsed = np.array(
+        [_parse_number(p, t) for p, t in zip(prices, texts)], dtype=np.float64
+    )
+
+    # Only prices whose text contains a minus can be negative
+    minus = np.array(["-" in t for t in uniques], dtype=bool)
+    for row in np.flatnonzero(minus[positions]):
+        if prices[row].strip().startswith("-"):
+            parsed[row] = -parsed[row]
+
+    if expect_negative:
+        if (parsed > 0).any():
+            raise ValueError("Expected a negative value")
+        parsed = -parsed
+
+    found = np.array([_get_currency(t) for t in uniques], dtype=object)
+    missing = np.array([c is None for c in found], dtype=bool)[positions]
+    if missing.any():
+        price = prices[np.flatnonzero(missing)[0]]
+        raise ValueError(f"Couldn't get currency for price {price}")
+
+    amounts[present] = parsed
+    currencies[present] = found[positions]
+    return amounts, currencies
+
+
+def read_prices_csv(content: str) -> Tuple[pd.Series, Optional[Currency]]:
+    """
+    Prices (sorted by date) and currency from the content of a prices file,
+    i.e. a CSV file with date and price columns. When a date appears several
+    times, its last price is kept.
+    """
+    df = pd.read_csv(
+        io.StringIO(content), dtype=str, keep_default_na=False, na_filter=False
+    )
+    amounts, currencies = parse_prices(df["price"])
+    dates = parse_dates(df["date"])
+
+    order = np.argsort(dates, kind="stable")
+    dates, amounts = dates[order], amounts[order]
+    last = np.ones(len(dates), dtype=bool)
+    last[:-1] = dates[1:] != dates[:-1]
+    prices = pd.Series(amounts[last], index=pd.DatetimeIndex(dates[last]))
+
+    currency = next((c for c in currencies if c is not None), None)
+    return prices, currency
+
+
+def _to_optional_str(values: pd.Series) -> np.ndarray:
+    res = values.values.astype(object)
+    res[res == ""] = None
+    return res
+
+
+class TransactionColumns:
+    """
+    Transactions stored column-wise: one array per field.
+
+    Prices (price, fees and amount) are split in an amount column (NaN when not
+    set) and a currency column (None when not set), the same goes for the
+    holding identifiers and quantity. Fees and amounts of money are stored in
+    fixed point (int64 units, MISSING when not set, see money.py), while
+    prices per unit are kept as floats. Transaction objects are only built on
+    demand, see to_transactions().
+
+    Columns are validated once they passed the checks of
+    TransactionsValidator, which also fills in their missing fields.
+    """
+
+    FIELDS = [
+        "date",
+        "action",
+        "name",
+        "ticker",
+        "isin",
+        "quantity",
+        "price",
+        "price_currency",
+        "fees",
+        "fees_currency",
+        "amount",
+        "amount_currency",
+    ]
+
+    def __init__(self, validated: bool = False, **columns: np.ndarray):
+        missing = set(self.FIELDS) - set(columns)
+        if missing:
+            raise ValueError(f"Missing transactions columns: {sorted(missing)}")
+
+        self.date: np.ndarray = columns["date"]
+        self.action: np.ndarray = columns["action"]
+        self.name: np.ndarray = columns["name"]
+        self.ticker: np.ndarray = columns["ticker"]
+        self.isin: np.ndarray = columns["isin"]
+        self.quantity: np.ndarray = columns["quantity"]
+        self.price: np.ndarray = columns["price"]
+        self.price_currency: np.ndarray = columns["price_currency"]
+        self.fees: np.ndarray = columns["fees"]
+        self.fees_currency: np.ndarray = columns["fees_currency"]
+        self.amount: np.ndarray = columns["amount"]
+        self.amount_currency: np.ndarray = columns["amount_currency"]
+        self.validated = validated
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    def columns(self) -> dict:
+        """ All columns by field name """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def get_digest(self) -> str:
+        """ Hash (sha256) of the content of the rows, in order """
+        digest = hashlib.sha256()
+        for values in self.columns().values():
+            if values.dtype != object:
+                digest.update(values.tobytes())
+                continue
+            # Objects (strings, actions, currencies) are hashed by value
+            codes, uniques = pd.factorize(values)
+            digest.update(codes.astype(np.int64).tobytes())
+            digest.update(repr(uniques.tolist()).encode())
+        return digest.hexdigest()
+
+    def take(self, indices: np.ndarray) -> "TransactionColumns":
+        """ New columns containing only the given rows (indices or mask) """
+        return TransactionColumns(
+            validated=self.validated,
+            **{field: values[indices] for field, values in self.columns().items()},
+        )
+
+    @staticmethod
+    def empty() -> "TransactionColumns":
+        """ Columns without any transaction """
+        return TransactionColumns.from_transactions([])
+
+    @staticmethod
+    def concat(tables: Sequence["TransactionColumns"]) -> "TransactionColumns":
+        """ Concatenate several columns one after the other """
+        if not tables:
+            return TransactionColumns.empty()
+        return TransactionColumns(
+            validated=all(t.validated for t in tables),
+            **{
+                field: np.concatenate([getattr(t, field) for t in tables])
+                for field in TransactionColumns.FIELDS
+            },
+        )
+
+    @staticmethod
+    def from_transactions(transactions: List[Transaction]) -> "TransactionColumns":
+        """ Store a list of transactions column-wise """
+
+        def _objects(values: list) -> np.ndarray:
+            res = np.empty(len(values), dtype=object)
+            res[:] = values
+            return res
+
+        def _amounts(prices: List[Optional[Price]]) -> np.ndarray:
+            return np.array(
+                [np.nan if p is None else p.amount for p in prices], dtype=np.float64
+            )
+
+        def _units(prices: List[Optional[Price]]) -> np.ndarray:
+            return to_units(_amounts(prices))
+
+        def _currencies(prices: List[Optional[Price]]) -> np.ndarray:
+            return _objects([None if p is None else p.currency for p in prices])
+
+        trs = transactions
+        dates = pd.to_datetime([t.date for t in trs]).values
+        return TransactionColumns(
+            date=dates.astype("datetime64[ns]"),
+            action=_objects([t.action for t in trs]),
+            name=_objects([t.name for t in trs]),
+            ticker=_objects([t.ticker for t in trs]),
+            isin=_objects([t.isin for t in trs]),
+            quantity=np.array(
+                [np.nan if t.quantity is None else t.quantity for t in trs],
+                dtype=np.float64,
+            ),
+            price=_amounts([t.price for t in trs]),
+            price_currency=_currencies([t.price for t in trs]),
+            fees=_units([t.fees for t in trs]),
+            fees_currency=_currencies([t.fees for t in trs]),
+            amount=_units([t.amount for t in trs]),
+            amount_currency=_currencies([t.amount for t in trs]),
+        )
+
+    @staticmethod
+    def from_standard_csv(content: str) -> "TransactionColumns":
+        """ Parse a transactions file in the standard format """
+        df = pd.read_csv(
+            io.StringIO(content), dtype=str, keep_default_na=False, na_filter=False
+        )
+
+        price, price_currency = parse_prices(df["price"])
+        fees, fees_currency = parse_prices(df["fees"])
+        amount, amount_currency = parse_prices(df["amount"])
+
+        actions = {a.value: a for a in TransactionAction}
+        action = df["action"].map(actions)
+        if action.isna().any():
+            unknown = df["action"][action.isna()].iloc[0]
+            raise ValueError(f"'{unknown}' is not a valid TransactionAction")
+
+        quantity = df["quantity"].replace("", np.nan).astype(np.float64).values
+
+        return TransactionColumns(
+            date=parse_dates(df["date"]),
+            action=action.values.astype(object),
+            name=_to_optional_str(df["name"]),
+            ticker=_to_optional_str(df["ticker"]),
+            isin=np.full(len(df), None, dtype=object),
+            quantity=quantity,
+            price=price,
+            price_currency=price_currency,
+            fees=to_units(fees),
+            fees_currency=fees_currency,
+            amount=to_units(amount),
+            amount_currency=amount_currency,
+        )
+
+    @staticmethod
+    def from_schwab_csv(content: str) -> "TransactionColumns":
+        """
+        Parse a transactions file exported from Schwab: the first line
+        contains the title of the document and the last row the total
+        """
+        lines = content.split("\n")[1:]
+        df = pd.read_csv(
+            io.StringIO("\n".join(lines)),
+            dtype=str,
+            keep_default_na=False,
+            na_filter=False,
+        ).iloc[:-1]
+
+        # Dates are sometime expressed as "mm/dd/yyyy as of mm/dd/yyy", in
+        # which case the first date is used
+        dates = pd.to_datetime(df["Date"].str.split(" ").str[0], format="%m/%d/%Y")
+
+        codes, uniques = pd.factorize(df["Action"])
+        known = [TransactionAction.from_schwab_action(a) for a in uniques]
+        action = np.array(known + [None], dtype=object)[codes]
+
+        price, price_currency = parse_prices(df["Price"])
+        fees, fees_currency = parse_prices(df["Fees & Comm"])
+
+        # Amounts of buy and tax transactions are negative
+        amount, amount_currency = parse_prices(df["Amount"])
+        negative = np.isin(action, [TransactionAction.TAX, TransactionAction.BUY])
+        if (amount[negative] > 0).any():
+            raise ValueError("Expected a negative value")
+        amount[negative] = -amount[negative]
+
+        quantity = df["Quantity"].replace("", np.nan).astype(np.float64).values
+
+        return TransactionColumns(
+            date=dates.values.astype("datetime64[ns]"),
+            action=action,
+            name=_to_optional_str(df["Description"]),
+            ticker=_to_optional_str(df["Symbol"]),
+            isin=np.full(len(df), None, dtype=object),
+            quantity=quantity,
+            price=price,
+            price_currency=price_currency,
+            fees=to_units(fees),
+            fees_currency=fees_currency,
+            amount=to_units(amount),
+            amount_currency=amount_currency,
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Columns as plain arrays (no python objects) so that they can be saved
+        without pickling: None becomes an empty string, actions and currencies
+        are stored by value and name.
+        """
+
+        def _names(values: np.ndarray, attr: Optional[str] = None) -> np.ndarray:
+            names = [
+                "" if v is None else (getattr(v, attr) if attr else v)
+                for v in values
+            ]
+            return np.array(names, dtype=str)
+
+        arrays = self.columns()
+        arrays["action"] = _names(self.action, "value")
+        for field in ["name", "ticker", "isin"]:
+            arrays[field] = _names(arrays[field])
+        for field in ["price_currency", "fees_currency", "amount_currency"]:
+            arrays[field] = _names(arrays[field], "name")
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: Mapping[str, np.ndarray]) -> "TransactionColumns":
+        """ Columns from arrays created with to_arrays() """
+
+        def _objects(values: np.ndarray, convert: Callable) -> np.ndarray:
+            res = np.empty(len(values), dtype=object)
+            res[:] = [None if v == "" else convert(v) for v in values.tolist()]
+            return res
+
+        columns = {field: arrays[field] for field in TransactionColumns.FIELDS}
+        columns["action"] = _objects(columns["action"], TransactionAction)
+        for field in ["name", "ticker", "isin"]:
+            columns[field] = _objects(columns[field], str)
+        for field in ["price_currency", "fees_currency", "amount_currency"]:
+            columns[field] = _objects(columns[field], Currency.__getitem__)
+        return TransactionColumns(**columns)
+
+    def holding_keys(
+        self, actions: Iterable[TransactionAction] = HOLDING_ACTIONS
+    ) -> np.ndarray:
+        """
+        Holding key of each row (see Transaction.get_holding_key), None for
+        rows whose action is not one of actions
+        """
+        keys = self.isin.copy()
+        for field in [self.ticker, self.name]:
+            missing = pd.isna(keys)
+            keys[missing] = field[missing]
+        keys[~np.isin(self.action, list(actions))] = None
+        return keys
+
+    def sorted_by_date(
+        self, end_date: Optional[datetime] = None
+    ) -> "TransactionColumns":
+        """
+        Rows sorted by date (keeping the original order among rows with the same
+        date), optionally dropping transactions after end_date.
+        """
+        rows = np.arange(len(self))
+        if end_date is not None:
+            rows = rows[self.date[rows] <= np.datetime64(pd.Timestamp(end_date))]
+        rows = rows[np.argsort(self.date[rows], kind="stable")]
+        return self.take(rows)
+
+    def to_transactions(self) -> List[Transaction]:
+        """
+        Build a Transaction object for each row, rows of validated columns
+        aren't checked again
+        """
+
+        def _price(amount: float, currency: Optional[Currency]) -> Optional[Price]:
+            if currency is None:
+                return None
+            return Price(currency=currency, amount=amount)
+
+        def _interned(values: np.ndarray) -> List[Optional[str]]:
+            # Rows with the same identifier share one (interned) string
+            codes, uniques = pd.factorize(values)
+            uniques = [sys.intern(u) for u in uniques] + [None]
+            return [uniques[c] for c in codes.tolist()]
+
+        dates = pd.DatetimeIndex(self.date).to_pydatetime()
+        quantities = [None if np.isnan(q) else q for q in self.quantity.tolist()]
+        make = Transaction.from_validated if self.validated else Transaction
+
+        return [
+            make(
+                action=action,
+                date=date,
+                ticker=ticker,
+                isin=isin,
+                name=name,
+                quantity=quantity,
+                price=_price(price, price_currency),
+                fees=_price(fees, fees_currency),
+                amount=_price(amount, amount_currency),
+            )
+            for (
+                date,
+                action,
+                name,
+                ticker,
+                isin,
+                quantity,
+                price,
+                price_currency,
+                fees,
+                fees_currency,
+                amount,
+                amount_currency,
+            ) in zip(
+                dates,
+                self.action,
+                _interned(self.name),
+                _interned(self.ticker),
+                _interned(self.isin),
+                quantities,
+                self.price.tolist(),
+                self.price_currency,
+                from_units(self.fees).tolist(),
+                self.fees_currency,
+                from_units(self.amount).tolist(),
+                self.amount_currency,
+            )
+        ]
+
+
+class TransactionsIndex:
+    """
+    Rows of the transactions done for each holding.
+
+    Rows are grouped by ISIN, ticker and name: the rows having the same value
+    are stored contiguously (in their original order, i.e. sorted by date if
+    the columns are) and each value maps to its slice. A holding is looked up
+    by the field of its key, the other fields it has are then checked on the
+    rows of the slice only (same rules as Holding.match_transaction).
+
+    The index serves lookups of a few holdings (see
+    Config.transactions_by_holding). Analysis goes through all transactions
+    at once instead, mapping each one to its holding with the registry it
+    shares with Project (see HoldingRegistry).
+    """
+
+    ID_FIELDS = ("isin", "ticker", "name")
+
+    def __init__(self, columns: TransactionColumns):
+        self.columns = columns
+        self._groups = {
+            field: self._group(getattr(columns, field)) for field in self.ID_FIELDS
+        }
+
+    @staticmethod
+    def _group(values: np.ndarray) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+        # Rows with None get a negative code and are left out
+        codes, uniques = pd.factorize(values)
+        rows = np.argsort(codes, kind="stable")
+        rows = rows[codes[rows] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return {v: i for i, v in enumerate(uniques)}, rows, offsets
+
+    def get_rows(self, holding: Holding) -> np.ndarray:
+        """ Rows (sorted) of all transactions done for holding """
+        fields = [f for f in self.ID_FIELDS if getattr(holding, f) is not None]
+        if not fields:
+            return np.arange(len(self.columns))
+
+        positions, rows, offsets = self._groups[fields[0]]
+        pos = positions.get(getattr(holding, fields[0]))
+        if pos is None:
+            return np.array([], dtype=np.int64)
+
+        found = rows[offsets[pos] : offsets[pos + 1]]
+        for field in fields[1:]:
+            found = found[getattr(self.columns, field)[found] == getattr(holding, field)]
+        return found
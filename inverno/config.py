@@ -2,19 +2,41 @@
 Config
 """
 
-from typing import List, Dict, Optional, Generator, Any
+from typing import List, Dict, Optional, Any, Hashable, Tuple, Union
 from collections import defaultdict
 from enum import Enum
 import os
-import csv
+import json
+import hashlib
 import datetime
 import yaml
 import pandas as pd
 import numpy as np
 import dateutil.parser
-from .price import Price, Currency
-from .transaction import Transaction, TransactionAction
+from .price import Currency
+from .transaction import Transaction
 from .holding import Holding
+from .columnar import TransactionColumns, TransactionsIndex, read_prices_csv
+from .cache import TransactionsCache, CACHE_DIR
+from .matcher import HoldingMatcher, HoldingsIndex
+from .meta import MetaResolver
+from .registry import HoldingRegistry
+from .timeline import BalanceTimeline
+from .validation import TransactionsValidator
+from .dedup import drop_duplicates
+from .common import log_info
+
+# Benchmarks shown when none is configured
+DEFAULT_BENCHMARKS = [
+    {"name": "S&P 500", "ticker": "^GSPC"},
+    {"name": "DJIA", "ticker": "^DJI"},
+    {"name": "NASDAQ", "ticker": "^IXIC"},
+    {"name": "Russell 2000", "ticker": "^RUT"},
+]
+
+# Use the (much faster) libyaml loader when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 class ConfKeys(Enum):
     OPTIONS = "options"
@@ -28,27 +50,99 @@ class ConfKeys(Enum):
 class Config:
     """ Utility class representing a yaml project config """
 
-    def __init__(self, cfg: str, path=None):
-        self._cfg = yaml.load(cfg, Loader=yaml.SafeLoader)
+    def __init__(
+        self, cfg: str, path=None, cache: Optional[TransactionsCache] = None
+    ):
+        self._cfg = yaml.load(cfg, Loader=YAML_LOADER)
         self._transactions = None
+        self._transactions_columns = None
+        self._transactions_index = None
+        self._holdings_registry = None
+        self._balance_timeline = None
         self._prices = None
         self._holding_to_currency = {}
+        self._prices_matcher = None
+        self._meta_matcher = None
+        self._meta_holdings = None
         self._files_provided = {}
+        self._prices_files = {}
         self._path = path
+        self._cache = cache
 
         self._load_includes()
 
+    def _get_includes(self) -> List[Dict]:
+        """
+        Configs included (directly or not) by this one, each parsed once, in
+        the order they are merged: a config comes after the configs it
+        includes, and among included configs the last ones come first.
+        """
+        parsed = set()
+        visiting = [] if self._path is None else [os.path.realpath(self._path)]
+        includes = []
+
+        def _visit(cfg: Dict, path: Optional[str]):
+            for include in reversed(cfg.get(ConfKeys.INCLUDE.value) or []):
+                if path is not None and not os.path.isabs(include):
+                    include = os.path.join(os.path.dirname(path), include)
+
+                # Files are identified by canonical path
+                canonical = os.path.realpath(include)
+                if canonical in visiting:
+                    cycle = visiting[visiting.index(canonical) :] + [canonical]
+                    raise ValueError(f"Include cycle: {' -> '.join(cycle)}")
+                if canonical in parsed:
+                    continue
+                parsed.add(canonical)
+
+                if include in self._files_provided:
+                    content = self._files_provided[include]
+                else:
+                    with open(include) as fd:
+                        content = fd.read()
+                included = yaml.load(content, Loader=YAML_LOADER) or {}
+
+                visiting.append(canonical)
+                _visit(included, include)
+                visiting.pop()
+                includes.append(included)
+
+        _visit(self._cfg, self._path)
+        return includes
+
     def _load_includes(self):
-        for path in (self._cfg.get(ConfKeys.INCLUDE.value) or []):
-            cfg_str = self._read_file(path=path)
-            cfg = Config(cfg=cfg_str, path=path)
-            self.merge(cfg=cfg)
+        includes = self._get_includes()
+        if not includes:
+            return
+
+        # Merge all configs at once, the ones coming later have precedence
+        options = {}
+        sections = {
+            key.value: []
+            for key in [ConfKeys.META, ConfKeys.TRANSACTIONS, ConfKeys.PRICES]
+        }
+        for cfg in includes + [self._cfg]:
+            options.update(cfg.get(ConfKeys.OPTIONS.value) or {})
+            for key, entries in sections.items():
+                entries.extend(cfg.get(key) or [])
+
+        self._cfg[ConfKeys.OPTIONS.value] = options
+        self._cfg.update(sections)
 
     @staticmethod
-    def from_file(path: str):
-        """ Create Config object from file """
+    def from_file(path: str, use_cache: bool = True):
+        """
+        Create Config object from file. Unless use_cache is False, parsed
+        transactions are cached in a directory next to the file.
+        """
+        cache = None
+        if use_cache:
+            cache = TransactionsCache(
+                directory=os.path.join(os.path.dirname(path), CACHE_DIR)
+            )
+
         with open(path) as fd:
-            return Config(cfg=fd.read(), path=path)
+            return Config(cfg=fd.read(), path=path, cache=cache)
 
     def merge(self, cfg: "Config"):
         self._cfg[ConfKeys.OPTIONS.value] = {
@@ -71,6 +165,11 @@ class Config:
             *(self._cfg.get(ConfKeys.PRICES.value) or []),
         ]
 
+        # Match sections changed, indexes are built again when needed
+        self._prices_matcher = None
+        self._meta_matcher = None
+        self._meta_holdings = None
+
 
 
     def provide_file(self, path: str, content: str):
@@ -81,10 +180,15 @@ class Config:
         This is similar to mocking.
         """
         self._files_provided[path] = content
+        self._prices_files.pop(path, None)
 
-    def _read_file(self, path: str) -> str:
+    def resolve_path(self, path: str) -> str:
         if not os.path.isabs(path) and self._path is not None:
             path = os.path.join(os.path.dirname(self._path), path)
+        return path
+
+    def _read_file(self, path: str) -> str:
+        path = self.resolve_path(path)
 
         if path in self._files_provided:
             return self._files_provided[path]
@@ -121,6 +225,55 @@ class Config:
         """ When to start the analysis """
         return self.end_date - datetime.timedelta(days=self.days)
 
+    @property
+    def price_freshness(self) -> float:
+        """ Hours after which prices of recent days are fetched again """
+        freshness = self._get_opt("price_freshness")
+        if freshness is None:
+            return 12
+        return float(freshness)
+
+    @property
+    def price_providers(self) -> List[Union[str, Dict[str, str]]]:
+        """ Sources of prices, in order of preference (see make_provider) """
+        return self._get_opt("price_providers") or ["csv", "cache", "yahoo"]
+
+    @property
+    def benchmarks(self) -> List[Dict[str, str]]:
+        """
+        Benchmarks to compare earnings with, each one has a name and either a
+        ticker or a prices file
+        """
+        benchmarks = self._get_opt("benchmarks")
+        if benchmarks is None:
+            return DEFAULT_BENCHMARKS
+
+        res = []
+        for benchmark in benchmarks:
+            if (
+                not isinstance(benchmark, dict)
+                or "name" not in benchmark
+                or ("ticker" in benchmark) == ("file" in benchmark)
+            ):
+                raise ValueError(
+                    "Benchmarks must contain a name and either a ticker or a file"
+                )
+            benchmark = dict(benchmark)
+            if "file" in benchmark:
+                benchmark["file"] = self.resolve_path(benchmark["file"])
+            res.append(benchmark)
+        return res
+
+    @property
+    def fetch_workers(self) -> int:
+        """ Maximum number of concurrent fetches of remote data """
+        return self._get_opt("fetch_workers") or 8
+
+    @property
+    def dedup_transactions(self) -> bool:
+        """ Whether to drop transactions repeated across transactions files """
+        return bool(self._get_opt("dedup_transactions"))
+
     @property
     def currency(self) -> Currency:
         """ Base currency to use """
@@ -129,46 +282,109 @@ class Config:
             return Currency.USD
         return Currency[curr]
 
+    @property
+    def transactions_columns(self) -> TransactionColumns:
+        """ All transactions ever done stored column-wise (sorted by date) """
+        if self._transactions_columns is None:
+            self._transactions_columns = self._load_transactions()
+        return self._transactions_columns
+
     @property
     def transactions(self) -> List[Transaction]:
-        """ All transactions ever done (random order) """
+        """ All transactions ever done (sorted by date) """
         if self._transactions is None:
-            self._transactions = self._load_transactions()
+            self._transactions = self.transactions_columns.to_transactions()
         return self._transactions
 
-    def transactions_by_holding(
-        self, holding: Holding
-    ) -> Generator[Transaction, None, None]:
-        """ All transactions ever done for the given holding """
-        for trs in self.transactions:
-            if holding.match_transaction(transaction=trs):
-                yield trs
-
-    def _match_holding(self, match_section: Dict, holding: Holding) -> bool:
-        if not isinstance(match_section, dict):
-            raise ValueError("Expected a matching list")
-
-        h = holding
-        m = match_section
-        t = "ticker"
-        i = "isin"
-        n = "name"
-
-        return (
-            (m.get(t) is None or m[t].strip() == getattr(h, t))
-            and (m.get(i) is None or m[i].strip() == getattr(h, i))
-            and (m.get(n) is None or m[n].strip() == getattr(h, n))
-        )
+    @property
+    def transactions_index(self) -> TransactionsIndex:
+        """ Rows of transactions_columns for each holding """
+        if self._transactions_index is None:
+            self._transactions_index = TransactionsIndex(self.transactions_columns)
+        return self._transactions_index
+
+    @property
+    def holdings_registry(self) -> HoldingRegistry:
+        """ IDs of the holdings bought, sold or vested in transactions """
+        if self._holdings_registry is None:
+            self._holdings_registry = HoldingRegistry.from_columns(
+                self.transactions_columns
+            )
+        return self._holdings_registry
 
-    def _find_matching_entry(self, config_section: List[Dict], holding: Holding):
+    def _get_timeline_path(self) -> str:
+        """
+        Where the timeline is saved, configs sharing the cache directory each
+        get their own file
+        """
+        name = hashlib.sha1(os.path.abspath(self._path or "").encode()).hexdigest()
+        return os.path.join(self._cache.directory, f"balance_timeline_{name}.npz")
+
+    @property
+    def balance_timeline(self) -> BalanceTimeline:
+        """
+        Balances of the transactions over time (see BalanceTimeline). When
+        transactions are cached, the timeline is saved along with them and
+        reused as long as its transactions are still the first ones: rows
+        appended since then are added to the saved timeline.
+        """
+        if self._balance_timeline is None:
+            columns = self.transactions_columns
+            timeline = None
+            if self._cache is not None:
+                timeline = BalanceTimeline.load(self._get_timeline_path())
+            if timeline is not None and (
+                len(timeline) > len(columns)
+                or timeline.fingerprint
+                != columns.take(slice(0, len(timeline))).get_digest()
+            ):
+                timeline = None
+
+            saved = timeline is not None and len(timeline) == len(columns)
+            if timeline is None:
+                timeline = BalanceTimeline.from_transactions(self.transactions)
+            elif not saved:
+                timeline = timeline.extend(self.transactions[len(timeline) :])
+
+            if self._cache is not None and not saved:
+                os.makedirs(self._cache.directory, exist_ok=True)
+                timeline.save(self._get_timeline_path(), columns.get_digest())
+            self._balance_timeline = timeline
+
+        return self._balance_timeline
+
+    def transactions_by_holding(self, holding: Holding) -> List[Transaction]:
+        """ All transactions ever done for the given holding (sorted by date) """
+        transactions = self.transactions
+        return [transactions[row] for row in self.transactions_index.get_rows(holding)]
+
+    @staticmethod
+    def _get_matcher(config_section: List[Dict]) -> HoldingMatcher:
         for entry in config_section:
             if not isinstance(entry, dict) or "match" not in entry:
                 raise ValueError("Expected a matching list")
             if not isinstance(entry["match"], dict):
                 raise ValueError("A match section must contain key,value pairs")
 
-            if self._match_holding(match_section=entry["match"], holding=holding):
-                return entry
+        return HoldingMatcher([entry["match"] for entry in config_section])
+
+    def get_prices_identity(self) -> Hashable:
+        """
+        Identifies the prices files of the config: configs with the same
+        identity provide the same prices
+        """
+        if self._files_provided:
+            # Provided contents can't be told apart from their paths
+            return self
+        entries = [
+            {
+                "match": entry.get("match"),
+                "file": self.resolve_path(entry["file"]) if "file" in entry else None,
+            }
+            for entry in self._cfg.get("prices") or []
+            if isinstance(entry, dict)
+        ]
+        return json.dumps(entries, sort_keys=True, default=str)
 
     def _get_prices_file(self, holding: Holding) -> Optional[str]:
         # If prices are provided use those (missing values are interpolated)
@@ -178,99 +394,19 @@ class Config:
         if not isinstance(self._cfg["prices"], list):
             raise ValueError("Prices section must contain a matching list")
 
-        match = self._find_matching_entry(
-            config_section=self._cfg["prices"], holding=holding
-        )
+        if self._prices_matcher is None:
+            self._prices_matcher = self._get_matcher(self._cfg["prices"])
 
-        if match is None:
+        pos = self._prices_matcher.find(holding)
+        if pos is None:
             return
+        match = self._cfg["prices"][pos]
 
         if "file" not in match:
             raise ValueError("Prices entries must contain a file field")
 
         return match["file"]
 
-    def _find_matching_holding(
-        self, match_section: Dict, holdings: List[Holding]
-    ) -> Holding:
-        if not isinstance(match_section, dict):
-            raise ValueError("Expected a matching list")
-
-        for holding in holdings:
-            if self._match_holding(match_section=match_section, holding=holding):
-                return holding
-
-    def _get_meta_attributes_apply(
-        self, attrs: Dict, holding: Holding, apply: Dict
-    ) -> defaultdict:
-        holding_key = holding.get_key()
-
-        for attr, val in apply.items():
-
-            # Apply has the precendence over everything else.
-            # If this attribute was already set, remove it.
-            for holdings_alloc in attrs[attr].values():
-                if holding_key in holdings_alloc:
-                    del holdings_alloc[holding_key]
-
-            if isinstance(val, str):
-                attrs[attr][val][holding_key] = 1
-
-            elif isinstance(val, dict):
-                for k, v in val.items():
-                    v = float(v.strip("%")) / 100.0
-                    attrs[attr][k][holding_key] = v
-
-    def _get_meta_attributes_composition(
-        self, attrs: Dict, holding: Holding, holdings: List[Holding], composition: Dict
-    ) -> defaultdict:
-        # Collect all sub holdings
-        sub_holdings = {}
-
-        def _collect_by(field: str):
-            if field not in composition:
-                return
-
-            if not isinstance(composition[field], dict):
-                raise ValueError("Components must be key value pairs")
-
-            for val, percentage in composition[field].items():
-
-                # Try to find holding among known holdings
-                sub_holding = self._find_matching_holding(
-                    {field: val},
-                    holdings,
-                )
-
-                if sub_holding is None:
-                    sub_holding = self._find_matching_holding(
-                        {field: val},
-                        self._collect_holdings_from_meta(),
-                    )
-
-                if sub_holding is None:
-                    continue
-
-                sub_holdings[sub_holding.get_key()] = {
-                    "holding": sub_holding,
-                    "percentage": float(percentage.strip("%")) / 100.0,
-                }
-
-        _collect_by("name")
-        _collect_by("ticker")
-        _collect_by("isin")
-
-        sub_holding_attrs = self.get_meta_attributes(
-            [s["holding"] for s in sub_holdings.values()]
-        )
-        for attr, entries in sub_holding_attrs.items():
-            for entry, holdings_alloc in entries.items():
-                for holding_key, sub_alloc_percentage in holdings_alloc.items():
-                    old_val = attrs[attr][entry].get(holding.get_key()) or 0.0
-                    attrs[attr][entry][holding.get_key()] = old_val + (
-                        sub_holdings[holding_key]["percentage"] * sub_alloc_percentage
-                    )
-
     def _collect_holdings_from_meta(self) -> List[Holding]:
         holdings = []
         meta = self._cfg.get("meta") or []
@@ -291,6 +427,11 @@ class Config:
             holdings.append(Holding(name=name, ticker=ticker, isin=isin))
         return holdings
 
+    def _get_meta_holdings(self) -> HoldingsIndex:
+        if self._meta_holdings is None:
+            self._meta_holdings = HoldingsIndex(self._collect_holdings_from_meta())
+        return self._meta_holdings
+
     def get_meta_attributes(self, holdings: List[Holding]) -> defaultdict:
         """
         Gets all meta attributes for the given list of holdings
@@ -307,28 +448,22 @@ class Config:
         if meta is None:
             return attrs
 
-        for entry in meta:
-            if not isinstance(entry, dict) or "match" not in entry:
-                raise ValueError("Expected a matching list")
-
-            holding = self._find_matching_holding(entry["match"], holdings=holdings)
-            if holding is None:
-                continue
+        if self._meta_matcher is None:
+            self._meta_matcher = self._get_matcher(meta)
 
-            if "composition" in entry:
-                self._get_meta_attributes_composition(
-                    attrs=attrs,
-                    holding=holding,
-                    holdings=holdings,
-                    composition=entry["composition"],
-                )
-
-            if "apply" in entry:
-                self._get_meta_attributes_apply(
-                    attrs=attrs, holding=holding, apply=entry["apply"]
-                )
+        resolver = MetaResolver(
+            meta=meta,
+            matcher=self._meta_matcher,
+            holdings=HoldingsIndex(holdings),
+            meta_holdings=self._get_meta_holdings(),
+        )
+        return resolver.resolve()
 
-        return attrs
+    def _read_prices_file(self, path: str) -> Tuple[pd.Series, Optional[Currency]]:
+        """ Prices and currency of a prices file, parsed once per run """
+        if path not in self._prices_files:
+            self._prices_files[path] = read_prices_csv(self._read_file(path))
+        return self._prices_files[path]
 
     def get_currency(self, holding: Holding) -> Optional[Currency]:
         """ Currency for the given holding (if provided) """
@@ -336,9 +471,8 @@ class Config:
         if path is None:
             return
 
-        for row in csv.DictReader(self._read_file(path)):
-            price = Price.from_str(price=row["price"])
-            return price.currency
+        _, currency = self._read_prices_file(path)
+        return currency
 
     def get_prices(
         self,
@@ -355,117 +489,67 @@ class Config:
         if end is None:
             end = self.end_date
 
+        # Select the rows within [start, end] from the sorted dates
+        history, _ = self._read_prices_file(path)
+        dates = history.index.values
+        first = dates.searchsorted(np.datetime64(pd.Timestamp(start)), side="left")
+        last = dates.searchsorted(np.datetime64(pd.Timestamp(end)), side="right")
+        window = history.iloc[first:last]
+
         index = pd.date_range(start=start, end=end, freq="D")
-        prices = pd.Series(index=index, dtype=np.float64)
+        prices = window.reindex(index.union(window.index))
         prices.name = holding.get_key()
 
-        for row in csv.DictReader(self._read_file(path).split("\n")):
-            date = dateutil.parser.parse(row["date"], dayfirst=True)
-            price = Price.from_str(price=row["price"])
-
-            if date >= start and date <= end:
-                prices[date] = price.amount
-
         return prices
 
-    def _load_transactions_schwab(self, filename: str) -> List[Transaction]:
-        trs = []
-
-        csvfile = self._read_file(filename).split("\n")
-
-        # skip first line, which contains the document title
-        csvfile = csvfile[1:]
-
-        # skip last line, which contains the total
-        for row in list(csv.DictReader(csvfile))[:-1]:
-            # dates are sometime expressed as "mm/dd/yyyy as of mm/dd/yyy"
-            # in which case we pick the first date
-            date_str = row["Date"].split(" ")[0]
-            date = datetime.datetime.strptime(date_str, "%m/%d/%Y")
-
-            action = TransactionAction.from_schwab_action(row["Action"])
-
-            price_str = row["Price"]
-            price = Price.from_str(price_str) if price_str else None
-
-            fees_str = row["Fees & Comm"]
-            fees = Price.from_str(fees_str) if fees_str else None
-
-            quantity_str = row["Quantity"]
-            quantity = float(quantity_str) if quantity_str else None
-
-            amount_str = row["Amount"]
-            if amount_str:
-                if action == TransactionAction.TAX or action == TransactionAction.BUY:
-                    amount = Price.from_str(amount_str, expect_negative=True)
-                else:
-                    amount = Price.from_str(amount_str)
-            else:
-                amount = None
-
-            trs.append(
-                Transaction(
-                    action=action,
-                    date=date,
-                    ticker=row["Symbol"] or None,
-                    name=row["Description"] or None,
-                    price=price,
-                    quantity=quantity,
-                    fees=fees,
-                    amount=amount,
-                )
+    def _parse_transactions_schwab(self, content: str) -> TransactionColumns:
+        return TransactionColumns.from_schwab_csv(content)
+
+    def _parse_transactions_standard(self, content: str) -> TransactionColumns:
+        return TransactionColumns.from_standard_csv(content)
+
+    def _parse_transactions_standard_tail(
+        self, header: str, tail: str
+    ) -> TransactionColumns:
+        return TransactionColumns.from_standard_csv(header + tail)
+
+    def _load_transactions_file(self, filename: str, fmt: str) -> TransactionColumns:
+        parse_tail = None
+        if fmt == "standard":
+            parse = self._parse_transactions_standard
+            parse_tail = self._parse_transactions_standard_tail
+        elif fmt == "schwab":
+            parse = self._parse_transactions_schwab
+        else:
+            raise ValueError(f"Unsupported transactions' format {fmt}")
+
+        path = self.resolve_path(filename)
+        if self._cache is None or path in self._files_provided:
+            return parse(self._read_file(filename))
+
+        return self._cache.load(path=path, fmt=fmt, parse=parse, parse_tail=parse_tail)
+
+    def _load_transactions(self) -> TransactionColumns:
+        tables = []
+        validator = TransactionsValidator()
+        for entry in self._cfg.get("transactions") or []:
+            columns = self._load_transactions_file(
+                filename=entry["file"], fmt=entry["format"]
             )
-        return trs
-
-    def _load_transactions_standard(self, filename: str) -> List[Transaction]:
-        trs = []
-        for row in list(csv.DictReader(self._read_file(filename).split("\n"))):
-            date = dateutil.parser.parse(row["date"], dayfirst=True)
-            action = TransactionAction(row["action"])
-            price_str = row["price"]
-            price = Price.from_str(price_str) if price_str else None
-
-            fees_str = row["fees"]
-            fees = Price.from_str(fees_str) if fees_str else None
-
-            quantity_str = row["quantity"]
-            quantity = float(quantity_str) if quantity_str else None
-
-            amount_str = row["amount"]
-            amount = Price.from_str(amount_str) if amount_str else None
-
-            trs.append(
-                Transaction(
-                    action=action,
-                    date=date,
-                    ticker=row["ticker"] or None,
-                    name=row["name"] or None,
-                    price=price,
-                    quantity=quantity,
-                    fees=fees,
-                    amount=amount,
-                )
-            )
-        return trs
-
-    def _load_transactions(self) -> List[Transaction]:
-        transactions = []
+            tables.append(validator.validate(columns, source=entry["file"]))
 
-        if "transactions" not in self._cfg:
-            return transactions
+        if self._cache is not None:
+            self._cache.log_stats()
 
-        for entry in self._cfg["transactions"]:
-            loader = entry["format"]
-            if loader == "standard":
-                transactions.extend(
-                    self._load_transactions_standard(filename=entry["file"])
-                )
-            elif loader == "schwab":
-                transactions.extend(
-                    self._load_transactions_schwab(filename=entry["file"])
-                )
-            else:
-                raise ValueError(f"Unsupported transactions' format {loader}")
+        # Errors of all files are reported at once
+        validator.check()
 
-        transactions = filter(lambda trs: trs.date <= self.end_date, transactions)
-        return list(sorted(transactions, key=lambda trs: trs.date))
+        if self.dedup_transactions:
+            tables, dropped = drop_duplicates(tables)
+            for entry, count in zip(self._cfg.get("transactions") or [], dropped):
+                if count > 0:
+                    log_info(
+                        f"Dropped {count} duplicated transaction(s)"
+                        f" from {entry['file']}"
+                    )
+        return TransactionColumns.concat(tables).sorted_by_date(end_date=self.end_date)
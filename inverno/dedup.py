@@ -0,0 +1,59 @@
+"""
+De-duplication of transactions loaded from overlapping files
+"""
+
+from typing import List, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from .columnar import TransactionColumns
+
+
+def get_fingerprints(columns: TransactionColumns) -> np.ndarray:
+    """
+    Fingerprint of each row: rows get the same (integer) fingerprint if and
+    only if all their fields are equal, as done by Transaction.__eq__.
+    Fields are hashed one at a time, in linear time.
+    """
+    fingerprints = np.zeros(len(columns), dtype=np.int64)
+    for values in columns.columns().values():
+        # Missing values (None, NaN) share code -1, shifted to 0
+        codes, uniques = pd.factorize(values)
+        combined = fingerprints * (len(uniques) + 1) + (codes + 1)
+        # Renumber the combinations seen so far, so that they can't overflow
+        fingerprints, _ = pd.factorize(combined)
+    return fingerprints.astype(np.int64)
+
+
+def drop_duplicates(
+    tables: Sequence[TransactionColumns],
+) -> Tuple[List[TransactionColumns], List[int]]:
+    """
+    Drop the rows of each table already found in the previous tables, returns
+    the remaining rows along with the number of rows dropped from each table.
+
+    Tables are expected to be exports of the same account covering
+    overlapping periods, so identical rows within a table are kept (e.g. two
+    equal purchases on the same day): a row is only dropped as many times as
+    it appears in one of the previous tables.
+    """
+    fingerprints = get_fingerprints(TransactionColumns.concat(tables))
+    # Occurrences of each fingerprint in the tables seen so far (the most
+    # found in a single table)
+    seen = np.zeros(int(fingerprints.max(initial=-1)) + 1, dtype=np.int64)
+
+    res = []
+    dropped = []
+    begin = 0
+    for table in tables:
+        codes = fingerprints[begin : begin + len(table)]
+        begin += len(table)
+
+        # Rank of each row among the equal rows of the table
+        ranks = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+        keep = ranks >= seen[codes]
+        np.maximum.at(seen, codes, ranks + 1)
+
+        res.append(table if keep.all() else table.take(keep))
+        dropped.append(int(len(table) - keep.sum()))
+
+    return res, dropped
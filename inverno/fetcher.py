@@ -0,0 +1,109 @@
+"""
+Concurrent fetching of remote data
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from .common import log_info, log_warning
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Host of Yahoo Finance's API, shared by prices and holdings info requests
+YAHOO_HOST = "query1.finance.yahoo.com"
+
+
+class Fetcher:
+    """
+    Runs fetches (e.g. network requests) concurrently on a bounded pool of
+    threads.
+
+    At most per_host fetches run at the same time against the same host,
+    unless host_limits sets a different limit for it.
+    Fetches failing with one of the retry_on exceptions are retried up to
+    retries times, waiting backoff seconds before the first retry and twice
+    as long before each of the following ones.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host: int = 4,
+        host_limits: Optional[Dict[str, int]] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        retry_on: Tuple[Type[BaseException], ...] = (OSError,),
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.host_limits = host_limits or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self._sleep = sleep
+        self._hosts: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def _get_host_limit(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._hosts:
+                limit = self.host_limits.get(host, self.per_host)
+                self._hosts[host] = threading.Semaphore(limit)
+            return self._hosts[host]
+
+    def _run(self, func: Callable[[T], R], item: T, host: Optional[str]) -> R:
+        attempt = 0
+        while True:
+            try:
+                if host is None:
+                    return func(item)
+                with self._get_host_limit(host):
+                    return func(item)
+            except self.retry_on as exc:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                log_warning(f"Fetch failed ({exc}), retrying in {delay:.1f}s")
+                self._sleep(delay)
+                attempt += 1
+
+    def map(
+        self,
+        func: Callable[[T], R],
+        items: Iterable[T],
+        host: Callable[[T], Optional[str]] = lambda _: None,
+        desc: str = "Fetching",
+        skip_errors: bool = False,
+    ) -> List[Optional[R]]:
+        """
+        Results of func for each item, in the same order as items.
+        host gives the host contacted when fetching an item (None if the item
+        doesn't need any host). If some fetches fail, the error of the first
+        failing item is raised once all fetches are done, or, if skip_errors,
+        their result is None.
+        """
+        items = list(items)
+        done = [0]
+
+        def _fetch(item: T) -> R:
+            try:
+                return self._run(func, item, host(item))
+            except self.retry_on as exc:
+                if not skip_errors:
+                    raise
+                log_warning(f"{desc}: giving up after {self.retries} retries ({exc})")
+                return None
+            finally:
+                with self._lock:
+                    done[0] += 1
+                    log_info(f"{desc}: {done[0]}/{len(items)}")
+
+        if not items:
+            return []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_fetch, item) for item in items]
+            return [future.result() for future in futures]
@@ -1,8 +1,11 @@
 from typing import Optional, Union
+import sys
 from .price import Price
 from .transaction import Transaction
 
 class Holding:
+    __slots__ = ("quantity", "name", "ticker", "isin", "_key")
+
     def __init__(
         self,
         quantity: Optional[float] = None,
@@ -14,8 +17,15 @@ class Holding:
         self.name = None if name is None else name.strip()
         self.ticker = None if ticker is None else ticker.strip()
         self.isin = None if isin is None else isin.strip()
+        self._key = None
 
     def get_key(self):
+        # Identifiers never change, the key is computed once
+        if self._key is None:
+            self._key = sys.intern(self._get_key())
+        return self._key
+
+    def _get_key(self):
         # prioritize stronger identifiers
         if self.isin is not None:
             return self.isin
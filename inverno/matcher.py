@@ -0,0 +1,87 @@
+"""
+Hash indexes for matching holdings against match sections of the config
+"""
+
+from typing import Dict, List, Optional, Tuple
+from .holding import Holding
+
+# Holding fields a match section can refer to
+MATCH_FIELDS = ("ticker", "isin", "name")
+
+
+def get_match_fields(match_section: Dict) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Fields a match section refers to and the (stripped) values they must
+    have. A holding matches the section if all these fields are equal.
+    """
+    if not isinstance(match_section, dict):
+        raise ValueError("Expected a matching list")
+
+    fields = tuple(f for f in MATCH_FIELDS if match_section.get(f) is not None)
+    return fields, tuple(match_section[f].strip() for f in fields)
+
+
+def _get_holding_values(holding: Holding, fields: Tuple[str, ...]) -> Tuple:
+    return tuple(getattr(holding, f) for f in fields)
+
+
+class HoldingMatcher:
+    """
+    Index of a list of match sections. Sections are grouped by the fields
+    they refer to, so that finding the first section matching a holding takes
+    one lookup per group of fields rather than a scan of the list.
+    """
+
+    def __init__(self, match_sections: List[Dict]):
+        # Fields and values of each section
+        self.sections = [get_match_fields(m) for m in match_sections]
+
+        self._index: Dict[Tuple[str, ...], Dict[Tuple, List[int]]] = {}
+        for pos, (fields, values) in enumerate(self.sections):
+            self._index.setdefault(fields, {}).setdefault(values, []).append(pos)
+
+    def find(self, holding: Holding) -> Optional[int]:
+        """ Position of the first section matching holding """
+        found = None
+        for fields, positions in self._index.items():
+            pos = positions.get(_get_holding_values(holding, fields))
+            if pos is not None and (found is None or pos[0] < found):
+                found = pos[0]
+        return found
+
+    def find_all(self, holdings: List[Holding]) -> List[int]:
+        """ Positions (sorted) of the sections matching any of holdings """
+        found = set()
+        for holding in holdings:
+            for fields, positions in self._index.items():
+                found.update(positions.get(_get_holding_values(holding, fields), ()))
+        return sorted(found)
+
+
+class HoldingsIndex:
+    """
+    Index of a list of holdings, to find the first holding matching a match
+    section. An index on a group of fields is built the first time a section
+    refers to it.
+    """
+
+    def __init__(self, holdings: List[Holding]):
+        self.holdings = holdings
+        self._index: Dict[Tuple[str, ...], Dict[Tuple, Holding]] = {}
+
+    def find(self, match_section: Dict) -> Optional[Holding]:
+        """ First holding matching the match section """
+        return self.find_by_fields(*get_match_fields(match_section))
+
+    def find_by_fields(
+        self, fields: Tuple[str, ...], values: Tuple[str, ...]
+    ) -> Optional[Holding]:
+        """ First holding whose fields have the given values """
+        index = self._index.get(fields)
+        if index is None:
+            index = {}
+            for holding in self.holdings:
+                index.setdefault(_get_holding_values(holding, fields), holding)
+            self._index[fields] = index
+
+        return index.get(values)
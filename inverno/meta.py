@@ -0,0 +1,183 @@
+"""
+Resolution of meta attributes, including compositions of holdings
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from .holding import Holding
+from .matcher import HoldingMatcher, HoldingsIndex
+
+# Attribute weights of one holding: weights[<attribute name>][<entry>] = x
+Weights = Dict[str, Dict[str, float]]
+
+# Fields by which components of a composition can be given
+COMPOSITION_FIELDS = ("name", "ticker", "isin")
+
+
+def _get_identity(holding: Holding) -> Tuple:
+    return (holding.name, holding.ticker, holding.isin)
+
+
+def _parse_percentage(percentage: str) -> float:
+    return float(percentage.strip("%")) / 100.0
+
+
+class MetaResolver:
+    """
+    Resolves the meta attributes of holdings. Compositions form a graph
+    of holdings (a fund points to the holdings it is made of) which is
+    visited in topological order, so that the weights of each holding are
+    computed once from the already flattened weights of its components.
+    """
+
+    def __init__(
+        self,
+        meta: List[Dict],
+        matcher: HoldingMatcher,
+        holdings: HoldingsIndex,
+        meta_holdings: HoldingsIndex,
+    ):
+        self.meta = meta
+        self.matcher = matcher
+        # Components are searched among holdings, then among meta_holdings
+        self.holdings = holdings
+        self.meta_holdings = meta_holdings
+        self._components: Dict[Tuple, Dict[int, Dict[str, Tuple]]] = {}
+        self._weights: Dict[Tuple, Weights] = {}
+
+    def _find_component(self, field: str, val: str) -> Optional[Holding]:
+        holding = self.holdings.find({field: val})
+        if holding is None:
+            holding = self.meta_holdings.find({field: val})
+        return holding
+
+    def _get_entry_components(self, composition: Dict) -> Dict[str, Tuple]:
+        """ Components (holding and percentage) of a composition, by key """
+        components = {}
+        for field in COMPOSITION_FIELDS:
+            if field not in composition:
+                continue
+
+            if not isinstance(composition[field], dict):
+                raise ValueError("Components must be key value pairs")
+
+            for val, percentage in composition[field].items():
+                holding = self._find_component(field, val)
+                if holding is not None:
+                    components[holding.get_key()] = (
+                        holding,
+                        _parse_percentage(percentage),
+                    )
+        return components
+
+    def _get_components(self, holding: Holding) -> Dict[int, Dict[str, Tuple]]:
+        """ Components of each composition (by position) matching holding """
+        identity = _get_identity(holding)
+        if identity not in self._components:
+            self._components[identity] = {
+                pos: self._get_entry_components(self.meta[pos]["composition"])
+                for pos in self.matcher.find_all([holding])
+                if "composition" in self.meta[pos]
+            }
+        return self._components[identity]
+
+    def _get_order(self, holdings: List[Holding]) -> List[Holding]:
+        """
+        Components of the given holdings (and their components) in
+        topological order, i.e. every holding comes after its components
+        """
+        order = []
+        visiting: Dict[Tuple, Holding] = {}
+        done = set(self._weights)
+
+        def _visit(holding: Holding):
+            identity = _get_identity(holding)
+            if identity in done:
+                return
+            if identity in visiting:
+                path = list(visiting.values())
+                cycle = path[list(visiting).index(identity) :] + [holding]
+                raise ValueError(
+                    "Cycle in meta compositions: "
+                    + " -> ".join(h.get_key() for h in cycle)
+                )
+
+            visiting[identity] = holding
+            for components in self._get_components(holding).values():
+                for component, _ in components.values():
+                    _visit(component)
+            del visiting[identity]
+
+            done.add(identity)
+            order.append(holding)
+
+        for holding in holdings:
+            _visit(holding)
+        return order
+
+    @staticmethod
+    def _apply(attrs: Dict, key: str, apply: Dict):
+        for attr, val in apply.items():
+
+            # Apply has the precendence over everything else.
+            # If this attribute was already set, remove it.
+            for holdings_alloc in attrs[attr].values():
+                if key in holdings_alloc:
+                    del holdings_alloc[key]
+
+            if isinstance(val, str):
+                attrs[attr][val][key] = 1
+
+            elif isinstance(val, dict):
+                for k, v in val.items():
+                    attrs[attr][k][key] = _parse_percentage(v)
+
+    def _compose(self, attrs: Dict, key: str, components: Dict[str, Tuple]):
+        for component, percentage in components.values():
+            for attr, entries in self._weights[_get_identity(component)].items():
+                for name, weight in entries.items():
+                    old_val = attrs[attr][name].get(key) or 0.0
+                    attrs[attr][name][key] = old_val + percentage * weight
+
+    def _fold(self, attrs: Dict, holding: Holding, pos: int):
+        """ Applies the meta entry at position pos to holding """
+        entry = self.meta[pos]
+        key = holding.get_key()
+
+        if "composition" in entry:
+            self._compose(attrs, key, self._get_components(holding)[pos])
+
+        if "apply" in entry:
+            self._apply(attrs, key, entry["apply"])
+
+    def _get_weights(self, holding: Holding) -> Weights:
+        """ Flattened weights of holding, its components must be resolved """
+        attrs = defaultdict(lambda: defaultdict(dict))
+        for pos in self.matcher.find_all([holding]):
+            self._fold(attrs, holding, pos)
+
+        key = holding.get_key()
+        weights: Weights = {}
+        for attr, entries in attrs.items():
+            weights[attr] = {
+                name: alloc[key] for name, alloc in entries.items() if key in alloc
+            }
+        return weights
+
+    def resolve(self) -> defaultdict:
+        """
+        Meta attributes of the holdings, structured as follows:
+          attrs[<attribute name>][<entry>][<holding key>] = x
+        A meta entry applies to the first of the holdings it matches.
+        """
+        holdings = self.holdings.holdings
+
+        # Components are resolved before the holdings made of them
+        for holding in self._get_order(holdings):
+            self._weights[_get_identity(holding)] = self._get_weights(holding)
+
+        attrs = defaultdict(lambda: defaultdict(dict))
+        for pos in self.matcher.find_all(holdings):
+            holding = self.holdings.find_by_fields(*self.matcher.sections[pos])
+            self._fold(attrs, holding, pos)
+        return attrs
@@ -0,0 +1,44 @@
+"""
+Fixed-point amounts of money
+
+Amounts are stored as integers counting millionths of the currency unit
+(units), which is finer than the minor unit of any supported currency and
+keeps exact the amounts written with up to 6 decimals. Sums of units are
+exact, amounts are converted back to floats only when multiplied by
+prices or conversion rates.
+"""
+
+from typing import Union
+import numpy as np
+
+# Units per currency unit
+SCALE = 1_000_000
+
+# Units of missing amounts in arrays (e.g. transactions without fees)
+MISSING = np.iinfo(np.int64).min
+
+
+def to_unit(amount: float) -> int:
+    """ Units of an amount, rounded to the closest unit """
+    return int(round(amount * SCALE))
+
+
+def to_units(amounts: np.ndarray) -> np.ndarray:
+    """ Units of an array of amounts, NaNs are marked as MISSING """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    units = np.full(amounts.shape, MISSING, dtype=np.int64)
+    present = ~np.isnan(amounts)
+    units[present] = np.rint(amounts[present] * SCALE).astype(np.int64)
+    return units
+
+
+def from_units(units: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+    """
+    Amount of some units, or amounts of an array of units (NaN for MISSING
+    units)
+    """
+    if isinstance(units, np.ndarray):
+        amounts = units / SCALE
+        amounts[units == MISSING] = np.nan
+        return amounts
+    return units / SCALE
@@ -0,0 +1,151 @@
+from typing import Any, Hashable, Iterator, Mapping, Optional, Tuple
+
+# Each level of the trie consumes this many bits of the key's hash
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+_HASH_BITS = 64
+_MAX_DEPTH = (_HASH_BITS + _BITS - 1) // _BITS
+
+
+def _hash(key: Hashable) -> int:
+    return hash(key) & ((1 << _HASH_BITS) - 1)
+
+
+class PersistentMap(Mapping):
+    """
+    Immutable mapping with structural sharing (hash array mapped trie).
+
+    Updates never modify a map in place: set() returns a new map which shares
+    all untouched nodes with the original one, so that an update only copies
+    the O(log32 n) nodes along the path to the key. This makes it cheap to keep
+    around every intermediate version of a mapping (e.g. one per balance).
+
+    Like dict, iteration follows insertion order: each leaf keeps the sequence
+    number of the insertion of its key.
+
+    Nodes are tuples of _WIDTH slots, each slot being either empty (None),
+    a (key, value, seq) leaf, a sub-node or, at the maximum depth, a dict of
+    colliding keys mapping to (value, seq).
+    """
+
+    __slots__ = ("_root", "_size", "_seq")
+
+    def __init__(self, items: Optional[Mapping] = None):
+        self._root: Optional[tuple] = None
+        self._size = 0
+        self._seq = 0
+        if items:
+            for key, value in items.items():
+                self._root, added = self._set(
+                    self._root, 0, _hash(key), key, value, self._seq
+                )
+                self._size += added
+                self._seq += 1
+
+    @classmethod
+    def _make(cls, root: Optional[tuple], size: int, seq: int) -> "PersistentMap":
+        pmap = cls.__new__(cls)
+        pmap._root = root
+        pmap._size = size
+        pmap._seq = seq
+        return pmap
+
+    def set(self, key: Hashable, value: Any) -> "PersistentMap":
+        """ Return a new map where key is associated to value """
+        root, added = self._set(self._root, 0, _hash(key), key, value, self._seq)
+        return self._make(root, self._size + added, self._seq + 1)
+
+    @classmethod
+    def _set(
+        cls,
+        node: Optional[tuple],
+        depth: int,
+        h: int,
+        key: Hashable,
+        value: Any,
+        seq: int,
+    ) -> Tuple[tuple, int]:
+        slots = list(node) if node is not None else [None] * _WIDTH
+        idx = (h >> (depth * _BITS)) & _MASK
+        slot = slots[idx]
+        added = 0
+
+        if slot is None:
+            slots[idx] = (key, value, seq)
+            added = 1
+
+        elif isinstance(slot, dict):
+            bucket = dict(slot)
+            if key in bucket:
+                seq = bucket[key][1]
+            else:
+                added = 1
+            bucket[key] = (value, seq)
+            slots[idx] = bucket
+
+        elif len(slot) == 3:
+            old_key, old_value, old_seq = slot
+            if old_key == key:
+                # Updating a key doesn't change its position
+                slots[idx] = (key, value, old_seq)
+            elif depth + 1 >= _MAX_DEPTH:
+                slots[idx] = {old_key: (old_value, old_seq), key: (value, seq)}
+                added = 1
+            else:
+                sub, _ = cls._set(
+                    None, depth + 1, _hash(old_key), old_key, old_value, old_seq
+                )
+                slots[idx], added = cls._set(sub, depth + 1, h, key, value, seq)
+
+        else:
+            slots[idx], added = cls._set(slot, depth + 1, h, key, value, seq)
+
+        return tuple(slots), added
+
+    def __getitem__(self, key: Hashable) -> Any:
+        node = self._root
+        h = _hash(key)
+        depth = 0
+        while node is not None:
+            slot = node[(h >> (depth * _BITS)) & _MASK]
+            if slot is None:
+                break
+            if isinstance(slot, dict):
+                return slot[key][0]
+            if len(slot) == 3:
+                if slot[0] == key:
+                    return slot[1]
+                break
+            node = slot
+            depth += 1
+        raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator:
+        leaves = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            for slot in stack.pop():
+                if slot is None:
+                    continue
+                if isinstance(slot, dict):
+                    leaves.extend((seq, key) for key, (_, seq) in slot.items())
+                elif len(slot) == 3:
+                    leaves.append((slot[2], slot[0]))
+                else:
+                    stack.append(slot)
+        leaves.sort(key=lambda leaf: leaf[0])
+        return iter([key for _, key in leaves])
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __repr__(self):
+        return f"PersistentMap({dict(self.items())})"
@@ -0,0 +1,215 @@
+from typing import List, Dict, Optional
+import pandas as pd
+import numpy as np
+from .transaction import Transaction, TransactionAction
+from .price import Currency
+from .balance import Balance
+from .registry import HoldingRegistry
+from .money import to_unit, from_units
+
+
+class PositionDeltas:
+    """
+    Signed changes of holdings' quantities and cash caused by a list of
+    transactions, stored as flat arrays (one entry per change).
+    Changes follow the same rules used by Balance.process_transaction, and
+    record the position (row) of the transaction causing them. Cash changes
+    are in fixed point (units, see money.py).
+    """
+
+    def __init__(self):
+        self.holdings_dates: List[np.datetime64] = []
+        self.holdings_rows: List[int] = []
+        self.holdings_keys: List[str] = []
+        self.quantities: List[float] = []
+
+        self.cash_dates: List[np.datetime64] = []
+        self.cash_rows: List[int] = []
+        self.currencies: List[Currency] = []
+        self.amounts: List[int] = []
+
+        self._row = 0
+
+    def _add_holding(self, transaction: Transaction, quantity: float):
+        self.holdings_dates.append(transaction.date)
+        self.holdings_rows.append(self._row)
+        self.holdings_keys.append(transaction.get_holding_key())
+        self.quantities.append(quantity)
+
+    def _add_cash(self, transaction: Transaction, currency: Currency, amount: float):
+        self.cash_dates.append(transaction.date)
+        self.cash_rows.append(self._row)
+        self.currencies.append(currency)
+        self.amounts.append(to_unit(amount))
+
+    def _add_fees(self, transaction: Transaction, currency: Currency):
+        if transaction.fees:
+            self._add_cash(transaction, currency, -transaction.fees.amount)
+
+    def _add_balance(self, balance: Balance):
+        """ Changes leading from an empty balance to balance """
+        self._row = -1
+        for key, holding in balance.holdings.items():
+            self.holdings_dates.append(balance.date)
+            self.holdings_rows.append(self._row)
+            self.holdings_keys.append(key)
+            self.quantities.append(holding.quantity)
+
+        for currency, units in balance.cash.items():
+            self.cash_dates.append(balance.date)
+            self.cash_rows.append(self._row)
+            self.currencies.append(currency)
+            self.amounts.append(units)
+
+    @staticmethod
+    def from_transactions(
+        transactions: List[Transaction], opening: Optional[Balance] = None
+    ) -> "PositionDeltas":
+        """
+        Collect holdings and cash changes of a list of transactions, starting
+        from the opening balance (if any)
+        """
+        deltas = PositionDeltas()
+        if opening is not None:
+            deltas._add_balance(opening)
+
+        for row, trs in enumerate(transactions):
+            deltas._row = row
+            if trs.action == TransactionAction.BUY:
+                currency = trs.price.currency
+                deltas._add_cash(trs, currency, -(trs.price * trs.quantity).amount)
+                deltas._add_fees(trs, currency)
+                deltas._add_holding(trs, trs.quantity)
+
+            elif trs.action == TransactionAction.SELL:
+                currency = trs.price.currency
+                deltas._add_holding(trs, -trs.quantity)
+                deltas._add_cash(trs, currency, (trs.price * trs.quantity).amount)
+                deltas._add_fees(trs, currency)
+
+            elif trs.action in (TransactionAction.CASH_IN, TransactionAction.DIV):
+                deltas._add_cash(trs, trs.amount.currency, trs.amount.amount)
+                deltas._add_fees(trs, trs.amount.currency)
+
+            elif trs.action in (TransactionAction.CASH_OUT, TransactionAction.TAX):
+                deltas._add_cash(trs, trs.amount.currency, -trs.amount.amount)
+                deltas._add_fees(trs, trs.amount.currency)
+
+            elif trs.action == TransactionAction.VEST:
+                if trs.fees:
+                    deltas._add_fees(trs, trs.fees.currency)
+                deltas._add_holding(trs, trs.quantity)
+
+            else:
+                raise ValueError(
+                    f"Couldn't process transaction action {trs.action.name}:"
+                    " this action is currently not fully supported"
+                )
+
+        return deltas
+
+
+class Positions:
+    """
+    Daily quantities held for each holding and daily cash for each currency.
+
+    Quantities are stored as a (days x holdings) matrix and cash as a
+    (days x currencies) matrix, both aligned to a daily index.
+    """
+
+    def __init__(
+        self,
+        index: pd.DatetimeIndex,
+        holdings_keys: List[str],
+        quantities: np.ndarray,
+        currencies: List[Currency],
+        cash: np.ndarray,
+    ):
+        self.index = index
+        self.holdings_keys = holdings_keys
+        self.quantities = quantities
+        self.currencies = currencies
+        self.cash = cash
+
+    @staticmethod
+    def _get_rows(index: pd.DatetimeIndex, dates: List) -> np.ndarray:
+        """
+        Row of the index for each date, changes happened before the beginning
+        of the index are accounted in the first row. Dates past the end of
+        the index are marked with -1.
+        """
+        if not dates:
+            return np.zeros(0, dtype=np.int64)
+
+        dates = pd.DatetimeIndex([pd.Timestamp(d) for d in dates])
+        rows = index.searchsorted(dates, side="right") - 1
+        rows = np.maximum(rows, 0)
+        rows[dates > index.max()] = -1
+        return rows
+
+    @staticmethod
+    def _scatter(
+        index: pd.DatetimeIndex,
+        dates: List,
+        columns: np.ndarray,
+        values: List,
+        ncols: int,
+        dtype: type = np.float64,
+    ) -> np.ndarray:
+        """ Sum values into a (days x ncols) matrix, accumulated over time """
+        matrix = np.zeros((len(index), ncols), dtype=dtype)
+        if len(index) == 0:
+            return matrix
+
+        rows = Positions._get_rows(index, dates)
+        values = np.asarray(values, dtype=dtype)
+        mask = (rows >= 0) & (columns >= 0)
+        np.add.at(matrix, (rows[mask], columns[mask]), values[mask])
+        return np.cumsum(matrix, axis=0)
+
+    @staticmethod
+    def from_transactions(
+        transactions: List[Transaction],
+        index: pd.DatetimeIndex,
+        registry: HoldingRegistry,
+        opening: Optional[Balance] = None,
+    ) -> "Positions":
+        """
+        Compute daily positions from a list of transactions, holdings are
+        stored in the column of their ID. Holdings that are not in the
+        registry are ignored.
+        Transactions made before the beginning of the index can be replaced
+        by the balance they lead to (opening).
+        """
+        deltas = PositionDeltas.from_transactions(transactions, opening=opening)
+
+        quantities = Positions._scatter(
+            index,
+            deltas.holdings_dates,
+            registry.get_ids(deltas.holdings_keys),
+            deltas.quantities,
+            len(registry),
+        )
+
+        currencies: Dict[Currency, int] = {}
+        for currency in deltas.currencies:
+            currencies.setdefault(currency, len(currencies))
+        cash_cols = np.array([currencies[c] for c in deltas.currencies], dtype=np.int64)
+        # Cash is summed up exactly in units, then converted once
+        cash_units = Positions._scatter(
+            index,
+            deltas.cash_dates,
+            cash_cols,
+            deltas.amounts,
+            len(currencies),
+            dtype=np.int64,
+        )
+        cash = from_units(cash_units)
+
+        return Positions(
+            index=index,
+            holdings_keys=list(registry.keys),
+            quantities=quantities,
+            currencies=list(currencies),
+            cash=cash,
+        )
@@ -20,6 +20,8 @@ class Price:
     negative amounts depending on your use case you should associate some meta info to
     the price, for example for cash transactions this is done with CASH_OUT vs CASH_IN)
     """
+    __slots__ = ("currency", "_amount")
+
     def __init__(self, currency: Currency, amount: float):
         self.currency = currency
         self.amount = amount
@@ -0,0 +1,256 @@
+"""
+Local store of daily prices history
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import threading
+import pandas as pd
+import numpy as np
+
+# (tickers, start, end) -> closing prices of each ticker indexed by date,
+# end is excluded. Tickers without prices can be left out.
+FetchFunction = Callable[[List[str], datetime, datetime], Dict[str, pd.Series]]
+
+# tickers -> name of the currency of each ticker (tickers can be left out)
+FetchCurrenciesFunction = Callable[[List[str]], Dict[str, str]]
+
+_DAY = pd.Timedelta(days=1)
+
+
+def _to_day(date: pd.Timestamp) -> str:
+    return date.strftime("%Y-%m-%d")
+
+
+def _subtract(
+    interval: Tuple[pd.Timestamp, pd.Timestamp],
+    covered: List[Tuple[pd.Timestamp, pd.Timestamp]],
+) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """ Parts of the (inclusive) interval of days not in the covered ones """
+    gaps = []
+    start, end = interval
+    for cov_start, cov_end in sorted(covered):
+        if cov_end < start:
+            continue
+        if cov_start > end:
+            break
+        if cov_start > start:
+            gaps.append((start, cov_start - _DAY))
+        start = max(start, cov_end + _DAY)
+    if start <= end:
+        gaps.append((start, end))
+    return gaps
+
+
+class PriceStore:
+    """
+    Daily closing prices of tickers, stored in a SQLite database.
+
+    The store records which days were already fetched for each ticker, so
+    that only the missing ranges of days are fetched. Days which were not
+    over at the time of the fetch (i.e. the day of the fetch and later) could
+    still see their price change: they are fetched again once older than
+    freshness.
+
+    The store is thread safe.
+    """
+
+    def __init__(
+        self,
+        fetch: FetchFunction,
+        fetch_currencies: Optional[FetchCurrenciesFunction] = None,
+        path: str = ":memory:",
+        freshness: timedelta = timedelta(hours=12),
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # The store can be used from several threads (see Fetcher), accesses
+        # to the database are serialized but fetches can run concurrently
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._fetch = fetch
+        self._fetch_currencies = fetch_currencies
+        self._freshness = freshness
+        self._now = now
+        self.fetches = 0
+
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                " ticker TEXT, date TEXT, close REAL,"
+                " PRIMARY KEY (ticker, date))"
+            )
+            # Ranges of days already fetched, fetched_at is NULL for days
+            # which were over at the time of the fetch
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                " ticker TEXT, start TEXT, end TEXT, fetched_at TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS currencies ("
+                " ticker TEXT PRIMARY KEY, currency TEXT)"
+            )
+
+    def _get_covered(
+        self, ticker: str, now: datetime
+    ) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM coverage WHERE ticker = ? AND fetched_at < ?",
+                (ticker, (now - self._freshness).isoformat()),
+            )
+            rows = self._db.execute(
+                "SELECT start, end FROM coverage WHERE ticker = ?", (ticker,)
+            ).fetchall()
+        return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in rows]
+
+    def _add_covered(
+        self,
+        ticker: str,
+        start: pd.Timestamp,
+        end: pd.Timestamp,
+        fetched_at: Optional[datetime],
+    ):
+        if start > end:
+            return
+
+        if fetched_at is not None:
+            self._db.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)",
+                (ticker, _to_day(start), _to_day(end), fetched_at.isoformat()),
+            )
+            return
+
+        # Merge with the ranges of days which were already over
+        rows = self._db.execute(
+            "SELECT start, end FROM coverage"
+            " WHERE ticker = ? AND fetched_at IS NULL",
+            (ticker,),
+        ).fetchall()
+        ranges = sorted(
+            [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in rows] + [(start, end)]
+        )
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            last_start, last_end = merged[-1]
+            if range_start <= last_end + _DAY:
+                merged[-1] = (last_start, max(last_end, range_end))
+            else:
+                merged.append((range_start, range_end))
+
+        self._db.execute(
+            "DELETE FROM coverage WHERE ticker = ? AND fetched_at IS NULL", (ticker,)
+        )
+        self._db.executemany(
+            "INSERT INTO coverage VALUES (?, ?, ?, NULL)",
+            [(ticker, _to_day(s), _to_day(e)) for s, e in merged],
+        )
+
+    def _save(
+        self,
+        ticker: str,
+        start: pd.Timestamp,
+        end: pd.Timestamp,
+        prices: pd.Series,
+        now: datetime,
+    ):
+        index = pd.DatetimeIndex(prices.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        days = index.normalize()
+        keep = (days >= start) & (days <= end) & ~np.isnan(prices.values)
+
+        today = pd.Timestamp(now).normalize()
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM prices WHERE ticker = ? AND date BETWEEN ? AND ?",
+                (ticker, _to_day(start), _to_day(end)),
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO prices VALUES (?, ?, ?)",
+                [
+                    (ticker, _to_day(day), float(close))
+                    for day, close in zip(days[keep], prices.values[keep])
+                ],
+            )
+            self._add_covered(ticker, start, min(end, today - _DAY), None)
+            self._add_covered(ticker, max(start, today), end, now)
+
+    def get_histories(
+        self, tickers: List[str], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        """
+        Daily closing prices of each ticker from start to end (excluded).
+        Only the days missing from the store are fetched, tickers missing the
+        same days are fetched together.
+        """
+        first = pd.Timestamp(start).normalize()
+        last = pd.Timestamp(end).ceil("D") - _DAY
+        now = self._now()
+        if last < first:
+            return {t: pd.Series(dtype=np.float64, name="Close") for t in tickers}
+
+        gaps: Dict[Tuple[pd.Timestamp, pd.Timestamp], List[str]] = {}
+        for ticker in tickers:
+            covered = self._get_covered(ticker, now)
+            for gap in _subtract((first, last), covered):
+                gaps.setdefault(gap, []).append(ticker)
+
+        for (gap_start, gap_end), gap_tickers in gaps.items():
+            with self._lock:
+                self.fetches += 1
+            prices = self._fetch(
+                gap_tickers,
+                gap_start.to_pydatetime(),
+                (gap_end + _DAY).to_pydatetime(),
+            )
+            for ticker in gap_tickers:
+                ticker_prices = prices.get(ticker)
+                if ticker_prices is None:
+                    ticker_prices = pd.Series(dtype=np.float64)
+                self._save(ticker, gap_start, gap_end, ticker_prices, now)
+
+        return {ticker: self._read(ticker, first, last) for ticker in tickers}
+
+    def get_history(self, ticker: str, start: datetime, end: datetime) -> pd.Series:
+        """ Daily closing prices of ticker from start to end (excluded) """
+        return self.get_histories([ticker], start=start, end=end)[ticker]
+
+    def _read(self, ticker: str, first: pd.Timestamp, last: pd.Timestamp) -> pd.Series:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT date, close FROM prices"
+                " WHERE ticker = ? AND date BETWEEN ? AND ? ORDER BY date",
+                (ticker, _to_day(first), _to_day(last)),
+            ).fetchall()
+        return pd.Series(
+            [close for _, close in rows],
+            index=pd.DatetimeIndex([day for day, _ in rows]),
+            dtype=np.float64,
+            name="Close",
+        )
+
+    def get_currencies(self, tickers: List[str]) -> Dict[str, str]:
+        """
+        Name of the currency of each ticker, currencies missing from the store
+        are fetched (if possible). Tickers without currency are left out.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT ticker, currency FROM currencies")
+            currencies = dict(rows.fetchall())
+
+        missing = [t for t in tickers if t not in currencies]
+        if missing and self._fetch_currencies is not None:
+            fetched = self._fetch_currencies(missing)
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO currencies VALUES (?, ?)",
+                    list(fetched.items()),
+                )
+            currencies.update(fetched)
+
+        return {t: currencies[t] for t in tickers if t in currencies}
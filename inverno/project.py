@@ -1,5 +1,5 @@
-from typing import Dict
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
 import shutil
 import tempfile
 import os
@@ -7,15 +7,22 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as ani
-import yfinance as yf
-from currency_converter import CurrencyConverter
 from jinja2 import Environment, PackageLoader
-from .balance import Balance
+from .transaction import Transaction
 from .price import Currency, Price
 from .common import log_info, log_warning
 from .holding import Holding
 from .analysis import Analysis
 from .config import Config
+from .cache import CACHE_DIR
+from .fetcher import Fetcher
+from .providers import make_provider
+from .benchmarks import get_benchmarks
+from .rates import get_daily_rates
+
+# How long before the analysed days prices are requested, so that the last
+# price before the first day is known
+PRICES_LOOKBACK = timedelta(days=31)
 
 
 class Project:
@@ -23,15 +30,32 @@ class Project:
     Root class for handling a project and the creation of a report
     """
 
-    def __init__(self, config: str):
+    def __init__(self, config: str, use_cache: bool = True):
+
+        self.cfg = Config.from_file(path=config, use_cache=use_cache)
 
-        self.cfg = Config.from_file(path=config)
+        # Fetches remote data concurrently
+        self._fetcher = Fetcher(max_workers=self.cfg.fetch_workers)
 
-        # Conversion rates to the dest currency
-        self._dst_currency_rates = self._get_currency_rates(self.cfg.currency.name)
+        # Sources of prices and currencies, fetched prices are kept across
+        # runs if caching
+        price_store_path = ":memory:"
+        cache_dir = None
+        if use_cache:
+            cache_dir = os.path.join(os.path.dirname(config), CACHE_DIR)
+            price_store_path = os.path.join(cache_dir, "prices.sqlite")
+        self._prices_provider = make_provider(
+            self.cfg.price_providers,
+            cfg=self.cfg,
+            fetcher=self._fetcher,
+            cache_path=price_store_path,
+            freshness=timedelta(hours=self.cfg.price_freshness),
+        )
 
-        # Balances after each transaction (max one balance per day)
-        self.balances = Balance.get_balances(transactions=self.cfg.transactions)
+        # Daily conversion rates from the dest currency
+        self._dst_currency_rates = get_daily_rates(
+            self.cfg.currency.name, cache_dir=cache_dir
+        )
 
         # For each holding identity (key) this list contains the
         # first one ever hold
@@ -54,26 +78,30 @@ class Project:
             for h in self._first_holdings.values()
         }
 
-    def _get_currency_rates(self, currency: str) -> Dict[str, float]:
-        cc = CurrencyConverter()
-        rates = {currency: 1.0}
-        for cu in cc.currencies:
-            try:
-                rates[cu] = cc.convert(1, currency, cu)
-            except Exception:
-                pass
-        return rates
-
-    def _get_attrs_report_data(self, analysis: Analysis, allocations: pd.DataFrame):
+    def _get_attrs_report_data(
+        self,
+        analysis: Analysis,
+        allocations: pd.DataFrame,
+        transactions: List[Transaction],
+    ):
+        # Allocations and earnings of all attributes are computed in one pass
+        log_info("Computing allocations for all attributes")
+        attrs_alloc = analysis.get_attrs_allocations(
+            allocations=allocations, attrs_weights=self._meta
+        )
+
+        log_info("Computing earnings for all attributes")
+        attrs_earnings = analysis.get_attrs_earnings(
+            attrs_allocations=attrs_alloc,
+            transactions=transactions,
+            attrs_weights=self._meta,
+        )
+
         reports = []
-        for attr in self._meta:
+        for attr, attr_alloc in attrs_alloc.items():
             log_info(f"Generating report for attribute {attr}")
             reports.append({"name": attr.capitalize(), "reports": []})
 
-            attr_alloc = analysis.get_attr_allocations(
-                allocations=allocations, attr=attr, attr_weights=self._meta[attr],
-            )
-
             # Get current allocation from last (more recent) row
             last_alloc = attr_alloc.tail(1).values.tolist()[0]
             reports[-1]["reports"].append(
@@ -102,11 +130,7 @@ class Project:
             )
 
             # Earnings
-            earnings = analysis.get_attr_earnings(
-                attr_allocations=attr_alloc,
-                transactions=self.cfg.transactions,
-                attr_weights=self._meta[attr],
-            )
+            earnings = attrs_earnings[attr]
             earnings_perc = (earnings / attr_alloc) * 100
             earnings_perc.replace([np.inf, -np.inf], np.nan, inplace=True)
             earnings_perc = earnings_perc.fillna(0.0)
@@ -151,11 +175,19 @@ class Project:
             prices=self._prices,
             conv_rates=self._dst_currency_rates,
             holdings_currencies=self._holding_to_currency,
+            registry=self.cfg.holdings_registry,
         )
 
+        # Transactions made before the analysed days are replaced by the
+        # balance they lead to
+        start = self._prices.index[0]
+        timeline = self.cfg.balance_timeline
+        opening = timeline.balance_before(start)
+        transactions = self.cfg.transactions[timeline.rows_before(start) :]
+
         # Balances graph
         allocations = analysis.get_allocations(
-            balances=self.balances.values(), ndays=self.cfg.days
+            transactions=transactions, ndays=self.cfg.days, opening=opening
         )
         balances = {
             "datasets": [
@@ -170,7 +202,7 @@ class Project:
         # Earning graph
         earnings_s = analysis.get_earnings(
             allocations=allocations,
-            transactions=self.cfg.transactions,
+            transactions=transactions,
             ndays=self.cfg.days,
         )
 
@@ -192,7 +224,7 @@ class Project:
 
         # Generate report data for all known attributes
         attrs_report = self._get_attrs_report_data(
-            analysis=analysis, allocations=allocations
+            analysis=analysis, allocations=allocations, transactions=transactions
         )
 
         # Rate of return
@@ -283,36 +315,114 @@ class Project:
         animator.save(dst, fps=10)
 
     def _get_first_holdings(self):
-        # Collect holdngs and earliest date
+        # Collect holdings and earliest date, in order of ID
+        registry = self.cfg.holdings_registry
         holdings = {}
-        for balance in self.balances.values():
-            for holding in balance.holdings.values():
-                if holding.get_key() not in holdings:
-                    holdings[holding.get_key()] = {
-                        "date": balance.date,
-                        "holding": holding,
-                    }
+        for key, row in zip(registry.keys, registry.first_rows):
+            trs = self.cfg.transactions[row]
+            holdings[key] = {
+                "date": trs.date,
+                "holding": Holding(
+                    quantity=trs.quantity,
+                    name=trs.name,
+                    ticker=trs.ticker,
+                    isin=trs.isin,
+                ),
+            }
         return holdings
 
+    def _get_histories(self, entries: List[Dict], start: datetime) -> Dict:
+        if not entries:
+            return {}
+        return self._prices_provider.history(
+            [entry["holding"] for entry in entries],
+            start=max(start, min(entry["date"] for entry in entries)),
+            end=self.cfg.end_date,
+        )
+
+    def _get_holding_prices(
+        self, entry: Dict, price_history: Optional[pd.Series]
+    ) -> pd.Series:
+        """ Daily prices of a holding, with NaNs covered """
+        holding = entry["holding"]
+        if price_history is not None:
+            # Histories are fetched together, from the earliest holding
+            price_history = price_history[price_history.index >= entry["date"]]
+        if price_history is None or price_history.empty:
+            price_history = self._infer_holding_prices(
+                start=entry["date"], end=self.cfg.end_date, holding=holding
+            )
+
+        price_history = self._reindex(price_history)
+        if all([np.isnan(p) for p in price_history.tail(7)]):
+            log_warning(
+                "Most recent price is older than one "
+                f"week for {holding.get_key()}"
+            )
+
+        # Use linear interpolation to cover NaNs
+        return price_history.interpolate(method="time", limit_direction="both")
+
+    def _get_window_start(self, prices: Dict[str, pd.Series]) -> pd.Timestamp:
+        """ First of the last days (see Config.days) with prices """
+        index = pd.DatetimeIndex([])
+        for price_history in prices.values():
+            index = index.union(price_history.index)
+        return index[max(len(index) - self.cfg.days, 0)]
+
+    @staticmethod
+    def _has_price_before(history: Optional[pd.Series], date: datetime) -> bool:
+        return history is not None and history[history.index <= date].notna().any()
+
     def _get_prices(self):
-        prices = []
-        end_date = self.cfg.end_date
-        for _, entry in self._first_holdings.items():
-            price_history = self._get_holding_prices(
-                start=entry["date"], end=end_date, holding=entry["holding"]
+        # Prices of all holdings are requested at once, only from shortly
+        # before the analysed days: enough to know the price of each holding
+        # on the first day
+        end = pd.Timestamp(self.cfg.end_date).normalize()
+        fetch_start = end - timedelta(days=self.cfg.days) - PRICES_LOOKBACK
+        fetch_start = fetch_start.to_pydatetime()
+        entries = self._first_holdings
+        histories = self._get_histories(list(entries.values()), start=fetch_start)
+        prices = {
+            key: self._get_holding_prices(entry, histories.get(key))
+            for key, entry in entries.items()
+        }
+        window_start = self._get_window_start(prices)
+
+        # Holdings held earlier, but without any price since fetch_start,
+        # are requested again from the beginning
+        missing = {
+            key: entry
+            for key, entry in entries.items()
+            if entry["date"] < fetch_start
+            and not self._has_price_before(histories.get(key), window_start)
+        }
+        if missing:
+            histories.update(
+                self._get_histories(list(missing.values()), start=datetime.min)
             )
-            if price_history is not None:
-                if all([np.isnan(p) for p in price_history.tail(7)]):
-                    log_warning(
-                        "Most recent price is older than one "
-                        f"week for {entry['holding'].get_key()}"
-                    )
-                prices.append(price_history)
+            for key, entry in missing.items():
+                prices[key] = self._get_holding_prices(entry, histories.get(key))
+            window_start = self._get_window_start(prices)
+
+        # Drop the days preceding the window, holdings without prices within
+        # it keep their last one
+        windows = []
+        for price_history in prices.values():
+            window = price_history[price_history.index >= window_start]
+            if window.empty:
+                window = pd.Series(
+                    price_history.iloc[-1:].values,
+                    index=pd.DatetimeIndex([window_start]),
+                    name=price_history.name,
+                )
+            windows.append(window)
 
         # Put all together in a single dataframe
-        prices = pd.concat(prices, axis=1, join="outer")
+        prices = pd.concat(windows, axis=1, join="outer")
 
-        # Use linear interpolation to cover NaNs
+        # Holdings priced from a later day (or until an earlier one) take
+        # their first (or last) price
         prices = prices.interpolate(method="time", axis=0, limit_direction="both")
 
         return prices
@@ -329,90 +439,37 @@ class Project:
                     currencies[holding.get_key()] = trs.price.currency
                     break
 
-            if holding.get_key() in currencies:
-                continue
-
-            # Try from prices
-            c = self.cfg.get_currency(holding=holding)
-            if c is not None:
-                currencies[holding.get_key()] = c
-                continue
-
-            # Try from Yahoo Finance
-            if holding.ticker is not None:
-                ticker = yf.Ticker(holding.ticker)
-                try:
-                    c = Currency[ticker.info["currency"]]
-                    currencies[holding.get_key()] = c
-                    continue
-                except KeyError:
-                    pass
+        # Try from prices providers
+        missing = [
+            entry["holding"]
+            for key, entry in self._first_holdings.items()
+            if key not in currencies
+        ]
+        if missing:
+            currencies.update(self._prices_provider.currency(missing))
 
-            raise ValueError(f"Couldn't determine currency for {holding.get_key()}")
+        for key in self._first_holdings:
+            if key not in currencies:
+                raise ValueError(f"Couldn't determine currency for {key}")
 
-        return currencies
+        # Keep the same order as holdings
+        return {key: currencies[key] for key in self._first_holdings}
 
     def _get_benchmarks(self, start: datetime, end: datetime):
-        def _reindex(s: pd.Series):
-            s = s.add(-s.iloc[0])
-            return s.reindex(
-                index=pd.date_range(s.index.min(), s.index.max()),
-                method="pad",
-            )
-
-        benchmarks = {}
-
-        # S&P 500
-        ticker = yf.Ticker("^GSPC")
-        prices = ticker.history(start=start, end=end, interval="1d")["Close"]
-        if prices.size > 0:
-            benchmarks["S&P 500"] = _reindex(prices)
-
-        # DJIA
-        ticker = yf.Ticker("^DJI")
-        prices = ticker.history(start=start, end=end, interval="1d")["Close"]
-        if prices.size > 0:
-            benchmarks["DJIA"] = _reindex(prices)
-            
-
-        # NASDAQ
-        ticker = yf.Ticker("^IXIC")
-        prices = ticker.history(start=start, end=end, interval="1d")["Close"]
-        if prices.size > 0:
-            benchmarks["NASDAQ"] = _reindex(prices)
-
-        # Russel 2000 
-        ticker = yf.Ticker("^RUT")
-        prices = ticker.history(start=start, end=end, interval="1d")["Close"]
-        if prices.size > 0:
-            benchmarks["Russell 2000"] = _reindex(prices)
+        return get_benchmarks(
+            self.cfg.benchmarks, provider=self._prices_provider, start=start, end=end
+        )
 
-        return benchmarks
+    @staticmethod
+    def _reindex(s: pd.Series) -> pd.Series:
+        return s.reindex(
+            index=pd.date_range(s.index.min(), s.index.max()),
+            method="pad",
+        )
 
-    def _get_holding_prices(
+    def _infer_holding_prices(
         self, start: datetime, end: datetime, holding: Holding
     ) -> pd.Series:
-        def _reindex(s: pd.Series):
-            return s.reindex(
-                index=pd.date_range(s.index.min(), s.index.max()),
-                method="pad",
-            )
-
-        prices = self.cfg.get_prices(holding=holding, start=start, end=end)
-        if prices is not None:
-            log_info(f"Using user-provided prices for {holding.get_key()}")
-            return _reindex(prices)
-
-        # Try to fetch prices from Yahoo Finance
-        if holding.ticker is not None:
-            ticker = yf.Ticker(holding.ticker)
-            prices = ticker.history(start=start, end=end, interval="1d")["Close"]
-            prices.name = holding.get_key()
-            if prices.size > 0:
-                log_info(f"Using Yahoo Finance prices for {holding.get_key()}")
-                return _reindex(prices)
-
-        # Try to infer from transaction data
         log_warning(
             f"Inferring prices from transactions for {holding.get_key()}"
             ", prices could be inaccurate"
@@ -426,4 +483,4 @@ class Project:
                 continue
             prices[trs.date] = trs.price.amount
 
-        return _reindex(prices)
+        return prices
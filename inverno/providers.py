@@ -0,0 +1,373 @@
+"""
+Providers of daily prices and currencies of holdings
+"""
+
+from typing import Dict, Hashable, List, Optional, Union
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import os
+import threading
+import pandas as pd
+import yfinance as yf
+from .price import Currency
+from .holding import Holding
+from .config import Config
+from .common import log_info
+from .columnar import read_prices_csv
+from .fetcher import Fetcher, YAHOO_HOST
+from .price_store import PriceStore
+
+# yfinance keeps the results of yf.download in module-global state, so
+# downloads can't overlap (other requests, e.g. holdings info, can)
+_yf_download_lock = threading.Lock()
+
+
+class PriceProvider(ABC):
+    """
+    Source of daily prices and currencies of holdings.
+
+    Both methods take a batch of holdings, so that providers supporting
+    multi-holding requests can serve all of them at once. Results are keyed
+    by holding key, holdings unknown to the provider are left out.
+    """
+
+    @abstractmethod
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        """ Daily prices of the given holdings from start to end (excluded) """
+
+    @abstractmethod
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        """ Currency of the given holdings """
+
+    def get_identity(self) -> Hashable:
+        """
+        Providers with the same identity give the same prices and currencies,
+        by default a provider is only identical to itself
+        """
+        return self
+
+
+class ProviderChain(PriceProvider):
+    """ Asks each provider in turn for the holdings not found so far """
+
+    def __init__(self, providers: List[PriceProvider]):
+        self.providers = providers
+
+    def get_identity(self) -> Hashable:
+        return tuple(provider.get_identity() for provider in self.providers)
+
+    @staticmethod
+    def _ordered(holdings: List[Holding], found: dict) -> dict:
+        keys = [h.get_key() for h in holdings]
+        return {key: found[key] for key in keys if key in found}
+
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        found: Dict[str, pd.Series] = {}
+        for provider in self.providers:
+            missing = [h for h in holdings if h.get_key() not in found]
+            if not missing:
+                break
+            found.update(provider.history(missing, start=start, end=end))
+        return self._ordered(holdings, found)
+
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        found: Dict[str, Currency] = {}
+        for provider in self.providers:
+            missing = [h for h in holdings if h.get_key() not in found]
+            if not missing:
+                break
+            found.update(provider.currency(missing))
+        return self._ordered(holdings, found)
+
+
+class ConfigProvider(PriceProvider):
+    """ Prices files provided by the user in the project config """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+
+    def get_identity(self) -> Hashable:
+        return ("csv", self.cfg.get_prices_identity())
+
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        found = {}
+        for holding in holdings:
+            prices = self.cfg.get_prices(holding=holding, start=start, end=end)
+            if prices is not None:
+                log_info(f"Using user-provided prices for {holding.get_key()}")
+                found[holding.get_key()] = prices
+        return found
+
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        found = {}
+        for holding in holdings:
+            currency = self.cfg.get_currency(holding=holding)
+            if currency is not None:
+                found[holding.get_key()] = currency
+        return found
+
+
+class YahooProvider(PriceProvider):
+    """
+    Prices and currencies from Yahoo Finance. Prices of up to chunk_size
+    tickers are downloaded with a single request.
+
+    yf.download isn't thread-safe and catches download errors itself:
+    downloads run one at a time, and tickers without prices are found from
+    the downloaded frame.
+    """
+
+    def __init__(self, fetcher: Fetcher, chunk_size: int = 100):
+        self.fetcher = fetcher
+        self.chunk_size = chunk_size
+
+    def get_identity(self) -> Hashable:
+        return ("yahoo",)
+
+    @staticmethod
+    def _download(tickers: List[str], start: datetime, end: datetime) -> pd.DataFrame:
+        """
+        Closing prices of the tickers (one column each), tickers without
+        prices are left out. Raises an OSError if no ticker got any price,
+        which is most likely a failed download.
+        """
+        with _yf_download_lock:
+            data = yf.download(
+                tickers,
+                start=start,
+                end=end,
+                interval="1d",
+                auto_adjust=True,
+                progress=False,
+            )
+        closes = data["Close"] if "Close" in data else pd.DataFrame()
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(name=tickers[0])
+        closes = closes.reindex(columns=tickers)
+
+        found = closes.notna().any()
+        if not found.any():
+            raise OSError(f"No prices downloaded for {', '.join(tickers)}")
+        return closes.loc[:, found]
+
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        tickers = list(dict.fromkeys(h.ticker for h in holdings if h.ticker))
+        chunks = [
+            tickers[i : i + self.chunk_size]
+            for i in range(0, len(tickers), self.chunk_size)
+        ]
+        closes = self.fetcher.map(
+            lambda chunk: self._download(chunk, start=start, end=end),
+            chunks,
+            host=lambda _: YAHOO_HOST,
+            desc="Downloading prices from Yahoo Finance",
+            skip_errors=True,
+        )
+
+        by_ticker = {}
+        for frame in closes:
+            if frame is None:
+                continue
+            for ticker in frame.columns:
+                prices = frame[ticker].dropna()
+                if prices.size > 0:
+                    by_ticker[ticker] = prices
+
+        found = {}
+        for holding in holdings:
+            if holding.ticker in by_ticker:
+                log_info(f"Using Yahoo Finance prices for {holding.get_key()}")
+                prices = by_ticker[holding.ticker].copy()
+                prices.name = holding.get_key()
+                found[holding.get_key()] = prices
+        return found
+
+    @staticmethod
+    def _get_currency(ticker: str) -> Optional[Currency]:
+        try:
+            return Currency[yf.Ticker(ticker).info["currency"]]
+        except KeyError:
+            return None
+
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        with_ticker = [h for h in holdings if h.ticker is not None]
+        currencies = self.fetcher.map(
+            lambda h: self._get_currency(h.ticker),
+            with_ticker,
+            host=lambda _: YAHOO_HOST,
+            desc="Getting currencies from Yahoo Finance",
+        )
+        return {
+            h.get_key(): c for h, c in zip(with_ticker, currencies) if c is not None
+        }
+
+
+class FixturesProvider(PriceProvider):
+    """
+    Prices files stored in a directory, e.g. to run offline. Files have the
+    same format as user-provided prices and are named after one of the
+    identifiers of the holding (e.g. "FB.csv" or "US30303M1027.csv").
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._parsed: Dict[str, Optional[pd.Series]] = {}
+        self._currencies: Dict[str, Currency] = {}
+
+    def get_identity(self) -> Hashable:
+        return ("fixtures", os.path.abspath(self.directory))
+
+    def _read(self, holding: Holding) -> Optional[pd.Series]:
+        key = holding.get_key()
+        if key in self._parsed:
+            return self._parsed[key]
+
+        self._parsed[key] = None
+        names = [holding.get_key(), holding.ticker, holding.isin, holding.name]
+        for name in dict.fromkeys(n for n in names if n is not None):
+            path = os.path.join(self.directory, f"{name}.csv")
+            if not os.path.isfile(path):
+                continue
+
+            with open(path) as fd:
+                prices, currency = read_prices_csv(fd.read())
+            prices.name = key
+            self._parsed[key] = prices
+            if currency is not None:
+                self._currencies[key] = currency
+            break
+
+        return self._parsed[key]
+
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        found = {}
+        for holding in holdings:
+            prices = self._read(holding)
+            if prices is None:
+                continue
+            prices = prices[(prices.index >= start) & (prices.index < end)]
+            if prices.size > 0:
+                log_info(f"Using fixture prices for {holding.get_key()}")
+                found[holding.get_key()] = prices
+        return found
+
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        found = {}
+        for holding in holdings:
+            key = holding.get_key()
+            if self._read(holding) is not None and key in self._currencies:
+                found[key] = self._currencies[key]
+        return found
+
+
+class CachedProvider(PriceProvider):
+    """
+    Keeps prices and currencies obtained from another provider in a local
+    store (see PriceStore), so that only missing days are requested to it.
+    """
+
+    def __init__(
+        self,
+        upstream: PriceProvider,
+        path: str = ":memory:",
+        freshness: timedelta = timedelta(hours=12),
+    ):
+        self.upstream = upstream
+        self.path = path
+        self._holdings: Dict[str, Holding] = {}
+        self.store = PriceStore(
+            fetch=self._fetch,
+            fetch_currencies=self._fetch_currencies,
+            path=path,
+            freshness=freshness,
+        )
+
+    def get_identity(self) -> Hashable:
+        return ("cache", self.path, self.upstream.get_identity())
+
+    def _fetch(
+        self, keys: List[str], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        holdings = [self._holdings[k] for k in keys]
+        return self.upstream.history(holdings, start=start, end=end)
+
+    def _fetch_currencies(self, keys: List[str]) -> Dict[str, str]:
+        currencies = self.upstream.currency([self._holdings[k] for k in keys])
+        return {key: currency.name for key, currency in currencies.items()}
+
+    def history(
+        self, holdings: List[Holding], start: datetime, end: datetime
+    ) -> Dict[str, pd.Series]:
+        self._holdings.update({h.get_key(): h for h in holdings})
+        histories = self.store.get_histories(
+            [h.get_key() for h in holdings], start=start, end=end
+        )
+
+        found = {}
+        for key, prices in histories.items():
+            if prices.size > 0:
+                prices.name = key
+                found[key] = prices
+        return found
+
+    def currency(self, holdings: List[Holding]) -> Dict[str, Currency]:
+        self._holdings.update({h.get_key(): h for h in holdings})
+        currencies = self.store.get_currencies([h.get_key() for h in holdings])
+        return {
+            key: Currency[name]
+            for key, name in currencies.items()
+            if name in Currency.__members__
+        }
+
+
+
+def make_provider(
+    specs: List[Union[str, Dict[str, str]]],
+    cfg: Config,
+    fetcher: Fetcher,
+    cache_path: str = ":memory:",
+    freshness: timedelta = timedelta(hours=12),
+) -> ProviderChain:
+    """
+    Build the chain of providers described by specs, each spec being one of:
+      - csv: prices files provided in the config
+      - cache: local store of the prices given by the following providers
+      - yahoo: Yahoo Finance
+      - {fixtures: <directory>}: prices files stored in a directory
+    """
+    providers: List[PriceProvider] = []
+    for pos, spec in enumerate(specs):
+        if spec == "csv":
+            providers.append(ConfigProvider(cfg=cfg))
+        elif spec == "yahoo":
+            providers.append(YahooProvider(fetcher=fetcher))
+        elif spec == "cache":
+            upstream = make_provider(
+                specs[pos + 1 :],
+                cfg=cfg,
+                fetcher=fetcher,
+                cache_path=cache_path,
+                freshness=freshness,
+            )
+            providers.append(
+                CachedProvider(upstream=upstream, path=cache_path, freshness=freshness)
+            )
+            break
+        elif isinstance(spec, dict) and "fixtures" in spec:
+            providers.append(
+                FixturesProvider(directory=cfg.resolve_path(spec["fixtures"]))
+            )
+        else:
+            raise ValueError(f"Unknown price provider {spec}")
+
+    return ProviderChain(providers)
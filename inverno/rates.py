@@ -0,0 +1,79 @@
+"""
+Daily currency conversion rates
+"""
+
+from typing import Optional
+import os
+import pandas as pd
+import numpy as np
+from currency_converter.currency_converter import CURRENCY_FILE
+
+# Bump whenever the layout of cached rates changes
+RATES_CACHE_VERSION = 1
+
+
+def _parse_ecb_file(path: str) -> pd.DataFrame:
+    """ Rates against the euro (days x currencies) from an ECB history file """
+    df = pd.read_csv(path, na_values=["N/A", ""], skipinitialspace=True)
+    df = df.loc[:, [c for c in df.columns if c and not c.startswith("Unnamed")]]
+    df.columns = [c.strip() for c in df.columns]
+    df.index = pd.to_datetime(df.pop("Date"), format="%Y-%m-%d")
+    df = df.astype(np.float64).dropna(axis=1, how="all").sort_index()
+    df["EUR"] = 1.0
+    return df
+
+
+def load_ecb_rates(path: str = CURRENCY_FILE, cache_dir: Optional[str] = None):
+    """
+    Daily rates of each currency against the euro from the ECB history file
+    (by default the one bundled with currency_converter). Days without rates
+    (e.g. week-ends) take the rates of the previous day.
+
+    The parsed matrix is cached in cache_dir (if provided), as long as the
+    ECB file doesn't change.
+    """
+    stat = os.stat(path)
+    source = np.array([os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns)])
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"ecb_rates_v{RATES_CACHE_VERSION}.npz")
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["source"], source):
+                    return pd.DataFrame(
+                        cached["rates"],
+                        index=pd.DatetimeIndex(cached["dates"]),
+                        columns=cached["currencies"].tolist(),
+                    )
+        except (OSError, ValueError, KeyError):
+            pass
+
+    rates = _parse_ecb_file(path)
+    days = pd.date_range(rates.index.min(), rates.index.max(), freq="D")
+    rates = rates.reindex(days).ffill().bfill()
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "wb") as fd:
+            np.savez_compressed(
+                fd,
+                source=source,
+                dates=rates.index.values,
+                currencies=np.array(rates.columns, dtype=str),
+                rates=rates.values,
+            )
+        os.replace(cache_path + ".tmp", cache_path)
+
+    return rates
+
+
+def get_daily_rates(currency: str, cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Daily conversion rates (days x currencies) from currency to every other
+    currency, i.e. how much of each currency one unit of currency is worth
+    """
+    rates = load_ecb_rates(cache_dir=cache_dir)
+    if currency not in rates.columns:
+        raise ValueError(f"Unsupported currency {currency}")
+    return rates.div(rates[currency], axis=0)
@@ -0,0 +1,68 @@
+"""
+Dense integer IDs for holdings
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence
+import pandas as pd
+import numpy as np
+from .columnar import TransactionColumns
+from .transaction import HOLDING_ACTIONS
+
+
+class HoldingRegistry:
+    """
+    Assigns dense integer IDs (0, 1, ...) to holdings keys in order of
+    registration, so that holdings can directly index the rows or columns of
+    matrices. Keys are only needed to label results.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self.keys: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._index: Optional[pd.Index] = None
+        # Row of the first transaction of each holding (see from_columns)
+        self.first_rows: List[int] = []
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._ids
+
+    def add(self, key: str) -> int:
+        """ ID of key, a new one is assigned if key isn't registered yet """
+        holding_id = self._ids.get(key)
+        if holding_id is None:
+            holding_id = len(self.keys)
+            self._ids[key] = holding_id
+            self.keys.append(key)
+            self._index = None
+        return holding_id
+
+    def get_id(self, key: str) -> Optional[int]:
+        """ ID of key (None if not registered) """
+        return self._ids.get(key)
+
+    def get_ids(self, keys: Sequence[Optional[str]]) -> np.ndarray:
+        """ IDs of several keys at once, -1 for keys not registered """
+        if self._index is None:
+            self._index = pd.Index(self.keys, dtype=object)
+        return self._index.get_indexer(pd.Index(keys, dtype=object))
+
+    def get_key(self, holding_id: int) -> str:
+        """ Key of the holding with the given ID """
+        return self.keys[holding_id]
+
+    @staticmethod
+    def from_columns(columns: TransactionColumns) -> "HoldingRegistry":
+        """
+        Registry of the holdings of the given transactions (see
+        HOLDING_ACTIONS), in order of first appearance
+        """
+        codes, uniques = pd.factorize(columns.holding_keys(actions=HOLDING_ACTIONS))
+        registry = HoldingRegistry(uniques)
+        _, first_rows = np.unique(codes[codes >= 0], return_index=True)
+        registry.first_rows = np.flatnonzero(codes >= 0)[first_rows].tolist()
+        return registry
@@ -0,0 +1,399 @@
+"""
+Balances over time, checkpointed to answer queries at any date
+"""
+
+from typing import Dict, List, Mapping, Optional, Tuple
+from datetime import datetime
+import os
+import numpy as np
+import pandas as pd
+from .balance import Balance
+from .holding import Holding
+from .positions import PositionDeltas
+from .price import Currency
+from .registry import HoldingRegistry
+from .transaction import Transaction
+
+# Bump whenever the layout of saved timelines changes
+TIMELINE_VERSION = 3
+
+# Default number of transactions between two snapshots
+SNAPSHOT_EVERY = 1024
+
+
+class BalanceTimeline:
+    """
+    Balances after each transaction of a sorted list of transactions.
+
+    Rather than keeping a balance for every transaction, the timeline stores
+    a snapshot of all quantities and cash every `every` transactions (or at
+    the first transaction of each month) and, in between, the compact
+    changes made by each transaction (see PositionDeltas). The balance at a
+    date is rebuilt from the closest previous snapshot, in O(log n + k) with
+    k the number of transactions since that snapshot.
+
+    Holdings and currencies are identified by their column in the
+    snapshots, holdings keep the identifiers of their first transaction.
+    Cash is stored in fixed point (units, see money.py), so that snapshots
+    are exact.
+
+    Transactions made since a timeline was built can be added to it (see
+    extend), only the new transactions are then processed.
+    """
+
+    def __init__(
+        self,
+        dates: np.ndarray,
+        registry: HoldingRegistry,
+        holdings_fields: Mapping[str, np.ndarray],
+        currencies: List[Currency],
+        changes: Mapping[str, np.ndarray],
+        snapshots: Mapping[str, np.ndarray],
+        every: int = SNAPSHOT_EVERY,
+        monthly: bool = False,
+    ):
+        self.dates = dates
+        self.registry = registry
+        self.holdings_fields = holdings_fields
+        self.currencies = currencies
+        self.changes = changes
+        self.snapshots = snapshots
+        self.every = every
+        self.monthly = monthly
+        # Fingerprint of the transactions, once saved or loaded (see save)
+        self.fingerprint: Optional[str] = None
+        self._identifiers: Optional[List[Tuple[Optional[str], ...]]] = None
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @staticmethod
+    def _get_snapshots_rows(dates: np.ndarray, every: int, monthly: bool):
+        if monthly:
+            months = dates.astype("datetime64[M]")
+            starts = np.flatnonzero(months[1:] != months[:-1]) + 1
+            return np.concatenate([[0], starts]).astype(np.int64)
+        return np.arange(0, max(len(dates), 1), every, dtype=np.int64)
+
+    @staticmethod
+    def _get_snapshots(
+        snapshots_rows: np.ndarray,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+        ncols: int,
+    ) -> np.ndarray:
+        """ State (one row per snapshot) before the transaction of each snapshot """
+        res = np.zeros((len(snapshots_rows), ncols), dtype=values.dtype)
+        state = np.zeros(ncols, dtype=values.dtype)
+        cuts = rows.searchsorted(snapshots_rows, side="left")
+        begin = 0
+        for i, end in enumerate(cuts):
+            # Changes are added in order, as done by Balance
+            np.add.at(state, cols[begin:end], values[begin:end])
+            res[i] = state
+            begin = end
+        return res
+
+    @staticmethod
+    def _get_first_rows(rows: np.ndarray, cols: np.ndarray, ncols: int) -> np.ndarray:
+        """ Row of the first change of each column """
+        first = np.full(ncols, np.iinfo(np.int64).max, dtype=np.int64)
+        _, positions = np.unique(cols, return_index=True)
+        first[cols[positions]] = rows[positions]
+        return first
+
+    @staticmethod
+    def from_transactions(
+        transactions: List[Transaction],
+        every: int = SNAPSHOT_EVERY,
+        monthly: bool = False,
+    ) -> "BalanceTimeline":
+        """
+        Timeline of a list of transactions sorted by date, with a snapshot
+        every `every` transactions or, if monthly, once a month
+        """
+        if every < 1:
+            raise ValueError("Snapshots must be taken at least every transaction")
+
+        empty = BalanceTimeline(
+            dates=np.array([], dtype="datetime64[us]"),
+            registry=HoldingRegistry(),
+            holdings_fields={
+                field: np.array([], dtype=str) for field in ["name", "ticker", "isin"]
+            },
+            currencies=[],
+            changes={
+                name: np.array([], dtype=dtype)
+                for name, dtype in [
+                    ("holdings_rows", np.int64),
+                    ("holdings_ids", np.int64),
+                    ("quantities", np.float64),
+                    ("cash_rows", np.int64),
+                    ("cash_ids", np.int64),
+                    ("amounts", np.int64),
+                ]
+            },
+            snapshots={},
+            every=every,
+            monthly=monthly,
+        )
+        return empty.extend(transactions)
+
+    def extend(self, transactions: List[Transaction]) -> "BalanceTimeline":
+        """
+        New timeline with the given transactions (sorted by date) made after
+        the ones of this timeline
+        """
+        offset = len(self)
+        new_dates = np.array(
+            [np.datetime64(trs.date, "us") for trs in transactions],
+            dtype="datetime64[us]",
+        )
+        if offset > 0 and len(new_dates) > 0 and new_dates[0] < self.dates[-1]:
+            raise ValueError("Transactions must be made after the timeline's ones")
+        dates = np.concatenate([self.dates, new_dates])
+        deltas = PositionDeltas.from_transactions(transactions)
+
+        # Existing holdings and currencies keep their column
+        registry = HoldingRegistry(self.registry.keys + deltas.holdings_keys)
+        holdings_rows = np.concatenate(
+            [
+                self.changes["holdings_rows"],
+                np.array(deltas.holdings_rows, dtype=np.int64) + offset,
+            ]
+        )
+        holdings_ids = np.concatenate(
+            [
+                self.changes["holdings_ids"],
+                registry.get_ids(deltas.holdings_keys).astype(np.int64),
+            ]
+        )
+        quantities = np.concatenate(
+            [self.changes["quantities"], np.array(deltas.quantities, dtype=np.float64)]
+        )
+        holdings_first = BalanceTimeline._get_first_rows(
+            holdings_rows, holdings_ids, len(registry)
+        )
+
+        # Identifiers of the first transaction of each new holding
+        holdings_fields = {}
+        new_first = holdings_first[len(self.registry) :] - offset
+        for field in ["name", "ticker", "isin"]:
+            values = [getattr(transactions[row], field) for row in new_first]
+            holdings_fields[field] = np.concatenate(
+                [
+                    self.holdings_fields[field],
+                    np.array(["" if v is None else v for v in values], dtype=str),
+                ]
+            )
+
+        currencies_ids = {c: i for i, c in enumerate(self.currencies)}
+        for currency in deltas.currencies:
+            currencies_ids.setdefault(currency, len(currencies_ids))
+        cash_rows = np.concatenate(
+            [
+                self.changes["cash_rows"],
+                np.array(deltas.cash_rows, dtype=np.int64) + offset,
+            ]
+        )
+        new_cash_ids = [currencies_ids[c] for c in deltas.currencies]
+        cash_ids = np.concatenate(
+            [self.changes["cash_ids"], np.array(new_cash_ids, dtype=np.int64)]
+        )
+        amounts = np.concatenate(
+            [self.changes["amounts"], np.array(deltas.amounts, dtype=np.int64)]
+        )
+
+        snapshots_rows = BalanceTimeline._get_snapshots_rows(
+            dates, self.every, self.monthly
+        )
+        return BalanceTimeline(
+            dates=dates,
+            registry=registry,
+            holdings_fields=holdings_fields,
+            currencies=list(currencies_ids),
+            changes={
+                "holdings_rows": holdings_rows,
+                "holdings_ids": holdings_ids,
+                "quantities": quantities,
+                "holdings_first": holdings_first,
+                "cash_rows": cash_rows,
+                "cash_ids": cash_ids,
+                "amounts": amounts,
+                "cash_first": BalanceTimeline._get_first_rows(
+                    cash_rows, cash_ids, len(currencies_ids)
+                ),
+            },
+            snapshots={
+                "rows": snapshots_rows,
+                "quantities": BalanceTimeline._get_snapshots(
+                    snapshots_rows,
+                    holdings_rows,
+                    holdings_ids,
+                    quantities,
+                    len(registry),
+                ),
+                "amounts": BalanceTimeline._get_snapshots(
+                    snapshots_rows, cash_rows, cash_ids, amounts, len(currencies_ids)
+                ),
+            },
+            every=self.every,
+            monthly=self.monthly,
+        )
+
+    def _get_identifiers(self) -> List[Tuple[Optional[str], ...]]:
+        """ Name, ticker and isin of each holding """
+        if self._identifiers is None:
+            fields = [
+                self.holdings_fields[field].tolist()
+                for field in ["name", "ticker", "isin"]
+            ]
+            self._identifiers = [
+                tuple(v or None for v in values) for values in zip(*fields)
+            ]
+        return self._identifiers
+
+    def _get_state(self, prefix: str, values: str, nb_rows: int) -> np.ndarray:
+        """ Quantities or cash after the first nb_rows transactions """
+        snapshots_rows = self.snapshots["rows"]
+        snapshot = snapshots_rows.searchsorted(nb_rows, side="right") - 1
+        state = self.snapshots[values][snapshot].copy()
+
+        # Changes since the snapshot
+        rows = self.changes[f"{prefix}_rows"]
+        begin, end = rows.searchsorted(
+            [snapshots_rows[snapshot], nb_rows], side="left"
+        )
+        np.add.at(
+            state,
+            self.changes[f"{prefix}_ids"][begin:end],
+            self.changes[values][begin:end],
+        )
+        return state
+
+    def _get_nb_rows(self, date: datetime, side: str) -> int:
+        return int(
+            self.dates.searchsorted(np.datetime64(pd.Timestamp(date), "us"), side)
+        )
+
+    def rows_before(self, date: datetime) -> int:
+        """ Number of transactions made before date (excluded) """
+        return self._get_nb_rows(date, side="left")
+
+    def balance_at(self, date: datetime) -> Optional[Balance]:
+        """
+        Balance after all the transactions made up to date (included), None
+        if there were no transactions by then
+        """
+        return self._get_balance(self._get_nb_rows(date, side="right"))
+
+    def balance_before(self, date: datetime) -> Optional[Balance]:
+        """ Same as balance_at, but excluding the transactions made at date """
+        return self._get_balance(self.rows_before(date))
+
+    def _get_balance(self, nb_rows: int) -> Optional[Balance]:
+        """ Balance after the first nb_rows transactions """
+        if nb_rows == 0:
+            return None
+
+        quantities = self._get_state("holdings", "quantities", nb_rows).tolist()
+        identifiers = self._get_identifiers()
+        holdings = {}
+        for holding_id in np.flatnonzero(self.changes["holdings_first"] < nb_rows):
+            name, ticker, isin = identifiers[holding_id]
+            holdings[self.registry.get_key(holding_id)] = Holding(
+                quantity=quantities[holding_id], name=name, ticker=ticker, isin=isin
+            )
+
+        cash = self._get_state("cash", "amounts", nb_rows)
+        return Balance(
+            date=self.dates[nb_rows - 1].astype(datetime),
+            holdings=holdings,
+            cash={
+                self.currencies[i]: int(cash[i])
+                for i in np.flatnonzero(self.changes["cash_first"] < nb_rows)
+            },
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """ Timeline as plain arrays, so that it can be saved without pickling """
+        arrays = {
+            "dates": self.dates,
+            "holdings_keys": np.array(self.registry.keys, dtype=str),
+            "currencies": np.array([c.name for c in self.currencies], dtype=str),
+            "every": np.array(self.every),
+            "monthly": np.array(self.monthly),
+        }
+        for field, values in self.holdings_fields.items():
+            arrays[f"holdings_{field}"] = values
+        for name, values in self.changes.items():
+            arrays[f"changes_{name}"] = values
+        for name, values in self.snapshots.items():
+            arrays[f"snapshots_{name}"] = values
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: Mapping[str, np.ndarray]) -> "BalanceTimeline":
+        """ Timeline from arrays created with to_arrays() """
+
+        def _group(prefix: str) -> Dict[str, np.ndarray]:
+            return {
+                name[len(prefix) :]: arrays[name]
+                for name in arrays
+                if name.startswith(prefix)
+            }
+
+        holdings_fields = _group("holdings_")
+        return BalanceTimeline(
+            dates=arrays["dates"],
+            registry=HoldingRegistry(holdings_fields.pop("keys").tolist()),
+            holdings_fields=holdings_fields,
+            currencies=[Currency[c] for c in arrays["currencies"].tolist()],
+            changes=_group("changes_"),
+            snapshots=_group("snapshots_"),
+            every=int(arrays["every"]),
+            monthly=bool(arrays["monthly"]),
+        )
+
+    def save(self, path: str, fingerprint: str = ""):
+        """
+        Save the timeline to path (npz), along with a fingerprint of the
+        transactions it was built from
+        """
+        self.fingerprint = fingerprint
+        with open(path + ".tmp", "wb") as fd:
+            np.savez_compressed(
+                fd,
+                version=np.array(TIMELINE_VERSION),
+                fingerprint=np.array(fingerprint),
+                **self.to_arrays(),
+            )
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(
+        path: str, fingerprint: Optional[str] = None
+    ) -> Optional["BalanceTimeline"]:
+        """
+        Timeline saved at path, None if missing, outdated or (when given)
+        saved with a different fingerprint
+        """
+        try:
+            with np.load(path) as npz:
+                arrays = dict(npz.items())
+        except (OSError, ValueError):
+            return None
+
+        if arrays.pop("version", None) != TIMELINE_VERSION:
+            return None
+        saved = str(arrays.pop("fingerprint", ""))
+        if fingerprint is not None and saved != fingerprint:
+            return None
+
+        try:
+            timeline = BalanceTimeline.from_arrays(arrays)
+        except (KeyError, ValueError):
+            return None
+        timeline.fingerprint = saved
+        return timeline
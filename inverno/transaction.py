@@ -1,6 +1,7 @@
 from enum import Enum
-from typing import Optional
+from typing import Optional, Tuple
 from datetime import datetime
+import sys
 from .price import Price
 
 
@@ -34,7 +35,31 @@ class TransactionAction(Enum):
         raise ValueError(f'Cannot translate action "{action}"')
 
 
+# Actions of transactions done for a holding
+HOLDING_ACTIONS = frozenset(
+    [
+        TransactionAction.BUY,
+        TransactionAction.SELL,
+        TransactionAction.VEST,
+        TransactionAction.SPLIT,
+    ]
+)
+
+
 class Transaction:
+    __slots__ = (
+        "action",
+        "date",
+        "quantity",
+        "price",
+        "fees",
+        "name",
+        "ticker",
+        "isin",
+        "amount",
+        "_holding_key",
+    )
+
     def __init__(
         self,
         action: TransactionAction,
@@ -56,24 +81,57 @@ class Transaction:
         self.ticker = ticker
         self.isin = isin
         self.amount = amount
+        self._holding_key = None
 
         self._check_constraints()
         self._infer_missing_fields()
 
+    @classmethod
+    def from_validated(
+        cls,
+        action: TransactionAction,
+        date: datetime,
+        quantity: Optional[float] = None,
+        price: Optional[Price] = None,
+        ticker: Optional[str] = None,
+        isin: Optional[str] = None,
+        name: Optional[str] = None,
+        fees: Optional[Price] = None,
+        amount: Optional[Price] = None,
+    ) -> "Transaction":
+        """
+        Transaction whose fields were already checked and completed in bulk
+        (see TransactionsValidator): constraints aren't checked again and
+        missing fields aren't inferred
+        """
+        trs = cls.__new__(cls)
+        trs.action = action
+        trs.date = date
+        trs.quantity = quantity
+        trs.price = price
+        trs.fees = fees
+        trs.name = name
+        trs.ticker = ticker
+        trs.isin = isin
+        trs.amount = amount
+        trs._holding_key = None
+        return trs
+
     def __str__(self):
         return f"Transaction: {self.date} {self.action.value} {self.name} {self.amount}"
 
     def get_holding_key(self):
-        if (
-            self.action != TransactionAction.BUY
-            and self.action != TransactionAction.SELL
-            and self.action != TransactionAction.VEST
-            and self.action != TransactionAction.SPLIT
-        ):
+        if self.action not in HOLDING_ACTIONS:
             raise ValueError(
                 f"Cannot get holding key from transaction with action {self.action}"
             )
 
+        # Identifiers never change, the key is computed once
+        if self._holding_key is None:
+            self._holding_key = sys.intern(self._get_holding_key())
+        return self._holding_key
+
+    def _get_holding_key(self):
         # prioritize stronger identifiers
         if self.isin is not None:
             return self.isin
@@ -85,7 +143,7 @@ class Transaction:
 
     def _infer_missing_fields(self):
         if self.amount is None and self.quantity is not None and self.price is not None:
-            fees = 0. if self.fees is None else self.fees
+            fees = 0. if self.fees is None else self.fees.amount
             self.amount = Price(
                 currency=self.price.currency, amount=(self.quantity * self.price.amount) - fees
             )
@@ -174,15 +232,31 @@ class Transaction:
         if self.amount is None:
             raise ValueError("Amount must be set for dividends transactions")
 
-    def __eq__(self, o):
+    @staticmethod
+    def _price_fingerprint(price: Optional[Price]) -> Optional[Tuple]:
+        return None if price is None else (price.currency, price.amount)
+
+    def get_fingerprint(self) -> Tuple:
+        """
+        Canonical form of the transaction: transactions are equal if and only
+        if they have the same fingerprint
+        """
         return (
-            self.action == o.action and
-            self.date == o.date and
-            self.ticker == o.ticker and
-            self.isin == o.isin and
-            self.name == o.name and
-            self.fees == o.fees and
-            self.price == o.price and
-            self.quantity == o.quantity and
-            self.amount == o.amount
+            self.action,
+            self.date,
+            self.ticker,
+            self.isin,
+            self.name,
+            self._price_fingerprint(self.fees),
+            self._price_fingerprint(self.price),
+            self.quantity,
+            self._price_fingerprint(self.amount),
         )
+
+    def __eq__(self, o):
+        if not isinstance(o, Transaction):
+            return NotImplemented
+        return self.get_fingerprint() == o.get_fingerprint()
+
+    def __hash__(self):
+        return hash(self.get_fingerprint())
@@ -0,0 +1,159 @@
+"""
+Validation of transactions in bulk
+"""
+
+from typing import List, Tuple
+import numpy as np
+from .columnar import TransactionColumns
+from .money import MISSING, to_units, from_units
+from .transaction import TransactionAction
+
+# Number of invalid rows listed in error messages
+MAX_REPORTED_ERRORS = 20
+
+
+class TransactionsError(ValueError):
+    """
+    Invalid transactions, errors are (source, row, reason) tuples where rows
+    are counted from 1 (the first transaction of the source)
+    """
+
+    def __init__(self, errors: List[Tuple[str, int, str]]):
+        self.errors = errors
+        lines = [
+            f"  {source}, row {row}: {reason}"
+            for source, row, reason in errors[:MAX_REPORTED_ERRORS]
+        ]
+        if len(errors) > MAX_REPORTED_ERRORS:
+            lines.append(f"  ... and {len(errors) - MAX_REPORTED_ERRORS} more")
+        super().__init__(
+            f"Found {len(errors)} invalid transaction(s):\n" + "\n".join(lines)
+        )
+
+
+def _is_in(actions: np.ndarray, *expected: TransactionAction) -> np.ndarray:
+    return np.isin(actions, list(expected))
+
+
+def _differ(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """ Whether both currencies are set and are different """
+    both = (left != None) & (right != None)  # pylint: disable=singleton-comparison
+    return both & (left != right)
+
+
+class TransactionsValidator:
+    """
+    Checks the same constraints as Transaction (see _check_constraints),
+    on all the rows of transactions columns at once, and infers their missing
+    fields. Errors of all the validated columns are collected, so that they
+    can be reported together (see check).
+    """
+
+    def __init__(self):
+        self.errors: List[Tuple[str, int, str]] = []
+
+    def validate(self, columns: TransactionColumns, source: str) -> TransactionColumns:
+        """
+        Validate columns read from source (e.g. a file name), returns the
+        columns with missing quantities, prices and amounts inferred
+        """
+        action = columns.action
+        quantity = np.abs(columns.quantity)
+        price = columns.price.copy()
+        price_currency = columns.price_currency.copy()
+        amount = columns.amount.copy()
+        amount_currency = columns.amount_currency.copy()
+
+        has_quantity = ~np.isnan(quantity)
+        has_price = ~np.isnan(price)
+        has_fees = columns.fees != MISSING
+        has_amount = amount != MISSING
+        trades = _is_in(action, TransactionAction.BUY, TransactionAction.SELL)
+
+        # Checks are listed in the order they are done by Transaction, only the
+        # first failed check of each row is reported
+        checks = [
+            (has_quantity & (quantity <= 0), "Quantity must be > 0"),
+            (has_price & (price <= 0), "Price must be > 0"),
+            (has_fees & (columns.fees <= 0), "Fees must be > 0"),
+            (has_amount & (amount < 0), "Amount must be positive"),
+            (
+                _differ(price_currency, columns.fees_currency)
+                | _differ(price_currency, amount_currency)
+                | _differ(columns.fees_currency, amount_currency),
+                "Currency of price, fees and amount must be the same",
+            ),
+            (
+                trades
+                & (columns.name == None)  # pylint: disable=singleton-comparison
+                & (columns.ticker == None)  # pylint: disable=singleton-comparison
+                & (columns.isin == None),  # pylint: disable=singleton-comparison
+                "Didn't find any valid identifier for transaction",
+            ),
+            (
+                trades & ~has_price & ~has_amount,
+                "Price or amount must be set for buy/sell transactions",
+            ),
+            (
+                _is_in(action, TransactionAction.VEST) & ~has_quantity,
+                "Quantity must be set for vest transactions",
+            ),
+            (
+                _is_in(action, TransactionAction.TAX) & ~has_amount,
+                "Amount must be set for tax transactions",
+            ),
+            (
+                _is_in(action, TransactionAction.CASH_IN, TransactionAction.CASH_OUT)
+                & ~has_amount,
+                "Amount must be set for cash transactions",
+            ),
+            (
+                _is_in(action, TransactionAction.DIV) & ~has_amount,
+                "Amount must be set for dividends transactions",
+            ),
+        ]
+        invalid = np.zeros(len(columns), dtype=bool)
+        errors = []
+        for failed, reason in checks:
+            for row in np.flatnonzero(failed & ~invalid):
+                errors.append((int(row), reason))
+            invalid |= failed
+
+        # Quantity of buy/sell transactions defaults to one
+        quantity[trades & ~has_quantity] = 1.0
+        has_quantity |= trades
+
+        # Price of buy/sell transactions from amount and quantity
+        infer = trades & ~has_price & ~invalid
+        price[infer] = np.abs(from_units(amount[infer]) / quantity[infer])
+        price_currency[infer] = amount_currency[infer]
+        has_price |= infer
+
+        # Amount from price, quantity and fees
+        infer = ~has_amount & has_quantity & has_price & ~invalid
+        fees = np.where(has_fees, from_units(columns.fees), 0.0)
+        inferred = quantity[infer] * price[infer] - fees[infer]
+        negative = np.flatnonzero(infer)[inferred < 0]
+        for row in negative:
+            errors.append((int(row), "Fees can't exceed price times quantity"))
+        amount[infer] = to_units(np.maximum(inferred, 0.0))
+        amount_currency[infer] = price_currency[infer]
+
+        errors.sort()
+        self.errors.extend((source, row + 1, reason) for row, reason in errors)
+
+        # Rows of columns without errors needn't be checked again
+        validated = columns.columns()
+        validated.update(
+            quantity=quantity,
+            price=price,
+            price_currency=price_currency,
+            amount=amount,
+            amount_currency=amount_currency,
+        )
+        return TransactionColumns(validated=not errors, **validated)
+
+    def check(self):
+        """ Raise a TransactionsError listing all the errors found so far """
+        if self.errors:
+            raise TransactionsError(self.errors)
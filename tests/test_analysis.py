@@ -1,10 +1,12 @@
 from typing import Dict, List
 from datetime import datetime
 import pytest
+import numpy as np
 import pandas as pd
 from inverno.price import Currency, Price
-from inverno.analysis import Analysis
-from inverno.balance import Balance
+from inverno.analysis import Analysis, AttrsWeights
+from inverno.registry import HoldingRegistry
+from inverno.timeline import BalanceTimeline
 from inverno.transaction import Transaction, TransactionAction
 
 # pylint: disable=missing-function-docstring
@@ -125,8 +127,7 @@ def test_allocations(analysis_data):
         holdings_currencies=data["holdings_currencies"],
     )
 
-    balances = Balance.get_balances(transactions=data["transactions"]["base"])
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=data["transactions"]["base"])
     df = pd.DataFrame(
         columns=list(data["prices"].columns) + ["cash"],
         index=data["prices"].index,
@@ -134,8 +135,7 @@ def test_allocations(analysis_data):
     )
     assert df.equals(allocations)
 
-    balances = Balance.get_balances(transactions=data["transactions"]["base_add_cash"])
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=data["transactions"]["base_add_cash"])
     df = pd.DataFrame(
         columns=list(data["prices"].columns) + ["cash"],
         index=data["prices"].index,
@@ -143,8 +143,7 @@ def test_allocations(analysis_data):
     )
     assert df.equals(allocations)
 
-    balances = Balance.get_balances(transactions=data["transactions"]["base_vest"])
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=data["transactions"]["base_vest"])
     df = pd.DataFrame(
         columns=list(data["prices"].columns) + ["cash"],
         index=data["prices"].index,
@@ -162,8 +161,7 @@ def test_earnings(analysis_data):
     )
 
     transactions = data["transactions"]["base"]
-    balances = Balance.get_balances(transactions=transactions)
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=transactions)
     earnings = analysis.get_earnings(
         allocations=allocations,
         transactions=transactions,
@@ -172,8 +170,7 @@ def test_earnings(analysis_data):
     assert earnings.equals(expected)
 
     transactions = data["transactions"]["base_add_cash"]
-    balances = Balance.get_balances(transactions=transactions)
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=transactions)
     earnings = analysis.get_earnings(
         allocations=allocations,
         transactions=transactions,
@@ -182,8 +179,7 @@ def test_earnings(analysis_data):
     assert earnings.equals(expected)
 
     transactions = data["transactions"]["base_vest"]
-    balances = Balance.get_balances(transactions=transactions)
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=transactions)
     earnings = analysis.get_earnings(
         allocations=allocations,
         transactions=transactions,
@@ -192,6 +188,52 @@ def test_earnings(analysis_data):
     assert earnings.equals(expected)
 
 
+def _get_earnings_reference(analysis, allocations, transactions, ndays=None):
+    """ Former implementation of get_earnings (one tail update per flow) """
+    earnings = allocations.sum(axis=1)
+
+    for trs in transactions:
+        if trs.action in (TransactionAction.CASH_IN, TransactionAction.CASH_OUT):
+            rows = earnings.loc[trs.date :]
+            delta = trs.amount.normalize_currency(analysis.conv_rates)
+            earnings.loc[trs.date :] = rows.add(
+                -delta if trs.action == TransactionAction.CASH_IN else delta
+            )
+        elif trs.action == TransactionAction.VEST:
+            rows = earnings.loc[trs.date :]
+            price = analysis.prices.loc[trs.date :][trs.get_holding_key()].iloc[0]
+            holding_cur = analysis.holdings_currencies[trs.get_holding_key()]
+            delta = Price(
+                currency=holding_cur, amount=trs.quantity * price
+            ).normalize_currency(analysis.conv_rates)
+            earnings.loc[trs.date :] = rows.add(-delta)
+
+    if ndays is not None:
+        earnings = earnings.iloc[-ndays:]
+
+    return earnings.add(-earnings.iloc[0])
+
+
+def test_earnings_regression(analysis_data):
+    data = analysis_data
+    analysis = Analysis(
+        prices=data["prices"],
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    )
+
+    for transactions in data["transactions"].values():
+        allocations = analysis.get_allocations(transactions=transactions)
+        for ndays in [None, 1]:
+            earnings = analysis.get_earnings(
+                allocations=allocations, transactions=transactions, ndays=ndays
+            )
+            expected = _get_earnings_reference(
+                analysis, allocations, transactions, ndays=ndays
+            )
+            assert earnings.equals(expected)
+
+
 def test_attrs_allocations(analysis_data):
     data = analysis_data
     analysis = Analysis(
@@ -206,8 +248,7 @@ def test_attrs_allocations(analysis_data):
     }
 
     transactions = data["transactions"]["base"]
-    balances = Balance.get_balances(transactions=transactions)
-    allocations = analysis.get_allocations(balances=balances.values())
+    allocations = analysis.get_allocations(transactions=transactions)
     attrs_alloc = analysis.get_attr_allocations(
         allocations=allocations, attr="Test", attr_weights=attr_weights
     )
@@ -219,6 +260,60 @@ def test_attrs_allocations(analysis_data):
     assert df.equals(attrs_alloc)
 
 
+def test_attrs_allocations_all_at_once(analysis_data):
+    data = analysis_data
+    analysis = Analysis(
+        prices=data["prices"],
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    )
+
+    attrs_weights = {
+        "Test": {"A": {"FB": 0.75, "TSM": 0.5}, "B": {"TSM": 0.5}},
+        "holdings": {"FB": {"FB": 1.0}, "TSM": {"TSM": 1.0}},
+    }
+
+    allocations = analysis.get_allocations(
+        transactions=data["transactions"]["base"]
+    )
+    attrs_alloc = analysis.get_attrs_allocations(
+        allocations=allocations, attrs_weights=attrs_weights
+    )
+
+    assert list(attrs_alloc) == ["Test", "holdings"]
+    for attr, weights in attrs_weights.items():
+        expected = analysis.get_attr_allocations(
+            allocations=allocations, attr=attr, attr_weights=weights
+        )
+        assert expected.equals(attrs_alloc[attr])
+
+    df = pd.DataFrame(
+        columns=["FB", "TSM", "unknown"],
+        index=data["prices"].index,
+        data=[[4.0, 2.0, 0.0], [8.0, 1.0, 0.0]],
+    )
+    assert df.equals(attrs_alloc["holdings"])
+
+
+def test_attrs_weights_dot(monkeypatch):
+    registry = HoldingRegistry(["A", "B", "C"])
+    weights = AttrsWeights(
+        registry,
+        {
+            "x": {"v": {"A": 0.5, "B": 0.25, "C": 1.0}, "w": {"A": 0.5}},
+            "y": {"v": {"B": 1.0}},
+        },
+    )
+    dense = np.zeros((len(registry), weights.ncols))
+    dense[weights.rows, weights.cols] = weights.weights
+    matrix = np.arange(12, dtype=np.float64).reshape(4, 3)
+
+    # Products are computed in chunks, splitting columns between them
+    for block_size in [4, 8, 1 << 20]:
+        monkeypatch.setattr("inverno.analysis.DOT_BLOCK_SIZE", block_size)
+        assert np.allclose(weights.dot(matrix), matrix @ dense)
+
+
 def test_attrs_earnings(analysis_data):
     data = analysis_data
     analysis = Analysis(
@@ -228,8 +323,7 @@ def test_attrs_earnings(analysis_data):
     )
 
     def _get_attrs_earnings(transactions, attr_weights):
-        balances = Balance.get_balances(transactions=transactions)
-        allocations = analysis.get_allocations(balances=balances.values())
+        allocations = analysis.get_allocations(transactions=transactions)
         attrs_alloc = analysis.get_attr_allocations(
             allocations=allocations, attr="Test", attr_weights=attr_weights
         )
@@ -271,3 +365,115 @@ def test_attrs_earnings(analysis_data):
         attr_weights,
     )
     assert df.equals(attrs_earnings)
+
+
+def test_positions(analysis_data):
+    data = analysis_data
+    analysis = Analysis(
+        prices=data["prices"],
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    )
+
+    positions = analysis.get_positions(data["transactions"]["base_sell"])
+    assert positions.holdings_keys == ["FB", "TSM"]
+    assert positions.quantities.tolist() == [[1.0, 1.0], [0.0, 1.0]]
+    assert positions.currencies == [Currency.USD, Currency.TWD]
+    assert positions.cash.tolist() == [[6.0, -4.0], [14.0, -4.0]]
+
+
+def test_attrs_earnings_all_at_once(analysis_data):
+    data = analysis_data
+    analysis = Analysis(
+        prices=data["prices"],
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    )
+
+    attrs_weights = {
+        "First": {"A": {"FB": 0.75, "TSM": 0.5}, "B": {"TSM": 0.5}},
+        "Second": {"C": {"TSM": 1.0}},
+    }
+
+    transactions = data["transactions"]["base_sell"]
+    allocations = analysis.get_allocations(transactions=transactions)
+    attrs_alloc = {
+        attr: analysis.get_attr_allocations(
+            allocations=allocations, attr=attr, attr_weights=weights
+        )
+        for attr, weights in attrs_weights.items()
+    }
+    attrs_earnings = analysis.get_attrs_earnings(
+        attrs_allocations=attrs_alloc,
+        transactions=transactions,
+        attrs_weights=attrs_weights,
+    )
+
+    for attr, weights in attrs_weights.items():
+        expected = analysis.get_attr_earnings(
+            attr_allocations=attrs_alloc[attr],
+            transactions=transactions,
+            attr_weights=weights,
+        )
+        assert expected.equals(attrs_earnings[attr])
+
+    df = pd.DataFrame(
+        columns=["C", "unknown"],
+        index=data["prices"].index,
+        data=[[0.0, 0.0], [-1.0, 4.0]],
+    )
+    assert df.equals(attrs_earnings["Second"])
+
+
+def test_daily_conv_rates(analysis_data):
+    data = analysis_data
+    conv_rates = pd.DataFrame(
+        {"USD": [1.0, 1.0], "TWD": [2.0, 4.0]},
+        index=pd.DatetimeIndex(["2021-05-01", "2021-05-04"]),
+    )
+    analysis = Analysis(
+        prices=data["prices"],
+        conv_rates=conv_rates,
+        holdings_currencies=data["holdings_currencies"],
+    )
+
+    # Each day uses the rates of the closest previous day
+    allocations = analysis.get_allocations(transactions=data["transactions"]["base"])
+    df = pd.DataFrame(
+        columns=list(data["prices"].columns) + ["cash"],
+        index=data["prices"].index,
+        data=[[4.0, 2.0, 4.0], [8.0, 0.5, 5.0]],
+    )
+    assert df.equals(allocations)
+
+    with pytest.raises(ValueError):
+        Analysis(
+            prices=data["prices"],
+            conv_rates={"USD": 1.0},
+            holdings_currencies=data["holdings_currencies"],
+        ).get_allocations(transactions=data["transactions"]["base"])
+
+
+def test_allocations_opening(analysis_data):
+    data = analysis_data
+    transactions = data["transactions"]["base_sell"]
+    expected = Analysis(
+        prices=data["prices"],
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    ).get_allocations(transactions=transactions)
+
+    # Only the last day is analysed, earlier transactions are replaced by the
+    # balance they lead to
+    window = data["prices"].iloc[1:]
+    timeline = BalanceTimeline.from_transactions(transactions)
+    analysis = Analysis(
+        prices=window,
+        conv_rates=data["conv_rates"],
+        holdings_currencies=data["holdings_currencies"],
+    )
+    allocations = analysis.get_allocations(
+        transactions=transactions[timeline.rows_before(window.index[0]) :],
+        opening=timeline.balance_before(window.index[0]),
+    )
+    assert expected.iloc[1:].equals(allocations)
@@ -0,0 +1,104 @@
+from datetime import datetime
+from inverno.balance import Balance
+from inverno.persistent import PersistentMap
+from inverno.price import Currency, Price
+from inverno.transaction import Transaction, TransactionAction
+
+# pylint: disable=missing-function-docstring
+
+
+def test_persistent_map():
+    base = PersistentMap({"A": 1, "B": 2})
+    updated = base.set("A", 10).set("C", 3)
+
+    assert dict(base) == {"A": 1, "B": 2}
+    assert dict(updated) == {"A": 10, "B": 2, "C": 3}
+    assert list(updated) == ["A", "B", "C"]
+    assert len(updated) == 3
+    assert "C" not in base
+
+
+def test_persistent_map_many_keys():
+    pmap = PersistentMap()
+    versions = []
+    for i in range(2000):
+        pmap = pmap.set(f"H{i}", i)
+        versions.append(pmap)
+
+    assert len(pmap) == 2000
+    assert list(pmap) == [f"H{i}" for i in range(2000)]
+    assert all(pmap[f"H{i}"] == i for i in range(2000))
+    assert len(versions[99]) == 100
+    assert "H100" not in versions[99]
+
+
+def test_balances_are_not_modified():
+    transactions = [
+        Transaction(
+            date=datetime(2021, 5, 3),
+            action=TransactionAction.CASH_IN,
+            amount=Price(currency=Currency.USD, amount=10.0),
+        ),
+        Transaction(
+            date=datetime(2021, 5, 4),
+            action=TransactionAction.BUY,
+            ticker="FB",
+            quantity=1.0,
+            price=Price(currency=Currency.USD, amount=4.0),
+        ),
+        Transaction(
+            date=datetime(2021, 5, 5),
+            action=TransactionAction.SELL,
+            ticker="FB",
+            quantity=1.0,
+            price=Price(currency=Currency.USD, amount=5.0),
+        ),
+    ]
+    balances = list(Balance.get_balances(transactions=transactions).values())
+
+    assert balances[0].get_cash_balance(Currency.USD) == 10.0
+    assert "FB" not in balances[0].holdings
+
+    assert balances[1].get_cash_balance(Currency.USD) == 6.0
+    assert balances[1].holdings["FB"].quantity == 1.0
+
+    assert balances[2].get_cash_balance(Currency.USD) == 11.0
+    assert balances[2].holdings["FB"].quantity == 0.0
+
+
+def test_process_transactions_in_place():
+    def _buy(day, quantity):
+        return Transaction(
+            date=datetime(2021, 5, day),
+            action=TransactionAction.BUY,
+            ticker="FB",
+            quantity=quantity,
+            price=Price(currency=Currency.USD, amount=4.0),
+        )
+
+    start = Balance(date=datetime(2021, 5, 1)).process_transaction(_buy(1, 1.0))
+    end = start.process_transactions([_buy(2, 2.0), _buy(3, 3.0)])
+
+    assert end.date == datetime(2021, 5, 3)
+    assert end.holdings["FB"].quantity == 6.0
+    assert end.get_cash_balance(Currency.USD) == -24.0
+
+    # Holdings shared with other balances are never updated in place
+    assert start.holdings["FB"].quantity == 1.0
+    assert start.process_transactions([_buy(4, 4.0)]).holdings["FB"].quantity == 5.0
+    assert start.holdings["FB"].quantity == 1.0
+    assert end.holdings["FB"].quantity == 6.0
+
+
+def test_cash_is_exact():
+    deposit = Transaction(
+        date=datetime(2021, 5, 3),
+        action=TransactionAction.CASH_IN,
+        amount=Price(currency=Currency.USD, amount=0.1),
+        fees=Price(currency=Currency.USD, amount=0.01),
+    )
+    balance = Balance(date=deposit.date).process_transactions([deposit] * 10)
+
+    # Floats would sum up to 0.8999999999999998
+    assert balance.get_cash_balance(Currency.USD) == 0.9
+    assert balance.get_cash_units(Currency.USD) == 900_000
@@ -0,0 +1,169 @@
+from datetime import datetime
+import pandas as pd
+import pytest
+from inverno.columnar import (
+    TransactionColumns,
+    TransactionsIndex,
+    parse_dates,
+    parse_prices,
+)
+from inverno.holding import Holding
+from inverno.money import MISSING
+from inverno.price import Currency, Price
+from inverno.transaction import Transaction, TransactionAction
+
+# pylint: disable=missing-function-docstring
+
+transactions_csv = """
+date,action,name,ticker,isin,quantity,price,fees,amount
+10/02/21,cash_in,,,,,,,"$4,000.00"
+12/02/21,buy,,FB,,4,$1234.56,,
+15/02/21,cash_in,,,,,,,"£2,000.00"
+17/02/21,buy,My Fund,,,4.1443,,,£1000.00
+""".strip()
+
+schwab_csv = """
+"Transactions  for account XXXX-1234 as of 05/25/2021 10:00 AM ET"
+"Date","Action","Symbol","Description","Quantity","Price","Fees & Comm","Amount",
+"05/20/2021","Buy","FB","FACEBOOK INC","4","$300.00","$1.00","-$1201.00",
+"05/21/2021 as of 05/20/2021","Qualified Dividend","AAPL","APPLE INC","","","","$1.50",
+"05/22/2021","NRA Tax Adj","AAPL","APPLE INC","","","","-$0.45",
+Transactions Total,"","","","","","","-$1199.95",
+""".strip()
+
+
+def test_parse_prices():
+    prices = ["$4,000.00", "-£12.5", "12-$", " -NT$3", "EUR 1.5 x2", "USD10"]
+    amounts, currencies = parse_prices(pd.Series(prices + [""]))
+
+    for price, amount, currency in zip(prices, amounts, currencies):
+        expected = Price.from_str(price.replace("-", ""))
+        sign = -1 if price.strip().startswith("-") else 1
+        assert amount == sign * expected.amount
+        assert currency == expected.currency
+
+    assert pd.isna(amounts[-1])
+    assert currencies[-1] is None
+
+    with pytest.raises(ValueError):
+        parse_prices(pd.Series(["12"]))
+
+    with pytest.raises(ValueError):
+        parse_prices(pd.Series(["$"]))
+
+
+def test_parse_dates():
+    dates = parse_dates(pd.Series(["10/02/21", "12/03/21"]))
+    assert list(pd.DatetimeIndex(dates)) == [
+        datetime(2021, 2, 10),
+        datetime(2021, 3, 12),
+    ]
+
+    dates = parse_dates(pd.Series(["21 May 2021", "22 May 2021"]))
+    assert list(pd.DatetimeIndex(dates)) == [
+        datetime(2021, 5, 21),
+        datetime(2021, 5, 22),
+    ]
+
+    # Mixed formats fallback to parsing each value
+    dates = parse_dates(pd.Series(["21 May 2021", "22/05/2021"]))
+    assert list(pd.DatetimeIndex(dates)) == [
+        datetime(2021, 5, 21),
+        datetime(2021, 5, 22),
+    ]
+
+
+def test_standard_csv():
+    columns = TransactionColumns.from_standard_csv(transactions_csv)
+    assert len(columns) == 4
+    assert columns.ticker.tolist() == [None, "FB", None, None]
+    assert columns.amount_currency.tolist() == [
+        Currency.USD,
+        None,
+        Currency.GBP,
+        Currency.GBP,
+    ]
+
+    # Amounts are stored in fixed point
+    assert columns.amount.tolist() == [
+        4_000_000_000,
+        MISSING,
+        2_000_000_000,
+        1_000_000_000,
+    ]
+
+    transactions = columns.to_transactions()
+    assert transactions[1] == Transaction(
+        action=TransactionAction.BUY,
+        date=datetime(2021, 2, 12),
+        ticker="FB",
+        quantity=4,
+        price=Price(Currency.USD, 1234.56),
+    )
+
+    # Round trip
+    columns = TransactionColumns.from_transactions(transactions)
+    assert columns.to_transactions() == transactions
+
+
+def test_transactions_index():
+    identifiers = [
+        ("Fund", None, None),
+        (None, "FB", None),
+        ("Facebook", "FB", "US30303M1027"),
+        (None, "FB", "US30303M1027"),
+        ("Fund", "FND", None),
+        (None, None, None),
+    ]
+    transactions = []
+    for i in range(24):
+        name, ticker, isin = identifiers[(i * 7) % len(identifiers)]
+        if name is None and ticker is None and isin is None:
+            trs = Transaction(
+                action=TransactionAction.CASH_IN,
+                date=datetime(2021, 2, 1 + i),
+                amount=Price(Currency.USD, 1.0),
+            )
+        else:
+            trs = Transaction(
+                action=TransactionAction.BUY,
+                date=datetime(2021, 2, 1 + i),
+                name=name,
+                ticker=ticker,
+                isin=isin,
+                quantity=1,
+                price=Price(Currency.USD, 1.0),
+            )
+        transactions.append(trs)
+    index = TransactionsIndex(TransactionColumns.from_transactions(transactions))
+
+    holdings = [Holding(name=n, ticker=t, isin=i) for n, t, i in identifiers[:-1]]
+    holdings.append(Holding(ticker="UNKNOWN"))
+    for holding in holdings:
+        expected = [
+            row for row, trs in enumerate(transactions) if holding.match_transaction(trs)
+        ]
+        assert index.get_rows(holding).tolist() == expected
+
+
+def test_from_schwab_csv():
+    columns = TransactionColumns.from_schwab_csv(schwab_csv)
+    transactions = columns.to_transactions()
+
+    assert len(transactions) == 3
+    assert transactions[0] == Transaction(
+        action=TransactionAction.BUY,
+        date=datetime(2021, 5, 20),
+        ticker="FB",
+        name="FACEBOOK INC",
+        quantity=4,
+        price=Price(Currency.USD, 300.0),
+        fees=Price(Currency.USD, 1.0),
+        amount=Price(Currency.USD, 1201.0),
+    )
+    assert transactions[1].date == datetime(2021, 5, 21)
+    assert transactions[1].action == TransactionAction.DIV
+    assert transactions[2].amount == Price(Currency.USD, 0.45)
+
+    with pytest.raises(ValueError, match="Expected a negative value"):
+        TransactionColumns.from_schwab_csv(schwab_csv.replace("-$0.45", "$0.45"))
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 import pytest
 from inverno.price import Currency, Price
@@ -110,6 +111,25 @@ def test_prices(get_config):
     assert len(prices) == (cfg.end_date - start).days + 1
 
 
+def test_prices_file_parsed_once(get_config):
+    cfg = get_config
+    cfg.provide_file(
+        "prices.csv",
+        "date,price\n22/05/21,£2\n20/05/21,£1\n22/05/21,£3\n",
+    )
+    h = Holding(name="TEST")
+
+    assert cfg.get_currency(h) == Currency.GBP
+    prices = cfg.get_prices(h, start=datetime(2021, 5, 20))
+    assert list(cfg._prices_files) == ["prices.csv"]
+
+    # Rows are sorted by date, the last price of a date wins
+    assert prices[0] == 1.0
+    assert prices.isna()[1]
+    assert prices[2] == 3.0
+    assert cfg.get_currency(Holding(name="OTHER")) is None
+
+
 config_meta_base = """
 meta:
     - match:
@@ -167,3 +187,128 @@ def test_meta_composition():
     assert "H1" not in meta["attr_1"]["val_b"]
     assert meta["attr_2"]["val_a"]["H1"] == 0.75
     assert meta["attr_2"]["val_b"]["H1"] == 0.25
+
+
+def test_transactions_cache(tmp_path):
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text(config)
+    trs_path = tmp_path / "transactions.csv"
+    trs_path.write_text(transactions_csv)
+
+    def _load():
+        cfg = Config.from_file(path=str(cfg_path))
+        transactions = cfg.transactions
+        return cfg._cache, transactions
+
+    cache, expected = _load()
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    cache, transactions = _load()
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert transactions == expected
+
+    # Same content, different modification time
+    trs_path.write_text(transactions_csv)
+    os.utime(trs_path, ns=(0, 0))
+    cache, transactions = _load()
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # New lines appended
+    appended = transactions_csv + "\n13/02/21,cash_in,,,,,,,$1.00"
+    trs_path.write_text(appended)
+    cache, transactions = _load()
+    assert (cache.hits, cache.appends, cache.misses) == (0, 1, 0)
+    assert len(transactions) == len(expected) + 1
+
+    # Different content
+    trs_path.write_text(appended.replace("$4,000.00", "$5,000.00"))
+    cache, transactions = _load()
+    assert (cache.hits, cache.appends, cache.misses) == (0, 0, 1)
+    assert transactions[0].amount.amount == 5000.0
+
+    cfg = Config.from_file(path=str(cfg_path), use_cache=False)
+    assert cfg.transactions == transactions
+
+
+def test_meta_nested_compositions():
+    # Each fund is made of the two previous ones, which would be resolved an
+    # exponential number of times if not memoized
+    meta = [
+        "meta:",
+        "    - match:\n        name: F0\n      apply:\n        attr: val_a",
+        "    - match:\n        name: F1\n      apply:\n        attr: val_b",
+    ]
+    for i in range(2, 40):
+        meta.append(
+            f"    - match:\n        name: F{i}\n      composition:\n"
+            f"        name:\n            F{i - 1}: 50%\n            F{i - 2}: 50%"
+        )
+    cfg = Config(cfg="\n".join(meta))
+
+    attrs = cfg.get_meta_attributes([Holding(name="F39")])
+    assert attrs["attr"]["val_a"]["F39"] + attrs["attr"]["val_b"]["F39"] == 1.0
+    assert abs(attrs["attr"]["val_a"]["F39"] - 1 / 3) < 1e-6
+
+
+config_meta_cycle = """
+meta:
+    - match:
+        name: H1
+      composition:
+        name:
+            H2: 100%
+    - match:
+        name: H2
+      composition:
+        name:
+            H3: 50%
+    - match:
+        name: H3
+      composition:
+        name:
+            H1: 50%
+""".strip()
+
+
+def test_meta_composition_cycle():
+    cfg = Config(cfg=config_meta_cycle)
+    with pytest.raises(ValueError, match="H1 -> H2 -> H3 -> H1"):
+        cfg.get_meta_attributes([Holding(name="H1")])
+
+
+def test_includes(tmp_path):
+    (tmp_path / "shared").mkdir()
+    (tmp_path / "shared" / "meta.yml").write_text(
+        "options:\n    days: 5\nmeta:\n    - match:\n        name: S\n      apply:\n        a: b\n"
+    )
+    (tmp_path / "shared" / "region_a.yml").write_text(
+        "include:\n    - meta.yml\noptions:\n    days: 7\n"
+        "meta:\n    - match:\n        name: A\n      apply:\n        a: b\n"
+    )
+    (tmp_path / "shared" / "region_b.yml").write_text(
+        "include:\n    - meta.yml\n"
+        "meta:\n    - match:\n        name: B\n      apply:\n        a: b\n"
+    )
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text(
+        "include:\n    - shared/region_a.yml\n    - shared/region_b.yml\n"
+        "options:\n    title: test\n"
+    )
+
+    cfg = Config.from_file(path=str(cfg_path), use_cache=False)
+
+    # The shared file is merged once, before the configs including it
+    names = [entry["match"]["name"] for entry in cfg._cfg["meta"]]
+    assert names == ["S", "B", "A"]
+    assert cfg.title == "test"
+    assert cfg.days == 7
+
+
+def test_includes_cycle(tmp_path):
+    (tmp_path / "a.yml").write_text("include:\n    - b.yml\n")
+    (tmp_path / "b.yml").write_text("include:\n    - a.yml\n")
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text("include:\n    - a.yml\n")
+
+    with pytest.raises(ValueError, match="Include cycle"):
+        Config.from_file(path=str(cfg_path), use_cache=False)
@@ -0,0 +1,90 @@
+from datetime import datetime
+from inverno.columnar import TransactionColumns
+from inverno.config import Config
+from inverno.dedup import drop_duplicates, get_fingerprints
+from inverno.price import Currency, Price
+from inverno.transaction import Transaction, TransactionAction
+
+# pylint: disable=missing-function-docstring
+
+config = """
+options:
+    end_date: 23/05/21
+    dedup_transactions: true
+transactions:
+    - format: standard
+      file: january.csv
+    - format: standard
+      file: overlap.csv
+""".strip()
+
+january_csv = """
+date,action,name,ticker,isin,quantity,price,fees,amount
+10/01/21,cash_in,,,,,,,"$4,000.00"
+12/01/21,buy,,FB,,4,$100.00,,
+12/01/21,buy,,FB,,4,$100.00,,
+""".strip()
+
+overlap_csv = """
+date,action,name,ticker,isin,quantity,price,fees,amount
+12/01/21,buy,,FB,,4,$100.00,,
+12/01/21,buy,,FB,,4,$100.00,,
+12/01/21,buy,,FB,,4,$100.00,,
+12/01/21,buy,,FB,,4,$100.00,$1.00,
+13/02/21,cash_in,,,,,,,"$4,000.00"
+""".strip()
+
+
+def test_transaction_hash():
+    def _buy(**kwargs):
+        return Transaction(
+            action=TransactionAction.BUY,
+            date=datetime(2021, 1, 12),
+            ticker="FB",
+            quantity=4,
+            price=Price(Currency.USD, 100.0),
+            **kwargs
+        )
+
+    transactions = {_buy(), _buy(), _buy(fees=Price(Currency.USD, 1.0))}
+    assert len(transactions) == 2
+    assert _buy() in transactions
+    assert _buy() != _buy().get_fingerprint()
+
+
+def test_fingerprints():
+    columns = TransactionColumns.from_standard_csv(overlap_csv)
+    assert get_fingerprints(columns).tolist() == [0, 0, 0, 1, 2]
+    assert len(get_fingerprints(TransactionColumns.empty())) == 0
+
+
+def test_drop_duplicates():
+    january = TransactionColumns.from_standard_csv(january_csv)
+    overlap = TransactionColumns.from_standard_csv(overlap_csv)
+
+    tables, dropped = drop_duplicates([january, overlap])
+    assert dropped == [0, 2]
+    assert len(tables[0]) == 3
+    # Only the purchases already in january are dropped
+    assert tables[1].to_transactions() == overlap.take([2, 3, 4]).to_transactions()
+
+
+def test_config_dedup(capsys):
+    cfg = Config(cfg=config)
+    cfg.provide_file("january.csv", january_csv)
+    cfg.provide_file("overlap.csv", overlap_csv)
+
+    assert cfg.dedup_transactions
+    assert len(cfg.transactions) == 6
+    assert "Dropped 2 duplicated transaction(s) from overlap.csv" in (
+        capsys.readouterr().out
+    )
+    balance = cfg.balance_timeline.balance_at(datetime(2021, 5, 23))
+    assert balance.holdings["FB"].quantity == 16
+    assert balance.get_cash_balance(Currency.USD) == 8000 - 1601
+
+    cfg = Config(cfg=config.replace("dedup_transactions: true", "days: 90"))
+    cfg.provide_file("january.csv", january_csv)
+    cfg.provide_file("overlap.csv", overlap_csv)
+    assert not cfg.dedup_transactions
+    assert len(cfg.transactions) == 8
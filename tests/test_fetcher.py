@@ -0,0 +1,155 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen
+import io
+import threading
+import time
+import pandas as pd
+import pytest
+from inverno.fetcher import Fetcher
+from inverno.price_store import PriceStore
+
+# pylint: disable=missing-function-docstring
+
+
+class PriceServer(ThreadingHTTPServer):
+    """ Local stand-in for a prices server: /<ticker>?start=..&end=.. """
+
+    def __init__(self, failures: int = 0):
+        super().__init__(("127.0.0.1", 0), PriceHandler)
+        self.failures = failures
+        self.running = 0
+        self.max_running = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class PriceHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.running += 1
+            server.max_running = max(server.max_running, server.running)
+            fail = server.failures > 0
+            server.failures -= 1
+
+        time.sleep(0.02)
+        with server.lock:
+            server.running -= 1
+
+        if fail:
+            self.send_error(500)
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        dates = pd.date_range(query["start"][0], query["end"][0])[:-1]
+        body = "date,close\n" + "".join(
+            f"{d:%Y-%m-%d},{len(url.path) + d.day}\n" for d in dates
+        )
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+
+@pytest.fixture
+def server():
+    srv = PriceServer()
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _fetch_from(srv: PriceServer):
+    def _fetch(ticker: str, start: datetime, end: datetime) -> pd.Series:
+        url = f"{srv.url}/{ticker}?start={start:%Y-%m-%d}&end={end:%Y-%m-%d}"
+        with urlopen(url) as resp:
+            content = resp.read().decode()
+        df = pd.read_csv(io.StringIO(content), index_col="date", parse_dates=True)
+        return df["close"]
+
+    return _fetch
+
+
+def test_concurrent_fetch_keeps_order(server):
+    fetch = _fetch_from(server)
+    tickers = [f"T{i:02}" for i in range(20)]
+    fetcher = Fetcher(max_workers=8, per_host=3)
+
+    results = fetcher.map(
+        lambda t: fetch(t, datetime(2021, 5, 1), datetime(2021, 5, 3)),
+        tickers,
+        host=lambda _: "prices",
+    )
+
+    assert [r.iloc[0] for r in results] == [len(f"/{t}") + 1 for t in tickers]
+    assert server.requests == 20
+    assert 1 < server.max_running <= 3
+
+
+def test_fetch_retries(server):
+    server.failures = 2
+    delays = []
+    fetcher = Fetcher(retries=2, backoff=0.1, sleep=delays.append)
+
+    fetch = _fetch_from(server)
+    store = PriceStore(
+        fetch=lambda tickers, start, end: {t: fetch(t, start, end) for t in tickers},
+        now=lambda: datetime(2021, 6, 1),
+    )
+    results = fetcher.map(
+        lambda t: store.get_history(t, datetime(2021, 5, 1), datetime(2021, 5, 4)),
+        ["FB"],
+    )
+
+    assert list(results[0].values) == [4, 5, 6]
+    assert delays == [0.1, 0.2]
+
+
+def test_fetch_errors(server):
+    server.failures = 10
+    fetcher = Fetcher(retries=1, backoff=0, sleep=lambda _: None)
+    fetch = _fetch_from(server)
+
+    with pytest.raises(OSError):
+        fetcher.map(
+            lambda t: fetch(t, datetime(2021, 5, 1), datetime(2021, 5, 2)), ["FB"]
+        )
+    assert server.requests == 2
+
+
+def test_fetch_host_limits(server):
+    fetch = _fetch_from(server)
+    fetcher = Fetcher(max_workers=8, per_host=3, host_limits={"prices": 1})
+
+    fetcher.map(
+        lambda t: fetch(t, datetime(2021, 5, 1), datetime(2021, 5, 3)),
+        [f"T{i:02}" for i in range(5)],
+        host=lambda _: "prices",
+    )
+    assert server.max_running == 1
+
+
+def test_fetch_skip_errors(server):
+    server.failures = 2
+    fetcher = Fetcher(max_workers=1, retries=1, backoff=0, sleep=lambda _: None)
+    fetch = _fetch_from(server)
+
+    results = fetcher.map(
+        lambda t: fetch(t, datetime(2021, 5, 1), datetime(2021, 5, 2)),
+        ["FB", "AAPL"],
+        skip_errors=True,
+    )
+    assert results[0] is None
+    assert list(results[1].values) == [len("/AAPL") + 1]
@@ -0,0 +1,60 @@
+import random
+from inverno.holding import Holding
+from inverno.matcher import HoldingMatcher, HoldingsIndex
+
+# pylint: disable=missing-function-docstring
+
+
+def _matches(match_section, holding):
+    """ Reference matching (linear scan of the fields) """
+    return all(
+        match_section.get(f) is None or match_section[f].strip() == getattr(holding, f)
+        for f in ["ticker", "isin", "name"]
+    )
+
+
+def _random_match_sections(rnd, n):
+    sections = []
+    for _ in range(n):
+        section = {}
+        for field in ["ticker", "isin", "name"]:
+            if rnd.random() < 0.5:
+                section[field] = f" {field}{rnd.randint(0, 5)} "
+        sections.append(section)
+    return sections
+
+
+def _random_holdings(rnd, n):
+    return [
+        Holding(
+            ticker=rnd.choice([None, "ticker1", "ticker2"]),
+            isin=rnd.choice([None, "isin1", "isin2", "isin3"]),
+            name=f"name{rnd.randint(0, 5)}",
+        )
+        for _ in range(n)
+    ]
+
+
+def test_holding_matcher():
+    rnd = random.Random(0)
+    sections = _random_match_sections(rnd, 50)
+    matcher = HoldingMatcher(sections)
+
+    for holding in _random_holdings(rnd, 200):
+        expected = next(
+            (pos for pos, s in enumerate(sections) if _matches(s, holding)), None
+        )
+        assert matcher.find(holding) == expected
+
+    # A section without fields matches any holding
+    assert HoldingMatcher([{"ticker": "X"}, {}]).find(Holding(name="A")) == 1
+
+
+def test_holdings_index():
+    rnd = random.Random(1)
+    holdings = _random_holdings(rnd, 50)
+    index = HoldingsIndex(holdings)
+
+    for section in _random_match_sections(rnd, 200):
+        expected = next((h for h in holdings if _matches(section, h)), None)
+        assert index.find(section) is expected
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import numpy as np
+import pytest
+from inverno.price_store import PriceStore
+
+# pylint: disable=missing-function-docstring
+
+
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+        self.offset = 0.0
+
+    def __call__(self, tickers, start: datetime, end: datetime):
+        self.calls.append((tickers, start, end))
+        index = pd.date_range(start, end - timedelta(days=1), freq="D")
+        prices = pd.Series(index.day.values + self.offset, index=index)
+        return {ticker: prices for ticker in tickers if ticker != "UNKNOWN"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    now = {"value": datetime(2021, 5, 20, 18, 0)}
+    provider = FakeProvider()
+    store = PriceStore(
+        fetch=provider,
+        path=str(tmp_path / "prices.sqlite"),
+        freshness=timedelta(hours=1),
+        now=lambda: now["value"],
+    )
+    yield store, provider, now
+
+
+def test_fetch_only_gaps(store):
+    store, provider, _ = store
+
+    prices = store.get_history("FB", datetime(2021, 5, 5), datetime(2021, 5, 10))
+    assert list(prices.index.day) == [5, 6, 7, 8, 9]
+    assert provider.calls == [(["FB"], datetime(2021, 5, 5), datetime(2021, 5, 10))]
+
+    prices = store.get_history("FB", datetime(2021, 5, 1), datetime(2021, 5, 15))
+    assert list(prices.values) == list(range(1, 15))
+    assert provider.calls[1:] == [
+        (["FB"], datetime(2021, 5, 1), datetime(2021, 5, 5)),
+        (["FB"], datetime(2021, 5, 10), datetime(2021, 5, 15)),
+    ]
+
+    store.get_history("FB", datetime(2021, 5, 2), datetime(2021, 5, 12))
+    assert store.fetches == 3
+
+
+def test_recent_days_freshness(store):
+    store, provider, now = store
+
+    store.get_history("FB", datetime(2021, 5, 15), datetime(2021, 5, 21))
+    store.get_history("FB", datetime(2021, 5, 15), datetime(2021, 5, 21))
+    assert store.fetches == 1
+
+    # The day of the fetch wasn't over, it is fetched again once stale
+    provider.offset = 100.0
+    now["value"] += timedelta(hours=2)
+    prices = store.get_history("FB", datetime(2021, 5, 15), datetime(2021, 5, 21))
+    assert provider.calls[-1] == (["FB"], datetime(2021, 5, 20), datetime(2021, 5, 21))
+    assert prices[datetime(2021, 5, 19)] == 19
+    assert prices[datetime(2021, 5, 20)] == 120
+
+
+def test_store_persists(tmp_path):
+    provider = FakeProvider()
+    path = str(tmp_path / "prices.sqlite")
+    now = lambda: datetime(2021, 6, 1)
+
+    PriceStore(fetch=provider, path=path, now=now).get_history(
+        "FB", datetime(2021, 5, 1), datetime(2021, 5, 10)
+    )
+    store = PriceStore(fetch=provider, path=path, now=now)
+    prices = store.get_history("FB", datetime(2021, 5, 1), datetime(2021, 5, 10))
+    assert store.fetches == 0
+    assert len(prices) == 9
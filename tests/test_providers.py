@@ -0,0 +1,276 @@
+from datetime import datetime
+import threading
+import time
+import pandas as pd
+import pytest
+from inverno.config import Config
+from inverno.fetcher import Fetcher
+from inverno.holding import Holding
+from inverno.price import Currency
+from inverno.project import Project
+from inverno.benchmarks import get_benchmarks
+from inverno.providers import (
+    CachedProvider,
+    FixturesProvider,
+    PriceProvider,
+    YahooProvider,
+    make_provider,
+)
+
+# pylint: disable=missing-function-docstring
+
+
+class StubProvider(PriceProvider):
+    def __init__(self, known):
+        self.known = known
+        self.requests = []
+
+    def history(self, holdings, start, end):
+        self.requests.append([h.get_key() for h in holdings])
+        index = pd.date_range(start, end)[:-1]
+        return {
+            h.get_key(): pd.Series(1.0, index=index)
+            for h in holdings
+            if h.get_key() in self.known
+        }
+
+    def currency(self, holdings):
+        self.requests.append([h.get_key() for h in holdings])
+        return {h.get_key(): Currency.EUR for h in holdings if h.get_key() in self.known}
+
+
+@pytest.fixture
+def fixtures_dir(tmp_path):
+    directory = tmp_path / "fixtures"
+    directory.mkdir()
+    (directory / "FB.csv").write_text(
+        "date,price\n01/05/21,$10.00\n02/05/21,$11.00\n04/05/21,$12.00\n"
+    )
+    (directory / "^GSPC.csv").write_text(
+        "date,price\n03/05/21,$4000\n04/05/21,$4100\n"
+    )
+    return directory
+
+
+def test_fixtures_provider(fixtures_dir):
+    provider = FixturesProvider(directory=str(fixtures_dir))
+    holdings = [Holding(ticker="FB"), Holding(name="Unknown")]
+
+    prices = provider.history(holdings, datetime(2021, 5, 2), datetime(2021, 5, 4))
+    assert list(prices) == ["FB"]
+    assert prices["FB"].to_dict() == {pd.Timestamp(2021, 5, 2): 11.0}
+    assert provider.currency(holdings) == {"FB": Currency.USD}
+
+
+def test_provider_chain(fixtures_dir):
+    cfg = Config(cfg="options:\n    title: test")
+    fixtures = {"fixtures": str(fixtures_dir)}
+    chain = make_provider(["csv", fixtures], cfg=cfg, fetcher=Fetcher())
+    stub = StubProvider(known={"FB", "AAPL"})
+    chain.providers.append(stub)
+
+    holdings = [Holding(ticker="AAPL"), Holding(ticker="FB"), Holding(ticker="X")]
+    prices = chain.history(holdings, datetime(2021, 5, 1), datetime(2021, 5, 3))
+
+    # Results follow the order of the holdings, each provider is asked only
+    # for the holdings not found so far
+    assert list(prices) == ["AAPL", "FB"]
+    assert list(prices["FB"].values) == [10.0, 11.0]
+    assert stub.requests == [["AAPL", "X"]]
+
+    with pytest.raises(ValueError):
+        make_provider(["unknown"], cfg=cfg, fetcher=Fetcher())
+
+    # Providers must implement both history and currency
+    class HistoryOnly(PriceProvider):  # pylint: disable=abstract-method
+        def history(self, holdings, start, end):
+            return {}
+
+    with pytest.raises(TypeError):
+        HistoryOnly()
+
+
+def test_cached_provider():
+    stub = StubProvider(known={"FB"})
+    provider = CachedProvider(upstream=stub)
+    holdings = [Holding(ticker="FB"), Holding(ticker="X")]
+
+    for _ in range(2):
+        prices = provider.history(holdings, datetime(2021, 5, 1), datetime(2021, 5, 3))
+        currencies = provider.currency(holdings)
+
+    assert list(prices) == ["FB"]
+    assert len(prices["FB"]) == 2
+    assert currencies == {"FB": Currency.EUR}
+    assert stub.requests == [["FB", "X"], ["FB", "X"], ["X"]]
+
+
+def test_yahoo_provider(monkeypatch):
+    downloads = []
+
+    def _download(tickers, start, end, **_):
+        downloads.append(list(tickers))
+        index = pd.date_range(start, end)[:-1]
+        closes = pd.DataFrame(float("nan"), index=index, columns=tickers)
+        if "FB" in tickers:
+            closes["FB"] = 10.0
+        return pd.concat({"Close": closes, "Open": closes}, axis=1)
+
+    monkeypatch.setattr("inverno.providers.yf.download", _download)
+    fetcher = Fetcher(retries=1, backoff=0, sleep=lambda _: None)
+    provider = YahooProvider(fetcher=fetcher, chunk_size=2)
+    holdings = [Holding(ticker="FB"), Holding(ticker="X"), Holding(ticker="Y")]
+
+    prices = provider.history(holdings, datetime(2021, 5, 1), datetime(2021, 5, 3))
+
+    # Tickers without prices are left out, chunks without any price are
+    # retried and then skipped
+    assert list(prices) == ["FB"]
+    assert list(prices["FB"].values) == [10.0, 10.0]
+    assert downloads == [["FB", "X"], ["Y"], ["Y"]]
+
+
+def test_yahoo_currencies_overlap(monkeypatch):
+    lock = threading.Lock()
+    running = [0, 0]
+
+    class Ticker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        @property
+        def info(self):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return {"currency": "EUR"}
+
+    monkeypatch.setattr("inverno.providers.yf.Ticker", Ticker)
+    provider = YahooProvider(fetcher=Fetcher(max_workers=4))
+    holdings = [Holding(ticker=f"T{i}") for i in range(4)]
+
+    # Only downloads are serialized, info lookups run concurrently
+    assert provider.currency(holdings) == {h.ticker: Currency.EUR for h in holdings}
+    assert running[1] > 1
+
+
+def test_offline_report(tmp_path, fixtures_dir):
+    (tmp_path / "transactions.csv").write_text(
+        "date,action,name,ticker,isin,quantity,price,fees,amount\n"
+        '01/05/21,cash_in,,,,,,,"$1,000.00"\n'
+        "01/05/21,buy,,FB,,10,$10.00,,\n"
+    )
+    (tmp_path / "project.yml").write_text(
+        "options:\n"
+        "    end_date: 05/05/21\n"
+        "    days: 3\n"
+        "    price_providers:\n"
+        "        - csv\n"
+        "        - fixtures: fixtures\n"
+        "transactions:\n"
+        "    - format: standard\n"
+        "      file: transactions.csv\n"
+    )
+
+    project = Project(config=str(tmp_path / "project.yml"))
+    data = project._get_report_data()
+
+    assert data["balances"]["datasets"][0]["data"][-1] == 900 + 10 * 12.0
+    assert data["nb_holdings"] == 2  # FB and cash
+    assert [d["label"] for d in data["earnings"]["datasets"]] == [
+        "Earnings",
+        "S&P 500",
+    ]
+
+
+def test_report_history_before_holding(tmp_path, fixtures_dir):
+    # Prices of AAPL end before it is bought, they are inferred instead
+    (fixtures_dir / "AAPL.csv").write_text("date,price\n01/05/21,$15.00\n")
+    (tmp_path / "transactions.csv").write_text(
+        "date,action,name,ticker,isin,quantity,price,fees,amount\n"
+        '01/05/21,cash_in,,,,,,,"$1,000.00"\n'
+        "01/05/21,buy,,FB,,10,$10.00,,\n"
+        "03/05/21,buy,,AAPL,,2,$20.00,,\n"
+    )
+    (tmp_path / "project.yml").write_text(
+        "options:\n"
+        "    end_date: 05/05/21\n"
+        "    days: 3\n"
+        "    benchmarks: []\n"
+        "    price_providers:\n"
+        "        - fixtures: fixtures\n"
+        "transactions:\n"
+        "    - format: standard\n"
+        "      file: transactions.csv\n"
+    )
+
+    project = Project(config=str(tmp_path / "project.yml"))
+    data = project._get_report_data()
+
+    assert data["balances"]["datasets"][0]["data"][-1] == (
+        860 + 10 * 12.0 + 2 * 20.0
+    )
+
+
+def test_provider_identity(tmp_path, fixtures_dir):
+    cfg = Config(cfg="options:\n    title: test")
+    specs = ["csv", {"fixtures": str(fixtures_dir)}, "cache", "yahoo"]
+    path = str(tmp_path / "prices.db")
+    chain = make_provider(specs, cfg=cfg, fetcher=Fetcher(), cache_path=path)
+
+    # Chains built from the same specs give the same prices
+    other_cfg = Config(cfg="options:\n    title: other")
+    other = make_provider(specs, cfg=other_cfg, fetcher=Fetcher(), cache_path=path)
+    assert chain.get_identity() == other.get_identity()
+
+    other = make_provider(specs, cfg=cfg, fetcher=Fetcher())
+    assert chain.get_identity() != other.get_identity()
+    stubs = [StubProvider({}), StubProvider({})]
+    assert stubs[0].get_identity() != stubs[1].get_identity()
+
+
+def test_benchmarks(tmp_path):
+    (tmp_path / "index.csv").write_text(
+        "date,price\n01/06/21,$100\n02/06/21,$110\n04/06/21,$90\n"
+    )
+    cfg = Config(
+        cfg="options:\n"
+        "    benchmarks:\n"
+        "        - name: Index\n"
+        "          file: index.csv\n"
+        "        - name: Stub\n"
+        "          ticker: STUB\n"
+        "        - name: Missing\n"
+        "          ticker: MISSING\n",
+        path=str(tmp_path / "project.yml"),
+    )
+    stub = StubProvider(known={"STUB"})
+
+    for _ in range(2):
+        benchmarks = get_benchmarks(
+            cfg.benchmarks,
+            provider=stub,
+            start=datetime(2021, 6, 1, 12),
+            end=datetime(2021, 6, 5, 12),
+        )
+
+    # Benchmarks are computed once and tickers are requested all together
+    assert stub.requests == [["STUB", "MISSING"]]
+    assert list(benchmarks) == ["Index", "Stub"]
+    assert list(benchmarks["Index"].values) == [0.0, 10.0, 10.0, -10.0]
+
+    # Benchmarks computed with another provider aren't reused
+    other = StubProvider(known={"MISSING"})
+    benchmarks = get_benchmarks(
+        cfg.benchmarks,
+        provider=other,
+        start=datetime(2021, 6, 1, 12),
+        end=datetime(2021, 6, 5, 12),
+    )
+    assert list(benchmarks) == ["Index", "Missing"]
+
+    with pytest.raises(ValueError):
+        _ = Config(cfg="options:\n    benchmarks:\n        - name: X").benchmarks
@@ -0,0 +1,24 @@
+import os
+import pytest
+from currency_converter import CurrencyConverter
+from inverno.rates import get_daily_rates, load_ecb_rates
+
+# pylint: disable=missing-function-docstring
+
+
+def test_daily_rates(tmp_path):
+    rates = get_daily_rates("USD", cache_dir=str(tmp_path))
+    assert (rates["USD"] == 1.0).all()
+
+    cc = CurrencyConverter()
+    date = rates.index[-1].date()
+    assert rates.loc[rates.index[-1], "EUR"] == pytest.approx(
+        cc.convert(1, "USD", "EUR", date=date)
+    )
+
+    # Rates are cached and reused
+    assert os.listdir(tmp_path) == ["ecb_rates_v1.npz"]
+    assert load_ecb_rates(cache_dir=str(tmp_path)).equals(load_ecb_rates())
+
+    with pytest.raises(ValueError):
+        get_daily_rates("XXX")
@@ -0,0 +1,52 @@
+import pytest
+import pandas as pd
+from inverno.analysis import Analysis
+from inverno.columnar import TransactionColumns
+from inverno.price import Currency
+from inverno.registry import HoldingRegistry
+
+# pylint: disable=missing-function-docstring
+
+transactions_csv = """
+date,action,name,ticker,isin,quantity,price,fees,amount
+10/02/21,cash_in,,,,,,,"$4,000.00"
+12/02/21,buy,,FB,,4,$100.00,,
+13/02/21,dividends,,AAPL,,,,,$1.00
+14/02/21,buy,Apple,AAPL,,1,$100.00,,
+15/02/21,sell,,FB,,1,$100.00,,
+16/02/21,vest,My Fund,,,1,,,
+""".strip()
+
+
+def test_registry():
+    registry = HoldingRegistry(["A", "B", "A"])
+    assert registry.keys == ["A", "B"]
+    assert registry.add("C") == 2
+    assert registry.get_id("B") == 1
+    assert registry.get_id("D") is None
+    assert "C" in registry and "D" not in registry
+    assert list(registry.get_ids(["C", "D", None, "A"])) == [2, -1, -1, 0]
+    assert registry.get_key(1) == "B"
+
+
+def test_registry_from_columns():
+    columns = TransactionColumns.from_standard_csv(transactions_csv)
+    registry = HoldingRegistry.from_columns(columns)
+
+    # Dividends don't register holdings
+    assert registry.keys == ["FB", "AAPL", "My Fund"]
+    assert registry.first_rows == [1, 3, 5]
+
+
+def test_analysis_registry():
+    prices = pd.DataFrame(
+        {"A": [1.0, 2.0], "B": [3.0, 4.0]},
+        index=pd.date_range("2021-01-01", periods=2),
+    )
+    currencies = {"A": Currency.USD, "B": Currency.USD}
+
+    analysis = Analysis(prices, {"USD": 1.0}, currencies)
+    assert analysis.registry.keys == ["A", "B"]
+
+    with pytest.raises(ValueError):
+        Analysis(prices, {"USD": 1.0}, currencies, registry=HoldingRegistry("BA"))
@@ -0,0 +1,161 @@
+import os
+import random
+from datetime import datetime, timedelta
+import pytest
+from inverno.balance import Balance
+from inverno.config import Config
+from inverno.price import Currency, Price
+from inverno.timeline import BalanceTimeline
+from inverno.transaction import Transaction, TransactionAction
+
+# pylint: disable=missing-function-docstring
+
+
+def _random_transactions(rnd, n):
+    date = datetime(2014, 1, 1)
+    transactions = []
+    for _ in range(n):
+        date += timedelta(days=rnd.choice([0, 0, 1, 3]))
+        currency = rnd.choice([Currency.USD, Currency.EUR])
+        fees = Price(currency, 1.5) if rnd.random() < 0.3 else None
+        action = rnd.choice(
+            [
+                TransactionAction.BUY,
+                TransactionAction.SELL,
+                TransactionAction.CASH_IN,
+                TransactionAction.VEST,
+            ]
+        )
+        if action == TransactionAction.CASH_IN:
+            transactions.append(
+                Transaction(
+                    action=action,
+                    date=date,
+                    amount=Price(currency, rnd.uniform(1, 1000)),
+                    fees=fees,
+                )
+            )
+            continue
+
+        quantity = float(rnd.randrange(1, 10))
+        price = Price(currency, rnd.uniform(1, 100))
+        transactions.append(
+            Transaction(
+                action=action,
+                date=date,
+                ticker=f"T{rnd.randrange(20)}",
+                quantity=quantity,
+                price=price,
+                fees=fees,
+                amount=price * quantity,
+            )
+        )
+    return transactions
+
+
+def _as_dict(balance: Balance):
+    return (
+        balance.date,
+        {
+            key: (h.quantity, h.name, h.ticker, h.isin)
+            for key, h in balance.holdings.items()
+        },
+        dict(balance.cash.items()),
+    )
+
+
+@pytest.mark.parametrize("options", [{"every": 1}, {"every": 7}, {"monthly": True}])
+def test_balance_at(options):
+    transactions = _random_transactions(random.Random(0), 300)
+    timeline = BalanceTimeline.from_transactions(transactions, **options)
+    balances = Balance.get_balances(transactions)
+
+    assert timeline.balance_at(transactions[0].date - timedelta(days=1)) is None
+    for date, balance in balances.items():
+        assert _as_dict(timeline.balance_at(date)) == _as_dict(balance)
+
+    # Dates without transactions get the previous balance
+    date = transactions[150].date
+    while date in balances:
+        date -= timedelta(days=1)
+    previous = max(d for d in balances if d < date)
+    assert _as_dict(timeline.balance_at(date)) == _as_dict(balances[previous])
+
+
+@pytest.mark.parametrize("options", [{"every": 1}, {"every": 7}, {"monthly": True}])
+def test_timeline_extend(options):
+    transactions = _random_transactions(random.Random(2), 200)
+    expected = BalanceTimeline.from_transactions(transactions, **options)
+
+    timeline = BalanceTimeline.from_transactions(transactions[:90], **options)
+    timeline = timeline.extend(transactions[90:150]).extend(transactions[150:])
+    assert timeline.registry.keys == expected.registry.keys
+    assert timeline.currencies == expected.currencies
+    for name, values in expected.to_arrays().items():
+        assert (timeline.to_arrays()[name] == values).all(), name
+
+    with pytest.raises(ValueError, match="must be made after"):
+        timeline.extend(transactions[:1])
+
+
+def test_timeline_save(tmp_path):
+    transactions = _random_transactions(random.Random(1), 100)
+    timeline = BalanceTimeline.from_transactions(transactions, every=10)
+    path = str(tmp_path / "timeline.npz")
+    timeline.save(path, fingerprint="abc")
+
+    assert BalanceTimeline.load(path, fingerprint="def") is None
+    loaded = BalanceTimeline.load(path, fingerprint="abc")
+    assert (loaded.fingerprint, loaded.every) == ("abc", 10)
+    date = transactions[55].date
+    assert _as_dict(loaded.balance_at(date)) == _as_dict(timeline.balance_at(date))
+
+    assert BalanceTimeline.load(str(tmp_path / "missing.npz")) is None
+    assert BalanceTimeline.from_transactions([]).balance_at(date) is None
+
+
+def test_config_balance_timeline(tmp_path, monkeypatch):
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text(
+        "transactions:\n    - format: standard\n      file: transactions.csv\n"
+    )
+    trs_path = tmp_path / "transactions.csv"
+    trs_path.write_text(
+        "date,action,name,ticker,isin,quantity,price,fees,amount\n"
+        '10/02/21,cash_in,,,,,,,"$4,000.00"\n'
+        "12/02/21,buy,,FB,,4,$100.00,,\n"
+    )
+
+    timeline = Config.from_file(path=str(cfg_path)).balance_timeline
+    balance = timeline.balance_at(datetime(2021, 2, 11))
+    assert balance.get_cash_balance(Currency.USD) == 4000.0
+    assert not balance.holdings
+
+    # Reused as long as transactions don't change
+    cfg = Config.from_file(path=str(cfg_path))
+    assert os.path.exists(cfg._get_timeline_path())
+    assert len(cfg.balance_timeline) == 2
+
+    # Configs sharing the cache directory don't overwrite each other's
+    other_path = tmp_path / "other.yml"
+    other_path.write_text(cfg_path.read_text())
+    other = Config.from_file(path=str(other_path))
+    assert other._get_timeline_path() != cfg._get_timeline_path()
+    assert len(other.balance_timeline) == 2
+    saved = BalanceTimeline.load(cfg._get_timeline_path())
+    assert saved.fingerprint == cfg.transactions_columns.get_digest()
+
+    # Appended transactions are added to the saved timeline
+    with open(trs_path, "a") as fd:
+        fd.write("14/02/21,sell,,FB,,1,$100.00,,\n")
+    with monkeypatch.context() as patch:
+        patch.setattr(BalanceTimeline, "from_transactions", None)
+        timeline = Config.from_file(path=str(cfg_path)).balance_timeline
+    assert timeline.balance_at(datetime(2021, 3, 1)).holdings["FB"].quantity == 3
+    assert len(BalanceTimeline.load(cfg._get_timeline_path())) == 3
+
+    # Otherwise the timeline is built again
+    trs_path.write_text(trs_path.read_text().replace("$4,000.00", "$5,000.00"))
+    timeline = Config.from_file(path=str(cfg_path)).balance_timeline
+    balance = timeline.balance_at(datetime(2021, 3, 1))
+    assert balance.get_cash_balance(Currency.USD) == 4700.0
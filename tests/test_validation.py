@@ -0,0 +1,147 @@
+from datetime import datetime
+import pytest
+from inverno.columnar import TransactionColumns
+from inverno.config import Config
+from inverno.price import Currency, Price
+from inverno.transaction import Transaction, TransactionAction
+from inverno.validation import TransactionsError, TransactionsValidator
+
+# pylint: disable=missing-function-docstring
+
+header = "date,action,name,ticker,isin,quantity,price,fees,amount\n"
+
+valid_csv = header + (
+    "10/02/21,buy,,FB,,4,$100.00,$1.50,\n"
+    "11/02/21,sell,,FB,,2,,,$300.00\n"
+    "12/02/21,buy,,FB,,,$10.00,,\n"
+    "13/02/21,cash_in,,,,,,$1.00,$50.00\n"
+)
+
+invalid_csv = header + (
+    "10/02/21,buy,,FB,,0,$100.00,,\n"
+    "11/02/21,cash_in,,,,,,,$10.00\n"
+    "12/02/21,buy,,,,1,$100.00,,\n"
+    "13/02/21,sell,,FB,,1,,,\n"
+    "14/02/21,buy,,FB,,1,$1.00,£1.00,\n"
+    "15/02/21,dividends,,FB,,,,,\n"
+    "16/02/21,buy,,FB,,1,$1.00,$2.00,\n"
+)
+
+
+def test_validate_infers_fields():
+    validator = TransactionsValidator()
+    columns = TransactionColumns.from_standard_csv(valid_csv)
+    transactions = validator.validate(columns, source="valid.csv").to_transactions()
+    assert not validator.errors
+
+    date = datetime(2021, 2, 10)
+    assert transactions[0].amount == Price(Currency.USD, 398.5)
+    assert transactions[1].price == Price(Currency.USD, 150.0)
+    assert transactions[2].quantity == 1.0
+    assert transactions[2].amount == Price(Currency.USD, 10.0)
+
+    # Same fields as inferred by Transaction
+    assert transactions[0] == Transaction(
+        action=TransactionAction.BUY,
+        date=date,
+        ticker="FB",
+        quantity=4,
+        price=Price(Currency.USD, 100.0),
+        fees=Price(Currency.USD, 1.5),
+    )
+    assert columns.to_transactions() == transactions
+
+
+def test_validated_rows_are_not_checked_again(monkeypatch):
+    validator = TransactionsValidator()
+    columns = TransactionColumns.from_standard_csv(valid_csv)
+    validated = validator.validate(columns, source="valid.csv")
+    assert validated.validated and not columns.validated
+    assert validated.take([0, 1]).validated
+    expected = validated.to_transactions()
+
+    def _check(_):
+        raise AssertionError("Validated rows were checked again")
+
+    monkeypatch.setattr(Transaction, "_check_constraints", _check)
+    assert validated.to_transactions() == expected
+    with pytest.raises(AssertionError):
+        columns.to_transactions()
+
+    # Columns with errors aren't validated
+    invalid = TransactionColumns.from_standard_csv(invalid_csv)
+    assert not validator.validate(invalid, source="invalid.csv").validated
+
+
+def test_validate_reports_all_errors():
+    validator = TransactionsValidator()
+    validator.validate(
+        TransactionColumns.from_standard_csv(invalid_csv), source="a.csv"
+    )
+    validator.validate(
+        TransactionColumns.from_standard_csv(header + "10/02/21,vest,,FB,,,,,\n"),
+        source="b.csv",
+    )
+
+    assert [(source, row) for source, row, _ in validator.errors] == [
+        ("a.csv", 1),
+        ("a.csv", 3),
+        ("a.csv", 4),
+        ("a.csv", 5),
+        ("a.csv", 6),
+        ("a.csv", 7),
+        ("b.csv", 1),
+    ]
+    with pytest.raises(TransactionsError) as error:
+        validator.check()
+    assert "Found 7 invalid transaction(s)" in str(error.value)
+    assert "a.csv, row 1: Quantity must be > 0" in str(error.value)
+    assert "a.csv, row 5: Currency of price, fees and amount" in str(error.value)
+    assert "b.csv, row 1: Quantity must be set for vest" in str(error.value)
+
+
+def test_config_reports_all_files(tmp_path):
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text(
+        "transactions:\n"
+        "    - format: standard\n      file: a.csv\n"
+        "    - format: standard\n      file: b.csv\n"
+    )
+    (tmp_path / "a.csv").write_text(invalid_csv)
+    (tmp_path / "b.csv").write_text(header + "10/02/21,tax,,,,,,,\n")
+
+    cfg = Config.from_file(path=str(cfg_path))
+    with pytest.raises(TransactionsError, match="b.csv, row 1: Amount must be set"):
+        cfg.transactions  # pylint: disable=pointless-statement
+
+
+def test_config_reports_schwab_errors(tmp_path):
+    cfg_path = tmp_path / "project.yml"
+    cfg_path.write_text(
+        "transactions:\n    - format: schwab\n      file: schwab.csv\n"
+    )
+    (tmp_path / "schwab.csv").write_text(
+        '"Transactions for account XXXX-1234"\n'
+        '"Date","Action","Symbol","Description","Quantity","Price","Fees & Comm",'
+        '"Amount",\n'
+        '"05/20/2021","Buy","FB","FACEBOOK INC","0","$300.00","","",\n'
+        '"05/21/2021","Stock Plan Activity","FB","FACEBOOK INC","","","","",\n'
+        'Transactions Total,"","","","","","","",\n'
+    )
+
+    cfg = Config.from_file(path=str(cfg_path))
+    with pytest.raises(TransactionsError) as error:
+        cfg.transactions  # pylint: disable=pointless-statement
+    assert [row for _, row, _ in error.value.errors] == [1, 2]
+
+
+def test_transaction_infers_amount_with_fees():
+    trs = Transaction(
+        action=TransactionAction.BUY,
+        date=datetime(2021, 2, 10),
+        ticker="FB",
+        quantity=2,
+        price=Price(Currency.USD, 10.0),
+        fees=Price(Currency.USD, 1.0),
+    )
+    assert trs.amount == Price(Currency.USD, 19.0)